@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+import dotenv
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common import distill, hedging, lazy, service, snippets, tracing, triage, typosquat, usage, vectorstores
+
+dotenv.load_dotenv()
+
+# The LLM clients are built on their first call, so importing grading.py before the options are read is fine
+import grading
+
+parser = argparse.ArgumentParser(description="HTTP service classifying packages with the CRAG or Simple_RAG flow.")
+parser.add_argument("--flow", choices=["crag", "simple"], default="crag",
+                    help="crag grades the retrieved YARA rules and advisories before classifying; simple classifies with the top documents of --collection.")
+parser.add_argument("--collection", type=str, default="malware.yara_rules2", help="Knowledge-base collection of the simple flow.")
+parser.add_argument("--k", type=int, default=None, help="Documents retrieved per collection (default: 4 for crag, 2 for simple).")
+parser.add_argument("--check", type=str, default=None, metavar="SETUP_PY",
+                    help="Classify this setup.py once, print the verdict and exit instead of serving.")
+parser.add_argument("--package_name", type=str, default=None, help="--check: package name (default: the directory of SETUP_PY).")
+parser.add_argument("--file_list", nargs="*", default=None, help="--check: files of the package (default: the files next to SETUP_PY).")
+service.add_arguments(parser)
+hedging.add_arguments(parser)
+tracing.add_arguments(parser)
+usage.add_arguments(parser)
+vectorstores.add_arguments(parser)
+typosquat.add_arguments(parser)
+triage.add_arguments(parser)
+snippets.add_arguments(parser)
+grading.add_arguments(parser)
+distill.add_arguments(parser)
+args = parser.parse_args()
+hedging.configure_from_args(args)
+tracing.configure_from_args(args)
+usage.configure_from_args(args)
+vectorstores.configure_from_args(args)
+typosquat.configure_from_args(args)
+triage.configure_from_args(args)
+snippets.configure_from_args(args)
+grading.configure_from_args(args)
+distill.configure_from_args(args)
+if args.local:
+    vectorstores.VECTORSTORE_BACKEND = "local"
+    os.environ.setdefault("LLAMA_MODEL", "local-stand-in")
+
+import classify_package as classify_package
+import retrieval_evaluator as ret_eval
+import retrieval_relevance_level as ret_rel_level
+
+if args.local:
+    # The CRAG modules call their module-level clients, so swapping those is enough
+    classify_package.llm = ret_eval.llm = ret_rel_level.llm = service.LocalChatClient()
+
+COLLECTIONS = {"yara": "malware.yara_rules2", "git": "github_advisories"}
+K = args.k or (4 if args.flow == "crag" else 2)
+
+
+def head(text: str) -> str:
+    # Same cut as main_crag_code_flow.py
+    return f"first 300 bytes:{text[:300]}  \nlast 300 bytes:{text[-300:]}" if len(text) > 600 else text
+
+
+class ClassificationService:
+    """
+    Keeps the embedding client, the vector stores, the LLM clients and a verdict cache warm between requests.
+    Concurrent requests share their embedding calls and vector searches through micro-batches.
+    """
+
+    def __init__(self):
+        if vectorstores.VECTORSTORE_BACKEND == "local":
+            # The local store embeds its documents with the hashing embeddings, so queries must use them too
+            self.embeddings = vectorstores.HashingEmbeddings()
+        else:
+            self.embeddings = lazy.openai_embeddings().get()
+        names = COLLECTIONS if args.flow == "crag" else {"simple": args.collection}
+        started = time.perf_counter()
+        self.stores = {key: vectorstores.get_vectorstore(name, self.embeddings) for key, name in names.items()}
+        print(f"📂 Loaded {', '.join(names.values())} in {time.perf_counter() - started:.1f}s")
+        self.embedder = service.MicroBatcher("embed", self.embeddings.embed_documents, args.max_batch, args.max_wait_ms)
+        self.searchers = {
+            key: service.MicroBatcher(f"search:{names[key]}", lambda vectors, store=store: service.search_vectors(store, vectors, K),
+                                      args.max_batch, args.max_wait_ms)
+            for key, store in self.stores.items()
+        }
+        self.cache = service.VerdictCache(args.cache_size)
+        self.slots = asyncio.Semaphore(args.max_concurrency)
+        self.metrics = service.Metrics()
+
+    async def context(self, code_snippet: str) -> str:
+        with tracing.span("embed"):
+            vector = await self.embedder.submit(code_snippet)
+        with tracing.span("retrieve", collections=len(self.searchers)):
+            documents = dict(zip(self.searchers, await asyncio.gather(*(searcher.submit(vector) for searcher in self.searchers.values()))))
+        if args.flow == "simple":
+            return "\n\n".join(doc.page_content for doc, _ in documents["simple"])
+        return await grading.build_context(code_snippet, {COLLECTIONS[key]: documents[key] for key in COLLECTIONS})
+
+    async def classify(self, payload) -> dict:
+        """
+        POST /classify with {"package_name", "setup.py", "file_list"}.
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get("package_name"), str):
+            raise service.HTTPError(400, 'expected a JSON object with "package_name", "setup.py" and "file_list"')
+        setup_py = payload.get("setup.py", payload.get("code_snippet"))
+        if not isinstance(setup_py, str) or not setup_py:
+            raise service.HTTPError(400, '"setup.py" must be a non-empty string')
+        package_name, file_list = payload["package_name"], payload.get("file_list") or []
+        if triage.enabled():
+            start = time.perf_counter()
+            verdict, probability = triage.decide(package_name, setup_py, file_list)
+            if verdict is not None:
+                return {"package_name": package_name, "prediction": verdict, "explanation": triage.explanation(probability),
+                        "flow": "triage", "cached": False, "seconds": round(time.perf_counter() - start, 3)}
+        code_snippet = snippets.select_text(setup_py, head)
+        key = self.cache.key(args.flow, package_name, code_snippet, file_list)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True, seconds=0.0)
+        start = time.perf_counter()
+        async with self.slots:
+            with tracing.span("package", package_name=package_name), usage.package(package_name):
+                context = await self.context(code_snippet)
+                with tracing.span("classify"):
+                    _, prediction, explanation = await classify_package.classify(
+                        package_name=package_name, code_snippet=code_snippet, contexts=context, file_list=file_list)
+        result = {"package_name": package_name, "prediction": prediction, "explanation": explanation, "flow": args.flow}
+        self.cache.put(key, result)
+        return dict(result, cached=False, seconds=round(time.perf_counter() - start, 3))
+
+    async def health(self, payload) -> dict:
+        return {
+            "status": "ok",
+            "flow": args.flow,
+            "local": args.local,
+            "collections": {store.collection_name if hasattr(store, "collection_name") else key: len(getattr(store, "documents", ()))
+                            for key, store in self.stores.items()},
+            "in_flight": self.metrics.in_flight,
+            "uptime_seconds": round(time.time() - self.metrics.started, 1),
+        }
+
+    async def render_metrics(self, payload) -> str:
+        return self.metrics.render([self.embedder, *self.searchers.values()], self.cache,
+                                   {"cached_verdicts": len(self.cache.entries)})
+
+    def routes(self) -> dict:
+        return {
+            ("POST", "/classify"): self.classify,
+            ("GET", "/healthz"): self.health,
+            ("GET", "/metrics"): self.render_metrics,
+        }
+
+
+async def check(classifier: ClassificationService):
+    """
+    One package from the command line: what `POST /classify` would answer.
+    """
+    path = Path(args.check)
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        setup_py = file.read()
+    file_list = args.file_list if args.file_list is not None else sorted(p.name for p in path.parent.iterdir() if p.is_file())
+    result = await classifier.classify({"package_name": args.package_name or path.resolve().parent.name,
+                                        "setup.py": setup_py, "file_list": file_list})
+    print(json.dumps(result, indent=4, ensure_ascii=False, default=str))
+
+
+async def main():
+    classifier = ClassificationService()
+    if args.check:
+        await check(classifier)
+        grading.print_summary()
+        distill.print_summary()
+        triage.print_summary()
+        usage.print_summary()
+        return
+    # Build the typosquat index before the first request instead of during it
+    typosquat.hint("warm-up")
+    server = service.HTTPService(classifier.routes(), classifier.metrics)
+    await server.start(args.host, args.port)
+    print(f"🚀 Serving the {args.flow} flow on http://{args.host}:{server.port} (POST /classify, GET /healthz, GET /metrics)")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+        grading.print_summary()
+        distill.print_summary()
+        triage.print_summary()
+        tracing.print_summary()
+        usage.print_summary()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,14 @@
 import os
 import dotenv
 import asyncio
+import sys
+from pathlib import Path
 import aiofiles
 import csv
 import json
-import re
-from langchain_core.prompts import ChatPromptTemplate
-from pydantic import BaseModel, Field
-from langchain_huggingface import HuggingFaceEndpoint
-from huggingface_hub import AsyncInferenceClient
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common import explanations, lazy, prompts, structured, typosquat, usage
 
 dotenv.load_dotenv()
 
@@ -26,74 +26,48 @@ response_schema = {
     },
 }
 
-# Initialize the LLM with correct parameters
-llm = AsyncInferenceClient(api_key=os.getenv("HUGGING_FACE_KEY"))
+VERDICT_SCHEMA = explanations.verdict_only_format(response_schema)
+
+# Initialize the LLM with correct parameters (on the first call, so importing this module stays fast)
+llm = lazy.hugging_face_client()
+
+
+# System instruction for the model, kept free of per-package data so every call shares the same prefix
+CLASSIFY_PROMPT = prompts.PromptTemplate("crag_classify", [
+    {"role": "developer",
+     "content": "You are a cybersecurity expert analyzing potential malware in Python packages. "
+                "Your task is to determine if a package is malicious or benign based on the YARA rule context.\n\n"
+                "Use the following YARA rule context to verify if the snippet from `setup.py` "
+                "can cause the entire package to be detected as malicious. "
+                "if no context is provided default to your internal knowledge.\n\n"
+                "**If you don't know the answer, just say that you don't know.**"},
+])
 
 
 async def get_prompt(context: str, code_snippet: str,package_name:str,file_list) -> str:
-    """Generates a prompt for the LLM to grade the relevance of a document to a code snippet."""
- 
-    # System instruction for the model
-    SYS_PROMPT = f"""You are a cybersecurity expert analyzing potential malware in Python packages. "
-                       "Your task is to determine if a package is malicious or benign based on the YARA rule context.
-                       
-                       The Python package **{package_name}** contains the following files:\n"
-                       f"{json.dumps(file_list, ensure_ascii=False, indent=2)}\n\n"
-                       "Use the following YARA rule context to verify if the snippet from `setup.py` "
-                       "can cause the entire package to be detected as malicious. "
-                       "if no context is provided default to your internal knowledge.\n\n"
-                       "**If you don't know the answer, just say that you don't know.**
-                       """
-    prompt =[
-        {"role": "developer", 
-         "content": SYS_PROMPT},
+    """Generates a prompt for the LLM to classify a package from a code snippet and its context."""
+    return CLASSIFY_PROMPT.render(
+        {"role": "user",
+            "content": f"The Python package **{package_name}** contains the following files:\n{prompts.compact_json(file_list)}{typosquat.hint(package_name)}"
+            },
         {"role": "user",
             "content": f"code snippet:\n{code_snippet}"
             },
-         {"role": "user",
+        {"role": "user",
             "content": f"context:\n{context}"
             },
-        
-    ]
-    return prompt
-
-
-async def extract_llm_output(raw_text: str):
-    """Attempts to extract filename, prediction, and a truncated explanation from a malformed JSON response."""
-    
-    # ✅ Try to find the filename
-    filename_match = re.search(r'"package_name"\s*:\s*"([^"]+)"', raw_text)
-    filename = filename_match.group(1) if filename_match else "Unknown"
-
-    # ✅ Try to find the prediction (true/false)
-    prediction_match = re.search(r'"prediction"\s*:\s*(true|false)', raw_text, re.IGNORECASE)
-    prediction = prediction_match.group(1).lower() == "true" if prediction_match else False
+    )
 
-    # ✅ Try to find the explanation
-    explanation_match = re.search(r'"explanation"\s*:\s*"([^"]+)"', raw_text, re.DOTALL)
-    explanation = explanation_match.group(1) if explanation_match else ""
 
-    # ✅ Truncate explanation to the first 2 sentences
-    sentences = re.split(r'(?<=[.!?])\s+', explanation)  # Split by sentence boundaries
-    truncated_explanation = " ".join(sentences[:2])  # Keep first 2 sentences
-
-    return {
-        "prediction": prediction,
-        "explanation": truncated_explanation
-    }
-
-
-
-    
-async def classify(package_name:str, code_snippet: str, contexts: str, file_list) -> list:
+async def classify(package_name:str, code_snippet: str, contexts: str, file_list, stage="classify") -> list:
     """classifies if a package is malicious or benign based on the YARA rule context."""
 
 
     messages = await get_prompt(context=contexts, code_snippet=code_snippet,package_name=package_name,file_list=file_list)
         
         # Generate response from LLM
-    stream = await llm.chat_completion(messages=messages, model=os.getenv('LLAMA_MODEL'), max_tokens=512,
-                                             response_format=response_schema)
+    stream = await usage.metered_call(stage, os.getenv('LLAMA_MODEL'), messages, 512, lambda messages, model: llm.chat_completion(
+            messages=messages, model=model, max_tokens=512, response_format=response_schema))
 
     response = stream.choices[0].message.content
     try:
@@ -105,9 +79,25 @@ async def classify(package_name:str, code_snippet: str, contexts: str, file_list
         
     except json.JSONDecodeError:
         print(f"❌ JSON Decode Error for {package_name}")
-        formated_output = await extract_llm_output(response)
+        formated_output = structured.extract_llm_output(response)
         return package_name, formated_output['prediction'], formated_output['explanation']
 
+async def classify_verdict(package_name:str, code_snippet: str, contexts: str, file_list):
+    """Asks for the prediction only, with a verdict-only schema and a small max_tokens."""
+    messages = await get_prompt(context=contexts, code_snippet=code_snippet,package_name=package_name,file_list=file_list)
+    max_tokens = explanations.verdict_max_tokens()
+    response = await usage.metered_call("classify", os.getenv('LLAMA_MODEL'), messages, max_tokens, lambda messages, model: llm.chat_completion(
+            messages=messages, model=model, max_tokens=max_tokens, response_format=VERDICT_SCHEMA))
+    return structured.parse(response.choices[0].message.content).get("prediction")
+
+
+async def classify_stream(package_name:str, code_snippet: str, contexts: str, file_list) -> structured.StructuredStream:
+    """Streams the classification and returns as soon as the prediction is decoded."""
+    messages = await get_prompt(context=contexts, code_snippet=code_snippet,package_name=package_name,file_list=file_list)
+    return await usage.metered_stream("classify", os.getenv('LLAMA_MODEL'), messages, 512, lambda messages, model: llm.chat_completion(
+            messages=messages, model=model, max_tokens=512, response_format=response_schema, stream=True))
+
+
 async def write_to_csv_async(file_path, data, header=['package_name', 'label', 'llm_prediction', 'explanation']):
     """
     Asynchronously appends a row of data to a CSV file.
@@ -0,0 +1,154 @@
+import sys
+import asyncio
+import statistics
+from pathlib import Path
+
+import retrieval_evaluator as ret_eval
+import retrieval_relevance_level as ret_rel_level
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common import tracing
+
+NO_CONTEXT = "No relevant context found"
+
+# Heading of each collection's documents in the context given to the classifier
+HEADINGS = {"malware.yara_rules2": "YARA rules", "github_advisories": "Git advisories"}
+
+# Lazy grading: documents farther than this cosine distance from the snippet are dropped without an LLM call,
+# and a collection's grading stops once this many high-relevance documents are found.
+MAX_DISTANCE = 0.5
+ENOUGH_HIGH = 1
+
+
+class GradingConfig:
+    """
+    Whether the documents are graded lazily, and what grading cost and found across the run.
+    """
+
+    def __init__(self, lazy: bool = False, max_distance: float = MAX_DISTANCE, enough_high: int = ENOUGH_HIGH):
+        self.lazy = lazy
+        self.max_distance = max_distance
+        self.enough_high = enough_high
+        self.stats = {"collections": 0, "documents": 0, "graded": 0, "too_far": 0, "not_needed": 0, "calls": 0}
+        # Distances of the graded documents by grade, to choose --max_distance from an eager run
+        self.distances = {"yes": [], "no": []}
+
+
+_config = GradingConfig()
+
+
+def search(vectorstore, code_snippet: str, k: int) -> list:
+    """
+    Top-k (document, distance) pairs of a collection, best first; the distance is None if the store has no scores.
+    """
+    if hasattr(vectorstore, "similarity_search_with_score"):
+        return vectorstore.similarity_search_with_score(code_snippet, k=k)
+    return [(doc, None) for doc in vectorstore.similarity_search(code_snippet, k=k)]
+
+
+def _record(distance, grade: str):
+    _config.stats["graded"] += 1
+    if distance is not None:
+        _config.distances[grade].append(distance)
+
+
+async def grade_documents(code_snippet: str, documents: list, collection: str = None) -> str:
+    """
+    The corrective step on (document, distance) pairs: keeps the documents graded relevant to the snippet, then
+    those of high or medium relevance.
+    """
+    _config.stats["collections"] += 1
+    _config.stats["documents"] += len(documents)
+    if _config.lazy:
+        return await grade_lazily(code_snippet, documents, collection)
+    with tracing.span("grade", collection=collection, documents=len(documents)):
+        grades = await ret_eval.evaluate_documents(documents=[doc.page_content for doc, _ in documents], code_snippet=code_snippet)
+    _config.stats["calls"] += len(documents)
+    for (_, distance), grade in zip(documents, grades):
+        _record(distance, grade)
+    chosen = [doc for (doc, _), grade in zip(documents, grades) if grade == "yes"]
+    if not chosen:
+        return NO_CONTEXT
+    with tracing.span("relevance", collection=collection, documents=len(chosen)):
+        levels = await ret_rel_level.evaluate_documents(code_snippet=code_snippet, documents=[doc.page_content for doc in chosen])
+    _config.stats["calls"] += len(chosen)
+    contexts = [doc.page_content for doc, level in zip(chosen, levels) if level in ["high", "medium"]]
+    return " \n".join(contexts) if contexts else NO_CONTEXT
+
+
+async def grade_lazily(code_snippet: str, documents: list, collection: str = None) -> str:
+    """
+    Grades the documents one at a time in rank order, skipping those beyond `--max_distance`, and stops once
+    `--enough_high` documents of high relevance are found. The documents kept are the same kind as in the eager
+    grading (relevant, then of high or medium relevance), only fewer of them are looked at.
+    """
+    contexts, high = [], 0
+    for rank, (doc, distance) in enumerate(documents):
+        if high >= _config.enough_high:
+            _config.stats["not_needed"] += len(documents) - rank
+            break
+        if distance is not None and distance > _config.max_distance:
+            _config.stats["too_far"] += 1
+            continue
+        with tracing.span("grade", collection=collection, rank=rank):
+            grade = await ret_eval.grade_document(code_snippet, doc.page_content)
+        _config.stats["calls"] += 1
+        _record(distance, grade)
+        if grade != "yes":
+            continue
+        with tracing.span("relevance", collection=collection, rank=rank):
+            level = await ret_rel_level.evaluate_document(code_snippet, doc.page_content)
+        _config.stats["calls"] += 1
+        if level in ["high", "medium"]:
+            contexts.append(doc.page_content)
+        high += level == "high"
+    return " \n".join(contexts) if contexts else NO_CONTEXT
+
+
+async def build_context(code_snippet: str, documents: dict) -> str:
+    """
+    Grades the documents retrieved from each collection ({collection: [(document, distance)]}) at the same time
+    and joins what is left under the collections' headings, e.g. "YARA rules: \n... \nGit advisories: \n...".
+    """
+    collections = list(documents)
+    contexts = await asyncio.gather(*(grade_documents(code_snippet, documents[collection], collection) for collection in collections))
+    parts = [f"{HEADINGS.get(collection, collection)}: \n{context}"
+             for collection, context in zip(collections, contexts) if context != NO_CONTEXT]
+    return " \n".join(parts) if parts else NO_CONTEXT
+
+
+def print_summary():
+    stats = _config.stats
+    if not stats["collections"]:
+        return
+    mode = f"lazy (max distance {_config.max_distance}, {_config.enough_high} high enough)" if _config.lazy else "eager"
+    print(f"Grading {mode}: {stats['documents']} documents retrieved for {stats['collections']} collection searches, "
+          f"{stats['graded']} graded, {stats['too_far']} too far, {stats['not_needed']} not needed; "
+          f"{stats['calls'] / stats['collections']:.1f} grader calls per search")
+    for grade in ("yes", "no"):
+        distances = _config.distances[grade]
+        if distances:
+            print(f"  distance of the documents graded '{grade}': median {statistics.median(distances):.3f}, "
+                  f"max {max(distances):.3f} ({len(distances)} documents)")
+
+
+def add_arguments(parser):
+    """
+    Adds the lazy grading options to a CRAG runner's argument parser.
+    """
+    parser.add_argument("--lazy_grading", action="store_true",
+                        help="Grade the retrieved documents in rank order, skip distant ones and stop at --enough_high high-relevance documents.")
+    parser.add_argument("--max_distance", type=float, default=MAX_DISTANCE,
+                        help="Lazy grading: cosine distance above which a document is dropped without an LLM call.")
+    parser.add_argument("--enough_high", type=int, default=ENOUGH_HIGH,
+                        help="Lazy grading: high-relevance documents after which a collection's grading stops.")
+
+
+def configure(lazy: bool = False, max_distance: float = MAX_DISTANCE, enough_high: int = ENOUGH_HIGH) -> GradingConfig:
+    global _config
+    _config = GradingConfig(lazy=lazy, max_distance=max_distance, enough_high=enough_high)
+    return _config
+
+
+def configure_from_args(args) -> GradingConfig:
+    return configure(lazy=args.lazy_grading, max_distance=args.max_distance, enough_high=args.enough_high)
@@ -1,13 +1,12 @@
 import os
 import dotenv
 import asyncio
+import sys
+from pathlib import Path
 import re
-from langchain_core.prompts import ChatPromptTemplate
-from pydantic import BaseModel, Field
-from huggingface_hub import InferenceClient
-from langchain_huggingface import HuggingFaceEndpoint
-from huggingface_hub import AsyncInferenceClient
-from langchain_core.messages import SystemMessage, HumanMessage
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common import distill, lazy, prompts, usage
 
 dotenv.load_dotenv()
 
@@ -22,57 +21,68 @@ response_schema = {
     },
 }
 
-# Initialize the LLM with correct parameters
-llm = AsyncInferenceClient(api_key=os.getenv("HUGGING_FACE_KEY"))
+# Initialize the LLM with correct parameters (on the first call, so importing this module stays fast)
+llm = lazy.hugging_face_client()
 
 
-async def get_prompt(context: str, code_snippet: str) -> str:
-    """Generates a prompt for the LLM to grade the relevance of a document to a code snippet."""
- 
-    # System instruction for the model
-    SYS_PROMPT = """You are an expert grader assessing the relevance of a retrieved document to a code snippet.
+# System instruction for the model
+SYS_PROMPT = """You are an expert grader assessing the relevance of a retrieved document to a code snippet.
     Follow these instructions for grading:
     - If the YARA rules or git advisory explained by the context are relevant to the code snippet, grade it as relevant.
     - Your grade should be either 'yes' or 'no' to indicate whether the document is relevant to the code snippet or not.
     - Provide only 'yes' or 'no' as your final response without additional explanations."""
-    prompt =[
-        {"role": "developer", 
-         "content": SYS_PROMPT},
+GRADE_PROMPT = prompts.PromptTemplate("crag_grade", [{"role": "developer", "content": SYS_PROMPT}])
+
+
+async def get_prompt(context: str, code_snippet: str) -> str:
+    """Generates a prompt for the LLM to grade the relevance of a document to a code snippet."""
+    # The snippet is shared by every document of a package, so it goes before the document
+    return GRADE_PROMPT.render(
         {"role": "user",
             "content": f"code snippet:\n{code_snippet}"
             },
-         {"role": "user",
+        {"role": "user",
             "content": f"context:\n{context}"
             },
-        
-    ]
-    return prompt
+    )
 
 
 
-def extract_yes_no(response: str) -> str:
-    """Extracts 'yes' or 'no' from the LLM response."""
+def extract_yes_no(response: str, default="no") -> str:
+    """Extracts 'yes' or 'no' from the LLM response, or `default` when it has neither."""
     match = re.search(r'\b(yes|no)\b', response, re.IGNORECASE)
-    return match.group(0).lower() if match else "no"  # Default to 'no' if unclear
+    return match.group(0).lower() if match else default  # Default to 'no' if unclear
+
+async def grade_document(code_snippet: str, document: str) -> str:
+    """Grades the relevance of one document to the given code snippet: 'yes' or 'no'."""
+    # The local grader answers the pairs it is confident about without a round-trip
+    local = distill.local_grade("grade", code_snippet, document)
+    if local is not None:
+        return local
+
+    # Format the prompt as a list of messages
+    messages = await get_prompt(document, code_snippet)
+
+    # Generate response from LLM
+    stream = await usage.metered_call("grade", os.getenv('LLAMA_MODEL'), messages, 64, lambda messages, model: llm.chat_completion(
+        messages=messages, model=model, max_tokens=64, response_format=response_schema))
+
+    response = stream.choices[0].message.content
+
+    # Extract 'yes' or 'no' from the response
+    grade = extract_yes_no(response, default=None)
+    if grade is None:
+        # Unparsed answers fall back to 'no', which is not a label the local grader should learn
+        return "no"
+    distill.record("grade", code_snippet, document, grade)
+    return grade
 
 async def evaluate_documents(code_snippet: str, documents: list) -> list:
     """Grades the relevance of each document to the given code snippet."""
     grades = []
-    
-    for doc in documents:
-        # Format the prompt as a list of messages
-        messages = await get_prompt(doc, code_snippet)
-        
-        # Generate response from LLM
-        stream = await llm.chat_completion(messages=messages, model=os.getenv('LLAMA_MODEL'), max_tokens=64,
-                                             response_format=response_schema)
-
-        response = stream.choices[0].message.content
 
-
-        # Extract 'yes' or 'no' from the response
-        final_grade = extract_yes_no(response)
-        grades.append(final_grade)
+    for doc in documents:
+        grades.append(await grade_document(code_snippet, doc))
 
     return grades
 
@@ -1,13 +1,12 @@
 import os
 import dotenv
 import asyncio
+import sys
+from pathlib import Path
 import re
-from langchain_core.prompts import ChatPromptTemplate
-from pydantic import BaseModel, Field
-from huggingface_hub import InferenceClient
-from langchain_huggingface import HuggingFaceEndpoint
-from huggingface_hub import AsyncInferenceClient
-from langchain_core.messages import SystemMessage, HumanMessage
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common import distill, lazy, prompts, usage
 
 dotenv.load_dotenv()
 
@@ -22,56 +21,65 @@ response_schema = {
     },
 }
 
-# Initialize the LLM with correct parameters
-llm = AsyncInferenceClient(api_key=os.getenv("HUGGING_FACE_KEY"))
+# Initialize the LLM with correct parameters (on the first call, so importing this module stays fast)
+llm = lazy.hugging_face_client()
 
 
-async def get_prompt(context: str, code_snippet: str) -> str:
-    """Generates a prompt for the LLM to grade the relevance of a document to a code snippet."""
- 
-    # System instruction for the model
-    SYS_PROMPT = """You are an expert grader assessing the level of relevance of a retrieved document to a code snippet.
+# System instruction for the model
+SYS_PROMPT = """You are an expert grader assessing the level of relevance of a retrieved document to a code snippet.
     Follow these instructions for grading:
     - If the YARA rules or git advisory explained by the context are really significant or explains the code snippet, set level as high, 
     else judge it as low or medium.
     - Your grade should be either 'high' or 'low' or 'medium' to indicate the level of the relevance  to the code snippet or not.
     - Provide only 'high' or 'low' or 'medium' as your final response without additional explanations."""
-    prompt =[
-        {"role": "developer", 
-         "content": SYS_PROMPT},
+GRADE_PROMPT = prompts.PromptTemplate("crag_relevance", [{"role": "developer", "content": SYS_PROMPT}])
+
+
+async def get_prompt(context: str, code_snippet: str) -> str:
+    """Generates a prompt for the LLM to grade the relevance of a document to a code snippet."""
+    # The snippet is shared by every document of a package, so it goes before the document
+    return GRADE_PROMPT.render(
         {"role": "user",
             "content": f"code snippet:\n{code_snippet}"
             },
-         {"role": "user",
+        {"role": "user",
             "content": f"context:\n{context}"
             },
-        
-    ]
-    return prompt
+    )
 
 
 
-def extract_level(response: str) -> str:
-    """Extracts 'yes' or 'no' from the LLM response."""
+def extract_level(response: str, default="low") -> str:
+    """Extracts 'high', 'medium' or 'low' from the LLM response, or `default` when it has none."""
     match = re.search(r'\b(high|medium|low)\b', response, re.IGNORECASE)
-    return match.group(0).lower() if match else "low"  # Default to 'low' if unclear
+    return match.group(0).lower() if match else default  # Default to 'low' if unclear
+
+async def evaluate_document(code_snippet: str, document: str) -> str:
+    """Grades the level of relevance of one document to the given code snippet: 'high', 'medium' or 'low'."""
+    local = distill.local_grade("relevance", code_snippet, document)
+    if local is not None:
+        return local
+
+    # Format the prompt as a list of messages
+    messages = await get_prompt(document, code_snippet)
+
+    # Generate response from LLM
+    stream = await usage.metered_call("relevance", os.getenv('LLAMA_MODEL'), messages, 64, lambda messages, model: llm.chat_completion(
+        messages=messages, model=model, max_tokens=64, response_format=response_schema))
+
+    response = stream.choices[0].message.content
+    level = extract_level(response, default=None)
+    if level is None:
+        # Unparsed answers fall back to 'low', which is not a label the local grader should learn
+        return "low"
+    distill.record("relevance", code_snippet, document, level)
+    return level
 
 async def evaluate_documents(code_snippet: str, documents: list) -> list:
     """Grades the relevance of each document to the given code snippet."""
     levels = []
 
     for doc in documents:
-        # Format the prompt as a list of messages
-        messages = await get_prompt(doc, code_snippet)
-        
-        # Generate response from LLM
-        stream = await llm.chat_completion(messages=messages, model=os.getenv('LLAMA_MODEL'), max_tokens=64,
-                                             response_format=response_schema)
-
-        response = stream.choices[0].message.content
-        final_level = extract_level(response)
-        levels.append(final_level)
-        
+        levels.append(await evaluate_document(code_snippet, doc))
 
     return levels
-
@@ -0,0 +1,202 @@
+import os
+import json
+
+from call_LLM import LLM
+from common import explanations, prompts, structured, typosquat
+
+
+YARA_PROMPT = prompts.PromptTemplate("yara_rag", [
+    {
+        "role": "developer",
+        "content": "You are a cybersecurity expert analyzing potential malware in Python packages. "
+                   "Your task is to determine if a package is malicious or benign based on the YARA rule context."
+    },
+    {
+        "role": "developer",
+        "content": "Use the following YARA rule context to verify if the snippet from `setup.py` "
+                   "can cause the entire package to be detected as malicious. "
+                   "Verify if the YARA rule described in the context can detect this malicious activity.\n\n"
+                   "**If you don't know the answer, just say that you don't know.**"
+    },
+    {
+        "role": "developer",
+        "content": "**Strict Response Format:**\n"
+                   "- **Filename**: {package_name}\n"
+                   "- **Result**:\n"
+                   "- **Predicted Classification**: (1 for Malicious, 0 for Benign)\n"
+                   "- **Explanation**: (Concise reasoning in two sentences)"
+    },
+])
+
+
+GIT_ADV_PROMPT = prompts.PromptTemplate("git_adv_rag", [
+    {
+        "role": "developer",
+        "content": "You are a cybersecurity expert analyzing potential malware in Python packages. "
+                   "Your task is to determine if a package is malicious or benign based on the advisories in the context."
+    },
+    {
+        "role": "developer",
+        "content": "Use the following advisories in the context to verify if the snippet from `setup.py` "
+                   "can cause the entire package to be detected as malicious. "
+                   "Verify if the advisories described in the context relates to the package\n\n"
+                   "**If you don't know the answer, just say that you don't know.**"
+    },
+    {
+        "role": "developer",
+        "content": "**Strict Response Format:**\n"
+                   "- **Filename**: {package_name}\n"
+                   "- **Result**:\n"
+                   "- **Predicted Classification**: (1 for Malicious, 0 for Benign)\n"
+                   "- **Explanation**: (Concise reasoning in two sentences)"
+    },
+])
+
+
+MAL_CODE_PROMPT = prompts.PromptTemplate("mal_code_rag", [
+    {
+        "role": "developer",
+        "content": """You are a cybersecurity expert analyzing potential malware in Python packages. "
+                       "Your task is to determine if a package is malicious or benign based sample code malicious code that is provided in the context.
+                       Evaluate the provided code snippet and the context to determine if the package is malicious or benign.
+                       """
+    },
+    {
+        "role": "developer",
+        "content": "Use the sample malicious code in the context to verify if the snippet from `setup.py` "
+                   "can cause the entire package to be detected as malicious. "
+                   "Verify if the advisories described in the context relates to the package\n\n"
+                   "**If you don't know the answer, just say that you don't know.**"
+    },
+    {
+        "role": "developer",
+        "content": "**Strict Response Format:**\n"
+                   "- **Filename**: {package_name}\n"
+                   "- **Result**:\n"
+                   "- **Predicted Classification**: (1 for Malicious, 0 for Benign)\n"
+                   "- **Explanation**: (Concise reasoning in two sentences)"
+    },
+])
+
+
+# Prompt and heading of the retrieved documents for each knowledge base
+PROMPTS = {
+    "yara": (YARA_PROMPT, "**YARA Rule Context:**"),
+    "git_adv": (GIT_ADV_PROMPT, "**Git advisories:**"),
+    "mal_code": (MAL_CODE_PROMPT, "**Sample Malicious code:**"),
+}
+
+# --model: (model name, environment variable of its API key)
+MODELS = {
+    "gpt": ("gpt-4o-mini", "OPENAI_API_KEY"),
+    "llama": ("meta-llama/Llama-3.1-8B-Instruct", "HUGGING_FACE_KEY"),
+}
+
+
+# Response Format Schema
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "python_package_classification_schema",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "filename": {
+                    "type": "string",
+                    "description": "The name of the file being classified"
+                },
+                "result": {
+                    "type": "object",
+                    "properties": {
+                        "prediction": {
+                            "type": "boolean",
+                            "description": "Prediction of whether the package is Malicious or Benign"
+                        },
+                        "explanation": {
+                            "type": "string",
+                            "description": "A brief explanation of why the file is classified this way in two sentences"
+                        }
+                    },
+                    "required": ["prediction", "explanation"]
+                }
+            },
+            "required": ["filename", "result"],
+            "additionalProperties": False
+        }
+    }
+}
+
+VERDICT_FORMAT = explanations.verdict_only_format(RESPONSE_FORMAT)
+
+
+class RAGClassifier:
+    """
+    Classifies a package from its `setup.py` snippet and the documents retrieved from one knowledge base.
+    Same calls as the CRAG `classify_package` module, so the RAG pipeline drives both the same way.
+    """
+
+    def __init__(self, knowledge: str, model: str):
+        self.prompt, self.context_heading = PROMPTS[knowledge]
+        self.model = model
+        self.model_name, key = MODELS[model]
+        self.api_key = os.getenv(key)
+        self.llm = LLM(model=self.model_name, api_key=self.api_key)
+
+    def get_prompt(self, package_name, file_list, snippet, context):
+        """
+        Generates a structured role-content format prompt for an LLM, static instructions first.
+        """
+        return self.prompt.render(
+            {
+                "role": "user",
+                "content": f"The Python package **{package_name}** contains the following files:\n{prompts.compact_json(file_list)}{typosquat.hint(package_name)}"
+            },
+            {
+                "role": "user",
+                "content": f"{self.context_heading}\n{context}"
+            },
+            {
+                "role": "user",
+                "content": f"**Code Snippet:**\n{snippet}"
+            },
+        )
+
+    async def classify(self, package_name, snippet, context, file_list, stage="classify"):
+        """
+        Generates a classification result using LLM.
+        """
+        messages = self.get_prompt(package_name, file_list, snippet, context)
+        response = await self.llm.call_llm(messages, RESPONSE_FORMAT, stage=stage)
+        return self.parse_response(package_name, response)
+
+    async def classify_verdict(self, package_name, snippet, context, file_list):
+        """
+        Asks for the prediction only, with a verdict-only schema and a small max_tokens.
+        """
+        messages = self.get_prompt(package_name, file_list, snippet, context)
+        response = await self.llm.call_llm(messages, VERDICT_FORMAT, max_tokens=explanations.verdict_max_tokens())
+        return structured.parse(response).get("prediction")
+
+    async def classify_stream(self, package_name, snippet, context, file_list):
+        """
+        Streams the classification and returns as soon as the prediction is decoded.
+        """
+        messages = self.get_prompt(package_name, file_list, snippet, context)
+        return await self.llm.call_llm_stream(messages, RESPONSE_FORMAT)
+
+    def parse_response(self, package_name, response):
+        """
+        Extracts the prediction and explanation from the LLM response.
+        """
+        try:
+            response_data = json.loads(response)
+        except json.JSONDecodeError:
+            print(f"❌ JSON Decode Error for {package_name}: {response}")
+            fields = structured.parse(response)
+            return package_name, fields.get("prediction"), fields.get("explanation", response)
+
+        if self.model == "gpt":
+            return package_name, response_data["result"]["prediction"], response_data["result"]["explanation"]
+        # Model is Llama; answers following the schema itself (e.g. the local batch backend) nest it under "result"
+        response_data = response_data.get("result", response_data)
+        return package_name, response_data["prediction"], response_data["explanation"]
@@ -0,0 +1,194 @@
+import re
+import sys
+import math
+import argparse
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.vectorstores import DB_PARAMS
+
+
+COLLECTIONS = ["malware.yara_rules2", "github_advisories", "malicious_setup_py"]
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+
+# PGVector's default distance strategy is cosine.
+OPERATOR_CLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "ip": "vector_ip_ops",
+}
+
+METADATA_INDEX = "ix_cmetadata_gin"
+COLLECTION_ID_INDEX = "ix_langchain_pg_embedding_collection_id"
+
+
+def connect(autocommit: bool = True):
+    return psycopg.connect(dbname=DB_PARAMS["database"], user=DB_PARAMS["user"], password=DB_PARAMS["password"],
+                           host=DB_PARAMS["host"], port=DB_PARAMS["port"], options="-csearch_path=malware",
+                           autocommit=autocommit)
+
+
+def collection_uuid(connection, collection_name: str) -> str:
+    row = connection.execute(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = %s", (collection_name,)).fetchone()
+    if row is None:
+        raise ValueError(f"Collection {collection_name} does not exist")
+    return str(row[0])
+
+
+def collection_rows(connection, uuid: str) -> int:
+    return connection.execute(f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE collection_id = %s", (uuid,)).fetchone()[0]
+
+
+def index_name(collection_name: str, method: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", collection_name.lower()).strip("_")
+    return f"ix_embedding_{slug}_{method}"[:63]
+
+
+def default_lists(rows: int) -> int:
+    """
+    pgvector's starting point for IVFFlat: rows / 1000 up to 1M rows, sqrt(rows) above.
+    """
+    if rows > 1_000_000:
+        return max(1, int(math.sqrt(rows)))
+    return max(1, rows // 1000)
+
+
+def ensure_dimensions(connection):
+    """
+    ANN indexes need a fixed dimension, but PGVector creates the `embedding` column as plain `vector`.
+    Types the column with the dimension of the stored embeddings, which must all agree.
+    """
+    column_type = connection.execute(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attname = 'embedding'", (EMBEDDING_TABLE,)
+    ).fetchone()[0]
+    if column_type != "vector":
+        return column_type
+    dimensions = [row[0] for row in connection.execute(
+        f"SELECT DISTINCT vector_dims(embedding) FROM {EMBEDDING_TABLE}")]
+    if len(dimensions) != 1:
+        raise ValueError(f"Embeddings have dimensions {dimensions}; re-embed the collections with a single model first")
+    connection.execute(sql.SQL("ALTER TABLE {table} ALTER COLUMN embedding TYPE vector({dims})").format(
+        table=sql.Identifier(EMBEDDING_TABLE), dims=sql.Literal(dimensions[0])))
+    print(f"✅ Typed {EMBEDDING_TABLE}.embedding as vector({dimensions[0]})")
+    return f"vector({dimensions[0]})"
+
+
+def create_metadata_indexes(connection, concurrently: bool = False):
+    """
+    GIN index for the JSONB metadata filters and a B-tree on the collection id used by every search.
+    """
+    concurrently = sql.SQL("CONCURRENTLY " if concurrently else "")
+    connection.execute(sql.SQL("CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} "
+                               "USING gin (cmetadata jsonb_path_ops)").format(
+        concurrently=concurrently, name=sql.Identifier(METADATA_INDEX), table=sql.Identifier(EMBEDDING_TABLE)))
+    connection.execute(sql.SQL("CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} (collection_id)").format(
+        concurrently=concurrently, name=sql.Identifier(COLLECTION_ID_INDEX), table=sql.Identifier(EMBEDDING_TABLE)))
+    print(f"✅ Metadata indexes {METADATA_INDEX}, {COLLECTION_ID_INDEX} ready")
+
+
+def create_ann_index(connection, collection_name: str, method: str = "hnsw", distance: str = "cosine",
+                     m: int = 16, ef_construction: int = 64, lists: int = None, concurrently: bool = False):
+    """
+    Creates a partial HNSW or IVFFlat index restricted to one collection, so each collection is searched
+    with its own graph or lists instead of a post-filtered global index.
+    """
+    uuid = collection_uuid(connection, collection_name)
+    if method == "hnsw":
+        params = sql.SQL("m = {m}, ef_construction = {ef}").format(m=sql.Literal(m), ef=sql.Literal(ef_construction))
+        hint = "tune recall with --ef_search"
+    else:
+        lists = lists or default_lists(collection_rows(connection, uuid))
+        params = sql.SQL("lists = {lists}").format(lists=sql.Literal(lists))
+        hint = f"start with --ivfflat_probes {max(1, int(math.sqrt(lists)))}"
+    name = index_name(collection_name, method)
+    connection.execute(sql.SQL(
+        "CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} USING {method} (embedding {opclass}) "
+        "WITH ({params}) WHERE collection_id = {uuid}").format(
+        concurrently=sql.SQL("CONCURRENTLY " if concurrently else ""), name=sql.Identifier(name),
+        table=sql.Identifier(EMBEDDING_TABLE), method=sql.SQL(method), opclass=sql.SQL(OPERATOR_CLASSES[distance]),
+        params=params, uuid=sql.Literal(uuid)))
+    print(f"✅ {method} index {name} ready on {collection_name} ({hint})")
+    return name
+
+
+def drop_ann_indexes(connection, collection_name: str):
+    for method in ("hnsw", "ivfflat"):
+        connection.execute(sql.SQL("DROP INDEX IF EXISTS {name}").format(name=sql.Identifier(index_name(collection_name, method))))
+    print(f"✅ Dropped the ANN indexes of {collection_name}")
+
+
+def reindex(connection, collection_name: str, concurrently: bool = False):
+    """
+    Rebuilds the ANN indexes of a collection, e.g. after large inserts degraded IVFFlat lists.
+    """
+    for method in ("hnsw", "ivfflat"):
+        name = index_name(collection_name, method)
+        if connection.execute("SELECT to_regclass(%s)", (name,)).fetchone()[0] is None:
+            continue
+        connection.execute(sql.SQL("REINDEX INDEX {concurrently}{name}").format(
+            concurrently=sql.SQL("CONCURRENTLY " if concurrently else ""), name=sql.Identifier(name)))
+        print(f"✅ Rebuilt {name}")
+    connection.execute(sql.SQL("ANALYZE {table}").format(table=sql.Identifier(EMBEDDING_TABLE)))
+
+
+def print_status(connection, collections: list):
+    print(f"{'collection':<24}{'rows':>9}")
+    for collection_name in collections:
+        try:
+            print(f"{collection_name:<24}{collection_rows(connection, collection_uuid(connection, collection_name)):>9}")
+        except ValueError as e:
+            print(f"⚠️ {e}")
+    print()
+    print(f"{'index':<48}{'size':>10}  definition")
+    for name, size, definition in connection.execute(
+            "SELECT indexname, pg_size_pretty(pg_relation_size(indexname::regclass)), indexdef "
+            "FROM pg_indexes WHERE tablename = %s ORDER BY indexname", (EMBEDDING_TABLE,)):
+        print(f"{name:<48}{size:>10}  {definition}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and maintain the pgvector indexes of the knowledge base.")
+    parser.add_argument("command", choices=["create", "status", "reindex", "drop"])
+    parser.add_argument("--collection", action="append", default=None,
+                        help="Collection to manage, may be repeated (default: all three).")
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--distance", choices=sorted(OPERATOR_CLASSES), default="cosine",
+                        help="Distance of the PGVector stores (cosine unless changed in the notebooks).")
+    parser.add_argument("--m", type=int, default=16, help="HNSW: links per node.")
+    parser.add_argument("--ef_construction", type=int, default=64, help="HNSW: candidate list size while building.")
+    parser.add_argument("--lists", type=int, default=None, help="IVFFlat: number of lists (default: rows / 1000).")
+    parser.add_argument("--maintenance_work_mem", type=str, default=None,
+                        help="e.g. 2GB; HNSW builds are much faster when the graph fits in memory.")
+    parser.add_argument("--concurrently", action="store_true", help="Build without blocking writes.")
+    args = parser.parse_args()
+    collections = args.collection or COLLECTIONS
+
+    with connect() as connection:
+        if args.maintenance_work_mem:
+            connection.execute(sql.SQL("SET maintenance_work_mem = {value}").format(value=sql.Literal(args.maintenance_work_mem)))
+        if args.command == "status":
+            print_status(connection, collections)
+            return
+        if args.command == "create":
+            ensure_dimensions(connection)
+        for collection_name in collections:
+            if args.command == "create":
+                create_ann_index(connection, collection_name, args.method, args.distance, args.m,
+                                 args.ef_construction, args.lists, args.concurrently)
+            elif args.command == "reindex":
+                reindex(connection, collection_name, args.concurrently)
+            else:
+                drop_ann_indexes(connection, collection_name)
+        if args.command == "create":
+            create_metadata_indexes(connection, args.concurrently)
+            connection.execute(sql.SQL("ANALYZE {table}").format(table=sql.Identifier(EMBEDDING_TABLE)))
+
+
+if __name__ == "__main__":
+    main()
@@ -32,3 +32,6 @@ ALTER DEFAULT PRIVILEGES IN SCHEMA malware GRANT SELECT, INSERT, UPDATE, DELETE
 
 -- Step 7: Enable vector Extension
 CREATE EXTENSION IF NOT EXISTS vector SCHEMA malware;
+
+-- Step 8: After embedding the collections, create the ANN and metadata indexes with
+--   python manage_indexes.py create --method hnsw
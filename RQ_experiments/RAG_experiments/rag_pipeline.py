@@ -0,0 +1,364 @@
+"""
+The Simple_RAG and CRAG experiments as one pipeline of declared stages:
+
+    load -> retrieve -> grade (CRAG only) -> classify -> write
+
+Each stage has its own workers (`--workers classify=8`) and a bounded queue in front of it, so a slow stage
+holds back the packages upstream instead of piling them up (see common/pipeline.py). The experiments only
+differ by their entry in VARIANTS; simulate_*_rag.py and main_crag_*_flow.py each run one of them.
+"""
+import os
+import sys
+import asyncio
+import argparse
+import importlib
+from pathlib import Path
+from contextlib import contextmanager
+
+import aiofiles
+import dotenv
+from tqdm import tqdm
+
+RAG_DIR = Path(__file__).resolve().parent
+DATA_DIR = RAG_DIR.parent / "data"
+sys.path.append(str(RAG_DIR.parent))
+from common import (batch, dedupe, distill, explanations, hedging, lazy, lexical, pipeline, prompts, shards, snippets, structured,
+                    tracing, triage, typosquat, usage, vectorstores, workqueue)
+
+dotenv.load_dotenv()
+
+# Default workers per stage: the LLM stages wait on the network, retrieval on the database, the writer appends to one file
+STAGE_WORKERS = {"load": 1, "retrieve": 2, "grade": 4, "classify": 4, "write": 1}
+
+
+def first_300(text: str) -> str:
+    return text[:300]
+
+
+def head_and_tail(text: str) -> str:
+    return f"first 300 bytes:{text[:300]}  \nlast 300 bytes:{text[-300:]}" if len(text) > 600 else text
+
+
+class Variant:
+    """
+    One RAG experiment: the folder of its classifier module, the collections searched with the number of
+    documents kept from each, and whether the documents are graded first (CRAG). Simple_RAG variants name the
+    `knowledge` prompt of `rag_classifier.py` and accept --model and --batch.
+    """
+
+    def __init__(self, folder: str, collections: dict, classifier: str, knowledge: str = None, grade: bool = False,
+                 classify_column: str = "setup.py", head=first_300, header: list = None):
+        self.folder = folder
+        self.collections = collections
+        self.classifier = classifier
+        self.knowledge = knowledge
+        self.grade = grade
+        self.classify_column = classify_column
+        self.head = head
+        self.header = header or ["filename", "label", "llm_prediction", "explanation"]
+
+    def stages(self, batch: bool = False) -> list:
+        names = ["load", "retrieve"] + (["grade"] if self.grade else [])
+        return names + (["prepare"] if batch else ["classify", "write"])
+
+
+CRAG_COLLECTIONS = {"malware.yara_rules2": 4, "github_advisories": 4}
+CRAG_HEADER = ["package_name", "label", "llm_prediction", "explanation"]
+
+VARIANTS = {
+    "yara": Variant("Simple_RAG", {"malware.yara_rules2": 2}, "rag_classifier", knowledge="yara"),
+    "git_adv": Variant("Simple_RAG", {"github_advisories": 2}, "rag_classifier", knowledge="git_adv"),
+    "mal_code": Variant("Simple_RAG", {"malicious_setup_py": 1}, "rag_classifier", knowledge="mal_code"),
+    "crag_code": Variant("CRAG", CRAG_COLLECTIONS, "classify_package", grade=True, head=head_and_tail, header=CRAG_HEADER),
+    # The AST variant retrieves and grades with the setup.py code, then classifies the package's code flow
+    "crag_ast": Variant("CRAG", CRAG_COLLECTIONS, "classify_package_ast", grade=True, classify_column="textual_description",
+                        head=head_and_tail, header=CRAG_HEADER),
+}
+
+
+class Runner:
+    """
+    Parses the command line of a variant, configures the shared helpers and runs the test dataset through the stages.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.variant = variant = VARIANTS[name]
+        simple = variant.knowledge is not None
+        sys.path.append(str(RAG_DIR / variant.folder))
+        # grading.py runs the corrective step of the CRAG variants
+        self.grading = importlib.import_module("grading") if variant.grade else None
+
+        parser = argparse.ArgumentParser(description="Simulate the testing of the LLM model on the test dataset.")
+        if simple:
+            parser.add_argument("--model", "-m", type=str, help="The name of the LLM model to use.", choices=["gpt", "llama"], default="llama")
+        parser.add_argument("--result_file", "-r", type=str, help="where to save the results of the test.")
+        pipeline.add_arguments(parser, {stage: STAGE_WORKERS[stage] for stage in variant.stages()})
+        if self.grading is not None:
+            self.grading.add_arguments(parser)
+            distill.add_arguments(parser)
+        hedging.add_arguments(parser)
+        if simple:
+            batch.add_arguments(parser)
+        tracing.add_arguments(parser)
+        usage.add_arguments(parser)
+        structured.add_arguments(parser)
+        explanations.add_arguments(parser)
+        dedupe.add_arguments(parser)
+        lexical.add_arguments(parser)
+        vectorstores.add_arguments(parser)
+        typosquat.add_arguments(parser)
+        triage.add_arguments(parser)
+        snippets.add_arguments(parser)
+        shards.add_arguments(parser)
+        workqueue.add_arguments(parser)
+
+        self.args = args = parser.parse_args()
+        self.batch = simple and args.batch
+        if self.batch and args.batch_backend == "openai" and args.model != "gpt":
+            parser.error("The OpenAI batch backend needs --model gpt, use --batch_backend local for other models")
+        if self.batch and args.stream:
+            parser.error("--stream cannot be combined with --batch")
+        if args.verdict_only and (self.batch or args.stream):
+            parser.error("--verdict_only cannot be combined with --batch or --stream")
+        if args.queue and (args.shard[1] > 1 or args.dedupe or self.batch):
+            parser.error("--queue replaces --shard and cannot be combined with --dedupe or --batch")
+        try:
+            workers = pipeline.parse_workers(args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        unknown = set(workers) - set(variant.stages(self.batch))
+        if unknown:
+            parser.error(f"Unknown stage(s) {', '.join(sorted(unknown))} for --workers, the stages are {', '.join(variant.stages(self.batch))}")
+        if workers.get("write", 1) != 1:
+            parser.error("The write stage appends to a single result file and runs on one worker")
+        pipeline.configure(workers, args.stage_queue_size)
+        if self.grading is not None:
+            self.grading.configure_from_args(args)
+            distill.configure_from_args(args)
+        shards.configure_from_args(args)
+        workqueue.configure_from_args(args, args.result_file)
+        hedging.configure_from_args(args)
+        tracing.configure_from_args(args)
+        usage.configure_from_args(args)
+        structured.configure_from_args(args)
+        explanations.configure_from_args(args, workqueue.result_path(shards.result_path(args.result_file)))
+        dedupe.configure_from_args(args)
+        lexical.configure_from_args(args)
+        vectorstores.configure_from_args(args)
+        typosquat.configure_from_args(args)
+        triage.configure_from_args(args)
+        snippets.configure_from_args(args)
+        self.result_file = workqueue.result_path(shards.result_path(args.result_file))
+        self._written = None
+
+        if simple:
+            import rag_classifier
+
+            self.classifier = rag_classifier.RAGClassifier(variant.knowledge, args.model)
+            self.model_name = self.classifier.model_name
+            self.response_format = rag_classifier.RESPONSE_FORMAT
+        else:
+            # The CRAG modules classify with their module-level client
+            self.classifier = importlib.import_module(variant.classifier)
+            self.model_name = None
+
+        embeddings = lazy.openai_embeddings()
+        # Connected on the first search, so --help and argument errors do not wait for the database
+        self.stores = {collection: lazy.Lazy(lambda collection=collection: lexical.get_retriever(collection, embeddings.get()))
+                       for collection in variant.collections}
+
+        # Built once, as a queue worker runs them again for every claimed batch
+        self.first_stages = [pipeline.Stage("load", self.load, STAGE_WORKERS["load"]),
+                             pipeline.Stage("retrieve", self.retrieve, STAGE_WORKERS["retrieve"], skip=self.triaged)]
+        if variant.grade:
+            self.first_stages.append(pipeline.Stage("grade", self.grade, STAGE_WORKERS["grade"], skip=self.triaged))
+        self.classify_stages = [pipeline.Stage("classify", self.classify_item, STAGE_WORKERS["classify"], skip=self.triaged),
+                                pipeline.Stage("write", self.write, STAGE_WORKERS["write"])]
+
+    def load_tests_files(self):
+        """
+        Loads test datasets from JSON files.
+        """
+        import pandas as pd
+
+        mal_tests = pd.read_json(DATA_DIR / "test_malicious_packages_final.json")
+        benign_tests = pd.read_json(DATA_DIR / "test_benign_packages_final.json")
+
+        mal_tests['label'] = 1
+        benign_tests['label'] = 0
+
+        test_dataset = shards.select(shards.shuffle(pd.concat([mal_tests, benign_tests])))
+        if triage.enabled():
+            # The triage model was trained on whole setup.py files, not on the snippets
+            test_dataset["full_setup.py"] = test_dataset["setup.py"]
+        test_dataset["setup.py"] = snippets.select_column(test_dataset["setup.py"], head=self.variant.head)
+
+        print(f"Test dataset loaded: {test_dataset.shape[0]} packages.")
+        return test_dataset
+
+    async def write_to_csv_async(self, data):
+        """
+        Asynchronously appends a row of data to the result file.
+        """
+        file_exists = os.path.exists(self.result_file)
+
+        async with aiofiles.open(self.result_file, mode='a', newline='', encoding='utf-8') as file:
+            if not file_exists:
+                await file.write(','.join(self.variant.header) + '\n')
+            await file.write(','.join(map(str, data)) + '\n')
+        if self._written is not None:
+            self._written.add(str(data[0]))
+
+    # Stages: each takes the item of the previous stage and returns the item of the next one, or None to stop there
+
+    async def load(self, row):
+        package_name = row["package_name"]
+        with tracing.span("load"):
+            if not isinstance(row["setup.py"], str) or not isinstance(row[self.variant.classify_column], str):
+                print(f"❌ No {self.variant.classify_column} for {package_name}")
+                return None
+            item = {"package_name": package_name, "label": row["label"], "file_list": row["file_list"], "snippet": row["setup.py"],
+                    "content": row[self.variant.classify_column], "custom_id": str(row.name)}
+            if triage.enabled():
+                verdict, probability = triage.decide(package_name, row["full_setup.py"], row["file_list"])
+                if verdict is not None:
+                    item.update(prediction=verdict, explanation=triage.explanation(probability), triaged=True)
+        return item
+
+    @staticmethod
+    def triaged(item) -> bool:
+        # Packages the triage model decided skip retrieval, grading and classification
+        return item.get("triaged", False)
+
+    async def retrieve(self, item):
+        async def search(collection, k):
+            with tracing.span("retrieve", collection=collection):
+                # The stores' searches block, so they run on a thread and the other stages keep going
+                if self.grading is not None:
+                    # (document, distance) pairs, for the lazy grading
+                    return await asyncio.to_thread(self.grading.search, self.stores[collection], item["snippet"], k)
+                return await asyncio.to_thread(self.stores[collection].similarity_search, item["snippet"], k=k)
+
+        documents = await asyncio.gather(*(search(collection, k) for collection, k in self.variant.collections.items()))
+        item["documents"] = dict(zip(self.variant.collections, documents))
+        if not self.variant.grade:
+            item["context"] = "\n\n".join(doc.page_content for docs in documents for doc in docs)
+        return item
+
+    async def grade(self, item):
+        item["context"] = await self.grading.build_context(item["snippet"], item["documents"])
+        return item
+
+    async def classify_item(self, item):
+        call = (item["package_name"], item["content"], item["context"], item["file_list"])
+        with tracing.span("classify"):
+            if explanations.enabled():
+                item["prediction"] = await self.classifier.classify_verdict(*call)
+            elif structured.enabled():
+                item["stream"] = await self.classifier.classify_stream(*call)
+            else:
+                _, item["prediction"], item["explanation"] = await self.classifier.classify(*call)
+        return item
+
+    async def write(self, item):
+        package_name, label = item["package_name"], item["label"]
+        if "stream" in item:
+            await structured.complete(item["stream"], lambda fields: self.write_to_csv_async(
+                [package_name, label, fields.get("prediction"), fields.get("explanation", "")]))
+            return None
+        with tracing.span("write"):
+            await self.write_to_csv_async([package_name, label, item["prediction"], item.get("explanation", "")])
+        if explanations.enabled() and not self.triaged(item):
+            call = (package_name, item["content"], item["context"], item["file_list"])
+
+            async def explain(call=call):
+                return (await self.classifier.classify(*call, stage="explain"))[2]
+            explanations.submit(package_name, item["prediction"], explain)
+        return None
+
+    @contextmanager
+    def package_scope(self, row):
+        with tracing.span("package", package_name=row["package_name"], variant=self.name), usage.package(row["package_name"]):
+            yield
+
+    async def run_stages(self, rows, last_stages: list):
+        """
+        Runs the rows whose package has no result yet through load, retrieve and grade, then `last_stages`;
+        skipping the written packages lets an interrupted run be resumed.
+        """
+        rows = rows[~rows["package_name"].isin(self.written())]
+        with tqdm(total=rows.shape[0]) as progress:
+            await pipeline.run(self.first_stages + last_stages, (row for _, row in rows.iterrows()), scope=self.package_scope,
+                               key=lambda item: item["package_name"], progress=progress)
+
+    async def classify(self, rows):
+        """
+        Simulates the LLM classification for each test package.
+        """
+        await self.run_stages(rows, self.classify_stages)
+        await structured.drain()
+        await explanations.drain()
+
+    async def classify_batch(self, rows):
+        """
+        Retrieves the context of every package, classifies the prompts through the batch backend and writes the results.
+        """
+        requests, packages = [], {}
+
+        async def prepare(item):
+            if self.triaged(item):
+                await self.write_to_csv_async([item["package_name"], item["label"], item["prediction"], item["explanation"]])
+                return
+            messages = self.classifier.get_prompt(item["package_name"], item["file_list"], item["snippet"], item["context"])
+            requests.append(batch.build_request(item["custom_id"], self.model_name, messages, self.response_format))
+            packages[item["custom_id"]] = (item["package_name"], item["label"])
+
+        await self.run_stages(rows, [pipeline.Stage("prepare", prepare)])
+        with tracing.span("batch", requests=len(requests)):
+            responses = await batch.run_batch(requests, self.args.batch_dir, batch.get_backend(self.args), self.args.batch_poll_interval)
+        for custom_id, (package_name, label) in packages.items():
+            response = responses.get(custom_id)
+            if response is None:
+                print(f"❌ No batch result for {package_name}")
+                continue
+            _, llm_prediction, explanation = self.classifier.parse_response(package_name, response)
+            await self.write_to_csv_async([package_name, label, llm_prediction, explanation])
+
+    def verdicts(self) -> dict:
+        return dedupe.read_verdicts(self.result_file)
+
+    def written(self) -> set:
+        """
+        Packages with a row in the result file: read once, then kept up to date by write_to_csv_async.
+        """
+        if self._written is None:
+            self._written = set(self.verdicts())
+        return self._written
+
+    async def write_propagated(self, row, representative, llm_prediction, explanation):
+        """
+        Writes the verdict of a near-duplicate's cluster representative.
+        """
+        await self.write_to_csv_async([row["package_name"], row["label"], llm_prediction, explanation])
+
+    def main(self):
+        test_dataset = self.load_tests_files()
+        classify = self.classify_batch if self.batch else self.classify
+        if workqueue.enabled():
+            asyncio.run(workqueue.run(test_dataset, classify, self.written))
+        else:
+            asyncio.run(dedupe.run(test_dataset, classify, self.write_propagated, self.verdicts))
+        pipeline.print_summary()
+        triage.print_summary()
+        if self.grading is not None:
+            self.grading.print_summary()
+            distill.print_summary()
+        tracing.print_summary()
+        usage.print_summary()
+        prompts.print_summary(self.model_name)
+        explanations.print_summary()
+        dedupe.print_summary()
+        workqueue.print_summary()
+        snippets.print_summary()
+        lexical.print_summary()
@@ -2,13 +2,13 @@ import os
 import json
 import dotenv
 import asyncio
-from openai import OpenAI,AsyncOpenAI
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-from huggingface_hub import InferenceClient
-from huggingface_hub import AsyncInferenceClient
+import sys
+from pathlib import Path
 
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common import lazy, usage
+
 dotenv.load_dotenv()
 
 
@@ -24,11 +24,11 @@ class LLM:
 
         if "gpt" in model:  # OpenAI model detection
             self.USE_HUGGINGFACE = False
-            self.llm =  AsyncOpenAI(api_key=self.API_KEY)
+            self.llm = lazy.openai_client(self.API_KEY)
         else:  # Hugging Face model detection (LLaMA-3 or other instruct models)
 
             self.USE_HUGGINGFACE = True
-            self.llm  = AsyncInferenceClient(api_key=self.API_KEY)
+            self.llm = lazy.hugging_face_client(self.API_KEY)
     
     
     async def convert_json_schema(self,original_schema):
@@ -76,9 +76,11 @@ class LLM:
            
     
             
-    async def call_llm(self, prompt,response_format) -> str:
+    async def call_llm(self, prompt, response_format, stage="classify", max_tokens=500) -> str:
         """
         Calls the selected LLM model API (Hugging Face for text generation or OpenAI GPT for chat completion).
+        The call runs under the deadline and token budget configured for `stage`.
+        `max_tokens` is lowered for verdict-only answers.
         """
        
 
@@ -86,22 +88,39 @@ class LLM:
             if self.USE_HUGGINGFACE:
                 # ✅ Use chat_completion() for instruct models
                 grammer =await self.convert_json_schema(response_format)
-                stream = await self.llm.chat_completion(messages=prompt, model=self.LLM_MODEL, max_tokens=500,
-                                                    response_format=grammer)
+                stream = await usage.metered_call(stage, self.LLM_MODEL, prompt, max_tokens, lambda messages, model: self.llm.chat_completion(
+                    messages=messages, model=model, max_tokens=max_tokens, response_format=grammer))
                 response = stream.choices[0].message.content
                 return response
     
             else:
                 # ✅ OpenAI chat model
                 
-                stream = await self.llm.chat.completions.create(model='gpt-4o-mini',messages =prompt,
-                                                          response_format= response_format)
+                stream = await usage.metered_call(stage, self.LLM_MODEL, prompt, max_tokens, lambda messages, model: self.llm.chat.completions.create(
+                    model=model, messages=messages, max_tokens=max_tokens, response_format=response_format))
                 
                 response = stream.choices[0].message.content
                 
 
 
             return response 
+        except usage.BudgetExceeded:
+            # Under --budget_policy skip the package is left unwritten, so a resumed run or the queue retries it
+            raise
         except Exception as e:
             print(f"❌ LLM API Error: {e}")
             return "Error in LLM inference."
+
+    async def call_llm_stream(self, prompt, response_format, stage="classify"):
+        """
+        Streams the answer of the selected LLM and returns a `structured.StructuredStream` as soon as
+        the prediction is decoded. The deadline of `stage` covers the time to the prediction.
+        """
+        if self.USE_HUGGINGFACE:
+            grammer = await self.convert_json_schema(response_format)
+            return await usage.metered_stream(stage, self.LLM_MODEL, prompt, 500, lambda messages, model: self.llm.chat_completion(
+                messages=messages, model=model, max_tokens=500, response_format=grammer, stream=True))
+
+        return await usage.metered_stream(stage, self.LLM_MODEL, prompt, 500, lambda messages, model: self.llm.chat.completions.create(
+            model=model, messages=messages, max_tokens=500, response_format=response_format,
+            stream=True, stream_options={"include_usage": True}))
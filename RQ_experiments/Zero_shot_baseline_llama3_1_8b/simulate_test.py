@@ -3,15 +3,18 @@ import json
 import aiofiles
 import csv
 import os
-import pandas as pd
 import argparse
 import asyncio
+from pathlib import Path
 from call_LLM import LLM
+from common import batch, dedupe, explanations, hedging, prompts, shards, snippets, structured, tracing, triage, typosquat, usage, workqueue
 import dotenv
 
 from tqdm import tqdm
 dotenv.load_dotenv()
 
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+
 RESPONSE_FORMAT = {
     "type": "json_schema",
     "json_schema": {
@@ -44,16 +47,49 @@ RESPONSE_FORMAT = {
     }
 }
 
+VERDICT_FORMAT = explanations.verdict_only_format(RESPONSE_FORMAT)
+
 
 
 
 parser = argparse.ArgumentParser(description="Simulate the testing of the LLM model on the test dataset.")
 parser.add_argument("--model","-m", type=str, help="The name of the LLM model to use.", choices=["gpt","llama"], default="llama")
 parser.add_argument("--result_file","-r", type=str, help="where to save the results of the test.")
+hedging.add_arguments(parser)
+batch.add_arguments(parser)
+tracing.add_arguments(parser)
+usage.add_arguments(parser)
+structured.add_arguments(parser)
+explanations.add_arguments(parser)
+dedupe.add_arguments(parser)
+typosquat.add_arguments(parser)
+snippets.add_arguments(parser)
+shards.add_arguments(parser)
+workqueue.add_arguments(parser)
+triage.add_arguments(parser)
 
 args = parser.parse_args()
+if args.batch and args.batch_backend == "openai" and args.model != "gpt":
+    parser.error("The OpenAI batch backend needs --model gpt, use --batch_backend local for other models")
+if args.batch and args.stream:
+    parser.error("--stream cannot be combined with --batch")
+if args.verdict_only and (args.batch or args.stream):
+    parser.error("--verdict_only cannot be combined with --batch or --stream")
+if args.queue and (args.shard[1] > 1 or args.dedupe or args.batch):
+    parser.error("--queue replaces --shard and cannot be combined with --dedupe or --batch")
+shards.configure_from_args(args)
+workqueue.configure_from_args(args, args.result_file)
+hedging.configure_from_args(args)
+tracing.configure_from_args(args)
+usage.configure_from_args(args)
+structured.configure_from_args(args)
+explanations.configure_from_args(args, workqueue.result_path(shards.result_path(args.result_file)))
+dedupe.configure_from_args(args)
+typosquat.configure_from_args(args)
+snippets.configure_from_args(args)
+triage.configure_from_args(args)
 model = args.model
-result_file = args.result_file
+result_file = workqueue.result_path(shards.result_path(args.result_file))
 
 if model == "gpt":
     api_key = os.getenv("OPENAI_API_KEY")
@@ -63,49 +99,76 @@ else:
     model_name = "meta-llama/Llama-3.1-8B-Instruct"
 
 
-async def get_prompt(package_name,file_list, file_content):
-    """
-    Generates a prompt for the user and developer to classify a package called as Malicious or Benign.
-    """
-    PROMPT = [{"role": "developer", 
-                "content": f"""You are a cybersecurity expert analyzing potential malware in a Python package called {package_name}.
-            You are provided with the names of the files in the package: {json.dumps(file_list, ensure_ascii=False)}.
-            Below is the first 300 characters from the `setup.py` file.
-            
+ZERO_SHOT_PROMPT = prompts.PromptTemplate("zero_shot_baseline", [
+    {"role": "developer",
+     "content": """You are a cybersecurity expert analyzing potential malware in a Python package.
+            You are provided with the name of the package, the names of the files in the package
+            and the first 300 characters from the `setup.py` file.
+
             Your task: 
             - Determine if the package is **Malicious (1) or Benign (0)**.
             - Provide a **brief explanation** (max 2 sentences) of why it is classified that way.
 
             **Strict Response Format**:
-            - **Filename**: {package_name}
+            - **Filename**: (the package name)
             - **Result**:
             - **Predicted Classification**: (1 for Malicious, 0 for Benign)
             - **Explanation**: (Concise reasoning in two sentences)
             """
-            },
-            {
-                "role": "user", 
-                "content": f"file content: {file_content}"
-            }
-        ] 
-    return PROMPT
+     },
+])
+
+
+async def get_prompt(package_name,file_list, file_content):
+    """
+    Generates a prompt for the user and developer to classify a package called as Malicious or Benign.
+    """
+    return ZERO_SHOT_PROMPT.render(
+        {
+            "role": "user",
+            "content": f"package: {package_name}\nfiles: {prompts.compact_json(file_list)}{typosquat.hint(package_name)}"
+        },
+        {
+            "role": "user", 
+            "content": f"file content: {file_content}"
+        }
+    )
 
 
 def load_tests_files():
-    mal_tests = pd.read_json(".\data\\test_malicious_packages_final.json")
-    benign_tests = pd.read_json(".\data\\test_benign_packages_final.json")
+    import pandas as pd
+
+    mal_tests = pd.read_json(DATA_DIR / "test_malicious_packages_final.json")
+    benign_tests = pd.read_json(DATA_DIR / "test_benign_packages_final.json")
     
     mal_tests['label'] = 1
     benign_tests['label'] = 0
     
     test_dataset = pd.concat([mal_tests, benign_tests])
-    test_dataset = test_dataset.sample(frac=1).reset_index(drop=True)
-    test_dataset["setup.py"] = test_dataset["setup.py"].apply(lambda x: x[:300] if isinstance(x, str) else x)
+    test_dataset = shards.select(shards.shuffle(test_dataset))
+    if triage.enabled():
+        # The triage model was trained on whole setup.py files, not on the snippets
+        test_dataset["full_setup.py"] = test_dataset["setup.py"]
+    test_dataset["setup.py"] = snippets.select_column(test_dataset["setup.py"], head=lambda x: x[:300])
     print(f"Test dataset loaded: {test_dataset.shape[0]} packages loaded.")
     return test_dataset
 
 
 
+# Packages with a row in the result file, once written_packages() has read them
+written = None
+
+
+def written_packages() -> set:
+    """
+    Reads the packages of the result file once; write_to_csv_async then keeps the set up to date.
+    """
+    global written
+    if written is None:
+        written = set(dedupe.read_verdicts(result_file))
+    return written
+
+
 async def write_to_csv_async(file_path, data, header=['filename', 'label','llm_prediction', 'explanation']):
     """
     Asynchronously appends a row of data to a CSV file. Creates the file if it does not exist.
@@ -126,6 +189,38 @@ async def write_to_csv_async(file_path, data, header=['filename', 'label','llm_p
 
         # Write the new row
         await file.write(','.join(map(str, data)) + '\n')  # Convert data to CSV format
+    if written is not None:
+        written.add(str(data[0]))
+
+
+def parse_response(response):
+    """
+    Extracts the prediction and explanation from the LLM response.
+    """
+    try:
+        response = json.loads(response)
+    except json.JSONDecodeError:
+        print(f"❌ Error: Could not decode JSON response: {response}")
+        fields = structured.parse(response)
+        return fields.get("prediction"), fields.get("explanation", response)
+    if model == "gpt":
+        return response["result"]["prediction"], response["result"]["explanation"]
+    # Answers following the schema itself (e.g. the local batch backend) nest the verdict under "result"
+    response = response.get("result", response)
+    return response["prediction"], response["explanation"]
+
+
+async def write_triaged(row) -> bool:
+    """
+    Writes the triage model's verdict when it is confident; False leaves the package to the LLM.
+    """
+    if not triage.enabled():
+        return False
+    verdict, probability = triage.decide(row['package_name'], row["full_setup.py"], row["file_list"])
+    if verdict is None:
+        return False
+    await write_to_csv_async(result_file, [row['package_name'], row['label'], verdict, triage.explanation(probability)])
+    return True
 
 
 async def simulate_test(llm, test_dataset):
@@ -133,32 +228,92 @@ async def simulate_test(llm, test_dataset):
     Simulates the testing of the LLM model on the test dataset.
     """
     for index, row in tqdm(test_dataset.iterrows()):
-        prompt = await get_prompt(row['package_name'],row["file_list"], row["setup.py"])
-        try:
-            response = await llm.call_llm(prompt, RESPONSE_FORMAT)
+        with tracing.span("package", package_name=row['package_name']), usage.package(row['package_name']):
+            if await write_triaged(row):
+                continue
+            with tracing.span("load"):
+                prompt = await get_prompt(row['package_name'],row["file_list"], row["setup.py"])
             try:
-                response = json.loads(response)
-            except json.JSONDecodeError:
-                print(f"❌ Error: Could not decode JSON response: {response}")
                 filename = row['package_name']
                 label = row['label']
-                llm_prediction = None
-                explanation = response
-                await write_to_csv_async(result_file, [filename, label, llm_prediction, explanation])
-                continue
-            filename = row['package_name']
-            label = row['label']
-            if model == "gpt":
-                llm_prediction = response["result"]["prediction"]
-                explanation = response["result"]["explanation"]
-            elif model == "llama":
-                llm_prediction = response["prediction"]
-                explanation = response["explanation"]
-            await write_to_csv_async(result_file, [filename, label, llm_prediction, explanation])
-    
-        except Exception as e:
-            print(f"❌ Error: {e}")
+                if explanations.enabled():
+                    with tracing.span("classify"):
+                        response = await llm.call_llm(prompt, VERDICT_FORMAT, max_tokens=explanations.verdict_max_tokens())
+                    llm_prediction = structured.parse(response).get("prediction")
+                    with tracing.span("write"):
+                        await write_to_csv_async(result_file, [filename, label, llm_prediction, ""])
+
+                    async def explain(prompt=prompt):
+                        return parse_response(await llm.call_llm(prompt, RESPONSE_FORMAT, stage="explain"))[1]
+                    explanations.submit(filename, llm_prediction, explain)
+                    continue
+
+                if structured.enabled():
+                    with tracing.span("classify"):
+                        stream = await llm.call_llm_stream(prompt, RESPONSE_FORMAT)
+                    await structured.complete(stream, lambda fields, filename=filename, label=label: write_to_csv_async(
+                        result_file, [filename, label, fields.get("prediction"), fields.get("explanation", "")]))
+                    continue
+
+                with tracing.span("classify"):
+                    response = await llm.call_llm(prompt, RESPONSE_FORMAT)
+                llm_prediction, explanation = parse_response(response)
+                with tracing.span("write"):
+                    await write_to_csv_async(result_file, [filename, label, llm_prediction, explanation])
+
+            except Exception as e:
+                print(f"❌ Error: {e}")
+
+    await structured.drain()
+    await explanations.drain()
+
+
+async def simulate_batch(test_dataset):
+    """
+    Prepares every prompt up front, classifies them through the batch backend and writes the results.
+    """
+    requests, packages = [], {}
+    for index, row in test_dataset.iterrows():
+        if await write_triaged(row):
+            continue
+        prompt = await get_prompt(row['package_name'], row["file_list"], row["setup.py"])
+        requests.append(batch.build_request(str(index), model_name, prompt, RESPONSE_FORMAT))
+        packages[str(index)] = (row['package_name'], row['label'])
+
+    with tracing.span("batch", requests=len(requests)):
+        responses = await batch.run_batch(requests, args.batch_dir, batch.get_backend(args), args.batch_poll_interval)
+    for custom_id, (filename, label) in packages.items():
+        response = responses.get(custom_id)
+        if response is None:
+            print(f"❌ Error: No batch result for {filename}")
+            continue
+        llm_prediction, explanation = parse_response(response)
+        await write_to_csv_async(result_file, [filename, label, llm_prediction, explanation])
+
+
+async def write_propagated(row, representative, llm_prediction, explanation):
+    """
+    Writes the verdict of a near-duplicate's cluster representative.
+    """
+    await write_to_csv_async(result_file, [row['package_name'], row['label'], llm_prediction, explanation])
+
+
 if __name__ == "__main__":
     test_dataset = load_tests_files()
-    llm = LLM(model_name, api_key)
-    asyncio.run(simulate_test(llm, test_dataset))
+    if args.batch:
+        classify = simulate_batch
+    else:
+        llm = LLM(model_name, api_key)
+        classify = lambda rows: simulate_test(llm, rows)
+    if workqueue.enabled():
+        asyncio.run(workqueue.run(test_dataset, classify, written_packages))
+    else:
+        asyncio.run(dedupe.run(test_dataset, classify, write_propagated, lambda: dedupe.read_verdicts(result_file)))
+    tracing.print_summary()
+    usage.print_summary()
+    prompts.print_summary(model_name)
+    explanations.print_summary()
+    dedupe.print_summary()
+    workqueue.print_summary()
+    snippets.print_summary()
+    triage.print_summary()
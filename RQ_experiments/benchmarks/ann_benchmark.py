@@ -0,0 +1,126 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+from run_benchmark import percentile
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "RAG_experiments" / "knowledge_base_setup"))
+from manage_indexes import COLLECTIONS, EMBEDDING_TABLE, OPERATOR_CLASSES, collection_uuid, connect, index_name
+
+
+DISTANCE_OPERATORS = {"cosine": "<=>", "l2": "<->", "ip": "<#>"}
+
+
+def sample_queries(connection, uuid: str, count: int, seed: float) -> list:
+    """
+    Uses stored embeddings of the collection as query vectors, sampled reproducibly.
+    """
+    connection.execute("SELECT setseed(%s)", (seed,))
+    return [row[0] for row in connection.execute(
+        f"SELECT embedding::text FROM {EMBEDDING_TABLE} WHERE collection_id = %s ORDER BY random() LIMIT %s",
+        (uuid, count))]
+
+
+def search(connection, uuid: str, query: str, k: int, operator: str) -> tuple:
+    """
+    Runs the top-k query PGVector sends and returns (ids, seconds).
+    """
+    start = time.perf_counter()
+    rows = connection.execute(
+        f"SELECT id FROM {EMBEDDING_TABLE} WHERE collection_id = %s "
+        f"ORDER BY embedding {operator} %s::vector LIMIT %s", (uuid, query, k)).fetchall()
+    return [row[0] for row in rows], time.perf_counter() - start
+
+
+def has_index(connection, collection_name: str, method: str) -> bool:
+    return connection.execute("SELECT to_regclass(%s)", (index_name(collection_name, method),)).fetchone()[0] is not None
+
+
+def uses_index(connection, uuid: str, query: str, k: int, operator: str) -> bool:
+    plan = connection.execute(
+        f"EXPLAIN (FORMAT JSON) SELECT id FROM {EMBEDDING_TABLE} WHERE collection_id = %s "
+        f"ORDER BY embedding {operator} %s::vector LIMIT %s", (uuid, query, k)).fetchone()[0]
+    return "Index Scan" in json.dumps(plan)
+
+
+def run_setting(connection, uuid: str, queries: list, exact: list, k: int, operator: str, setting: str = None, value: int = None) -> dict:
+    with connection.transaction():
+        if setting:
+            connection.execute(f"SET LOCAL {setting} = {int(value)}")
+        latencies, recalls = [], []
+        for query, truth in zip(queries, exact):
+            ids, seconds = search(connection, uuid, query, k, operator)
+            latencies.append(seconds)
+            recalls.append(len(set(ids) & set(truth)) / max(1, len(truth)))
+        indexed = uses_index(connection, uuid, queries[0], k, operator) if queries else False
+    return {
+        "setting": f"{setting}={value}" if setting else "default",
+        "recall": sum(recalls) / max(1, len(recalls)),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "index_scan": indexed,
+    }
+
+
+def exact_search(connection, uuid: str, queries: list, k: int, operator: str) -> tuple:
+    """
+    Ground truth: the same queries with index scans disabled, i.e. a sequential scan.
+    """
+    with connection.transaction():
+        connection.execute("SET LOCAL enable_indexscan = off")
+        connection.execute("SET LOCAL enable_bitmapscan = off")
+        results = [search(connection, uuid, query, k, operator) for query in queries]
+    latencies = [seconds for _, seconds in results]
+    row = {"setting": "exact (seq scan)", "recall": 1.0, "p50": percentile(latencies, 0.50),
+           "p95": percentile(latencies, 0.95), "index_scan": False}
+    return [ids for ids, _ in results], row
+
+
+def print_report(collection_name: str, rows: list):
+    print(f"\n{collection_name}")
+    header = f"{'setting':<24}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}{'index':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['setting']:<24}{row['recall']:>10.3f}{row['p50'] * 1000:>9.2f}{row['p95'] * 1000:>9.2f}"
+              f"{'yes' if row['index_scan'] else 'no':>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the pgvector ANN indexes against exact search.")
+    parser.add_argument("--collection", action="append", default=None, help="Collection to benchmark, may be repeated.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=4, help="Results per query (the CRAG flows use 4).")
+    parser.add_argument("--distance", choices=sorted(OPERATOR_CLASSES), default="cosine")
+    parser.add_argument("--ef_search", type=int, nargs="*", default=[10, 20, 40, 80, 160, 320])
+    parser.add_argument("--probes", type=int, nargs="*", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=float, default=0.42)
+    parser.add_argument("--output", type=str, help="Optional JSON file for the report.")
+    args = parser.parse_args()
+    operator = DISTANCE_OPERATORS[args.distance]
+
+    report = {}
+    with connect() as connection:
+        for collection_name in args.collection or COLLECTIONS:
+            uuid = collection_uuid(connection, collection_name)
+            queries = sample_queries(connection, uuid, args.queries, args.seed)
+            exact, row = exact_search(connection, uuid, queries, args.k, operator)
+            rows = [row, run_setting(connection, uuid, queries, exact, args.k, operator)]
+            if has_index(connection, collection_name, "hnsw"):
+                rows += [run_setting(connection, uuid, queries, exact, args.k, operator, "hnsw.ef_search", value)
+                         for value in args.ef_search]
+            if has_index(connection, collection_name, "ivfflat"):
+                rows += [run_setting(connection, uuid, queries, exact, args.k, operator, "ivfflat.probes", value)
+                         for value in args.probes]
+            print_report(collection_name, rows)
+            report[collection_name] = rows
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
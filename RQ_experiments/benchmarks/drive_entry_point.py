@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import time
+import shlex
+import asyncio
+import argparse
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+
+
+EXPERIMENTS_DIR = Path(__file__).resolve().parents[1]
+
+# name -> (script, extra command line arguments, driver)
+ENTRY_POINTS = {
+    "simple_rag_yara": ("RAG_experiments/Simple_RAG/simulate_yara_rag.py", ["-m", "{model}"], "simple_rag"),
+    "simple_rag_git_adv": ("RAG_experiments/Simple_RAG/simulate_git_adv_rag.py", ["-m", "{model}"], "simple_rag"),
+    "simple_rag_mal_code": ("RAG_experiments/Simple_RAG/simulate_mal_code_rag.py", ["-m", "{model}"], "simple_rag"),
+    "crag_code_flow": ("RAG_experiments/CRAG/main_crag_code_flow.py", [], "crag"),
+    "crag_ast_flow": ("RAG_experiments/CRAG/main_crag_ast_flow.py", [], "crag"),
+    "zero_shot_baseline": ("Zero_shot_baseline_llama3_1_8b/simulate_test.py", ["-m", "{model}"], "zero_shot"),
+    "zsp": ("zero_shot_prompting_baseline_package_classifier/main.py", [], "zsp"),
+}
+
+
+def load_entry_point(script: Path, argv: list):
+    """
+    Imports an experiment script as a module, with its own folder on the import path and the given argv.
+    """
+    sys.path.insert(0, str(script.parent))
+    sys.argv = [str(script), *argv]
+    spec = importlib.util.spec_from_file_location("entry_point", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def drive(module, driver: str, packages: list) -> list:
+    """
+    Classifies the packages one at a time and returns the latency of each.
+    """
+    llm = module.LLM(module.model_name, module.api_key) if driver == "zero_shot" else None
+    latencies = []
+    for package in packages:
+        row = pd.DataFrame([package])
+        started = time.perf_counter()
+        if driver == "simple_rag":
+            await module.simulate_test(row)
+        elif driver == "crag":
+            await module.classify_pipeline(row)
+        elif driver == "zero_shot":
+            await module.simulate_test(llm, row)
+        else:
+            await module.classify_files(package["files"], module.MODEL_NAME, module.API_KEY)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drives one experiment entry point over a synthetic dataset.")
+    parser.add_argument("entry_point", choices=sorted(ENTRY_POINTS))
+    parser.add_argument("--dataset", type=str, required=True, help="JSONL file of synthetic packages.")
+    parser.add_argument("--result_file", type=str, required=True)
+    parser.add_argument("--report", type=str, required=True, help="Where to write the latency report (JSON).")
+    parser.add_argument("--model", choices=["gpt", "llama"], default="llama")
+    parser.add_argument("--entry_args", type=str, default="",
+                        help="Extra arguments for the entry point, e.g. \"--stream --stream_explanation cancel\".")
+    args = parser.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as file:
+        packages = [json.loads(line) for line in file if line.strip()]
+
+    script, extra_argv, driver = ENTRY_POINTS[args.entry_point]
+    argv = [arg.format(model=args.model) for arg in extra_argv]
+    if driver != "zsp":
+        argv += ["--result_file", args.result_file]
+    argv += shlex.split(args.entry_args)
+    os.chdir(EXPERIMENTS_DIR)
+    module = load_entry_point(EXPERIMENTS_DIR / script, argv)
+
+    started = time.perf_counter()
+    latencies = asyncio.run(drive(module, driver, packages))
+    wall_seconds = time.perf_counter() - started
+
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump({"entry_point": args.entry_point, "packages": len(packages),
+                   "wall_seconds": wall_seconds, "latencies": latencies}, file)
+
+
+if __name__ == "__main__":
+    main()
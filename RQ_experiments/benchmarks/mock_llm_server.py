@@ -0,0 +1,267 @@
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common.batch import example_from_schema
+
+
+class LatencyDistribution:
+    """
+    Samples synthetic latencies (seconds) from a spec such as `constant:0.2`, `uniform:0.1,0.5`
+    or `lognormal:0.3,0.6` (median, sigma).
+    """
+
+    def __init__(self, spec: str, seed: int = None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(x) for x in params.split(",") if x]
+        self.random = random.Random(seed)
+        if kind not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution '{spec}'")
+
+    def sample(self) -> float:
+        if self.kind == "constant":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return self.random.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return self.random.lognormvariate(0.0, sigma) * median
+
+
+class MockLLMState:
+    """
+    Configuration and request counters shared by the request handlers.
+    """
+
+    def __init__(self, latency: LatencyDistribution, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 malicious_rate: float = 0.5, embedding_dim: int = 1536, seed: int = None, token_latency: float = 0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malicious_rate = malicious_rate
+        self.embedding_dim = embedding_dim
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"chat": 0, "embeddings": 0, "errors": 0, "rate_limited": 0}
+
+    def count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+
+def response_schema(body: dict):
+    """
+    Extracts the JSON schema from an OpenAI (`json_schema`) or TGI (`json`) response_format.
+    """
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["schema"]
+    if response_format.get("type") == "json":
+        value = dict(response_format.get("value", {}))
+        value.setdefault("type", "object")
+        return value
+    return None
+
+
+def canned_content(body: dict, state: MockLLMState) -> str:
+    """
+    Builds a schema-valid answer, flagging a configurable share of packages as malicious.
+    """
+    schema = response_schema(body)
+    if schema is None:
+        return "no"
+    answer = example_from_schema(schema)
+    malicious = state.roll() < state.malicious_rate
+
+    def fill(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key == "prediction":
+                    value[key] = malicious
+                elif key in ("grade",):
+                    value[key] = "yes" if malicious else "no"
+                elif key in ("level",):
+                    value[key] = "high" if malicious else "low"
+                elif "Classification" in key:
+                    value[key] = "Malicious" if malicious else "Benign"
+                elif "Score" in key:
+                    value[key] = 90 if malicious else 5
+                elif "xplanation" in key:
+                    value[key] = "Synthetic explanation from the mock server. It is not a real analysis."
+                else:
+                    fill(item)
+        return value
+
+    return json.dumps(fill(answer))
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+def make_handler(state: MockLLMState):
+
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, body: dict, content: str, usage: dict):
+            """
+            Sends the answer as server-sent chat-completion chunks of about one token each.
+            """
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": body.get("model", "mock-model"), "system_fingerprint": "mock"}
+            pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+            try:
+                for index, piece in enumerate(pieces):
+                    finish_reason = "stop" if index == len(pieces) - 1 else None
+                    chunk = dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": piece},
+                                                 "logprobs": None, "finish_reason": finish_reason}])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if state.token_latency:
+                        time.sleep(state.token_latency)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client cancelled the rest of the answer.
+                pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") in ("/health", "/healthz"):
+                self._send_json(200, {"status": "ok"})
+            elif self.path.rstrip("/") == "/stats":
+                with state.lock:
+                    self._send_json(200, dict(state.counters))
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(state.latency.sample())
+
+            roll = state.roll()
+            if roll < state.rate_limit_rate:
+                state.count("rate_limited")
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                headers={"Retry-After": "1"})
+                return
+            if roll < state.rate_limit_rate + state.error_rate:
+                state.count("errors")
+                self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                return
+
+            if self.path.endswith("/embeddings"):
+                state.count("embeddings")
+                inputs = body.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._send_json(200, {
+                    "object": "list",
+                    "model": body.get("model", "mock-embedding"),
+                    "data": [{"object": "embedding", "index": i,
+                              "embedding": fake_embedding(str(text), state.embedding_dim)}
+                             for i, text in enumerate(inputs)],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                })
+            elif self.path.endswith("/chat/completions"):
+                state.count("chat")
+                content = canned_content(body, state)
+                prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+                completion_tokens = len(content) // 4
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+                if body.get("stream"):
+                    self._send_stream(body, content, usage)
+                    return
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock-model"),
+                    "system_fingerprint": "mock",
+                    "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                })
+            else:
+                self._send_json(404, {"error": "not found"})
+
+    return MockLLMHandler
+
+
+def start_server(state: MockLLMState, host: str = "127.0.0.1", port: int = 0):
+    """
+    Starts the mock server on a background thread and returns it; `server.server_port` holds the bound port.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=str, default="lognormal:0.2,0.5",
+                        help="Latency distribution: constant:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Share of requests answered with a 429.")
+    parser.add_argument("--malicious_rate", type=float, default=0.5, help="Share of packages predicted malicious.")
+    parser.add_argument("--token_latency", type=float, default=0.01,
+                        help="Delay between streamed chunks (about one token each) when a client sets stream=true.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latencies and injected failures.")
+
+
+def state_from_args(args) -> MockLLMState:
+    return MockLLMState(LatencyDistribution(args.latency, args.seed), error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, malicious_rate=args.malicious_rate, seed=args.seed,
+                        token_latency=args.token_latency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI/TGI-compatible mock LLM server with synthetic latency.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state_from_args(args)))
+    print(f"🚀 Mock LLM server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
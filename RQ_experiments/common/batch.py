@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_FILE = 50000  # OpenAI Batch API limit per input file
+
+
+def build_request(custom_id: str, model: str, messages: list, response_format: dict, max_tokens: int = 500) -> dict:
+    """
+    Builds one line of a chat-completions batch input file.
+    """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": messages,
+            "response_format": response_format,
+            "max_tokens": max_tokens,
+        },
+    }
+
+
+def write_batch_files(requests: list, batch_dir, prefix: str = "batch") -> list:
+    """
+    Serialises the requests to JSONL batch files of at most MAX_REQUESTS_PER_FILE lines each.
+    """
+    batch_dir = Path(batch_dir)
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for start in range(0, len(requests), MAX_REQUESTS_PER_FILE):
+        path = batch_dir / f"{prefix}_{start // MAX_REQUESTS_PER_FILE:04d}.jsonl"
+        with open(path, "w", encoding="utf-8") as file:
+            for request in requests[start:start + MAX_REQUESTS_PER_FILE]:
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        paths.append(path)
+    return paths
+
+
+def read_batch_results(path) -> dict:
+    """
+    Reads a batch output file into {custom_id: message content}, with None for failed requests.
+    """
+    results = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                print(f"❌ Batch request {record.get('custom_id')} failed: {record.get('error')}")
+                results[record["custom_id"]] = None
+                continue
+            results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+def example_from_schema(schema: dict):
+    """
+    Builds a value that validates against a (simple) JSON schema.
+    """
+    schema_type = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        return {key: example_from_schema(value) for key, value in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [example_from_schema(schema.get("items", {}))]
+    if schema_type == "boolean":
+        return False
+    if schema_type in ("integer", "number"):
+        return schema.get("minimum", 0)
+    return "mock"
+
+
+class BatchBackend(ABC):
+    """
+    Submits batch input files and returns the path of their output files.
+    """
+
+    @abstractmethod
+    def submit(self, input_path) -> str:
+        """
+        Returns the id of the batch created from the input file.
+        """
+
+    @abstractmethod
+    def poll(self, batch_id: str) -> str:
+        """
+        Returns one of 'in_progress', 'completed' or 'failed'.
+        """
+
+    @abstractmethod
+    def download(self, batch_id: str, output_path) -> Path:
+        """
+        Writes the output file of a completed batch to `output_path`.
+        """
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Runs batches through the OpenAI Batch API.
+    """
+
+    def __init__(self, api_key: str, completion_window: str = "24h"):
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=api_key)
+        self.completion_window = completion_window
+
+    def submit(self, input_path) -> str:
+        with open(input_path, "rb") as file:
+            uploaded = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=CHAT_COMPLETIONS_ENDPOINT,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return "completed"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    def download(self, batch_id: str, output_path) -> Path:
+        batch = self.client.batches.retrieve(batch_id)
+        content = self.client.files.content(batch.output_file_id)
+        Path(output_path).write_bytes(content.read())
+        return Path(output_path)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for the Batch API: answers every request with `responder(body)`,
+    which defaults to a schema-valid canned response.
+    """
+
+    def __init__(self, work_dir, responder=None):
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.responder = responder or self.canned_response
+
+    @staticmethod
+    def canned_response(body: dict) -> str:
+        # OpenAI (`json_schema`) or TGI (`json`) response formats
+        response_format = body["response_format"]
+        schema = response_format["json_schema"]["schema"] if "json_schema" in response_format else response_format["value"]
+        return json.dumps(example_from_schema(schema))
+
+    def submit(self, input_path) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        with open(input_path, "r", encoding="utf-8") as source, \
+                open(self.work_dir / f"{batch_id}.jsonl", "w", encoding="utf-8") as output:
+            for line in source:
+                request = json.loads(line)
+                record = {
+                    "id": f"req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"role": "assistant",
+                                                          "content": self.responder(request["body"])}}]},
+                    },
+                    "error": None,
+                }
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        return "completed" if (self.work_dir / f"{batch_id}.jsonl").exists() else "failed"
+
+    def download(self, batch_id: str, output_path) -> Path:
+        Path(output_path).write_bytes((self.work_dir / f"{batch_id}.jsonl").read_bytes())
+        return Path(output_path)
+
+
+async def run_batch(requests: list, batch_dir, backend: BatchBackend, poll_interval: float = 60.0) -> dict:
+    """
+    Writes, submits and waits for the batch files, then returns {custom_id: message content}.
+    """
+    results = {}
+    batch_dir = Path(batch_dir)
+    for input_path in write_batch_files(requests, batch_dir):
+        batch_id = backend.submit(input_path)
+        print(f"📤 Submitted {input_path.name} as {batch_id}")
+        started = time.monotonic()
+        while (status := backend.poll(batch_id)) == "in_progress":
+            await asyncio.sleep(poll_interval)
+        if status != "completed":
+            print(f"❌ Batch {batch_id} {status}")
+            continue
+        output_path = backend.download(batch_id, batch_dir / f"{input_path.stem}_output.jsonl")
+        print(f"✅ Batch {batch_id} completed in {time.monotonic() - started:.0f}s")
+        results.update(read_batch_results(output_path))
+    return results
+
+
+def add_arguments(parser):
+    """
+    Adds the batch-submission options to an experiment's argument parser.
+    """
+    parser.add_argument("--batch", action="store_true",
+                        help="Classify the whole dataset through a batch backend instead of interactive calls.")
+    parser.add_argument("--batch_backend", choices=["openai", "local"], default="openai",
+                        help="Batch backend to submit to ('openai' needs --model gpt; 'local' is a file-based stand-in for any model).")
+    parser.add_argument("--batch_dir", type=str, default="batches",
+                        help="Directory for the batch input and output files.")
+    parser.add_argument("--batch_poll_interval", type=float, default=60.0,
+                        help="Seconds between batch status checks.")
+
+
+def get_backend(args) -> BatchBackend:
+    if args.batch_backend == "local":
+        return LocalBatchBackend(Path(args.batch_dir) / "local_backend")
+    return OpenAIBatchBackend(api_key=os.getenv("OPENAI_API_KEY"))
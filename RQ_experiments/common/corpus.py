@@ -0,0 +1,216 @@
+import json
+import mmap
+import time
+import random
+import hashlib
+import argparse
+from pathlib import Path
+from collections.abc import Mapping
+
+import numpy as np
+
+
+FILES = {
+    "blobs": "blobs.bin",
+    "manifests": "manifests.jsonl",
+    # The index is two arrays sorted by key hash: the hashes, and (offset, length) of each manifest line. The
+    # hashes are contiguous so a binary search over the memory map only touches ~log2(n) pages.
+    "hashes": "hashes.npy",
+    "locations": "locations.npy",
+    "meta": "meta.json",
+}
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class PackageFiles(Mapping):
+    """
+    `{filename: {"content", "file path"}}` view of one package, as `classify_files` expects. Contents are
+    only decoded from the memory-mapped blobs when a file is accessed.
+    """
+
+    def __init__(self, blobs, files: list):
+        self.blobs = blobs
+        self.files = {filename: (path, offset, length) for filename, path, offset, length in files}
+
+    def __getitem__(self, filename):
+        path, offset, length = self.files[filename]
+        return {"content": self.blobs[offset:offset + length].decode("utf-8", errors="replace"), "file path": path}
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def to_dict(self) -> dict:
+        return {filename: self[filename] for filename in self}
+
+
+class Corpus:
+    """
+    Read side of a packed corpus directory. Opening maps the files without reading them, so startup and
+    a lookup (binary search over the memory-mapped index, one manifest line) do not grow with the corpus.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / FILES["meta"], "r", encoding="utf-8") as file:
+            self.meta = json.load(file)
+        self.hashes = np.load(self.path / FILES["hashes"], mmap_mode="r")
+        self.locations = np.load(self.path / FILES["locations"], mmap_mode="r")
+        self.blobs = self._map(FILES["blobs"])
+        self.manifests = self._map(FILES["manifests"])
+
+    def _map(self, name: str):
+        with open(self.path / name, "rb") as file:
+            if not file.seek(0, 2):
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _manifest(self, offset: int, length: int) -> dict:
+        return json.loads(self.manifests[offset:offset + length])
+
+    def get(self, key: str, default=None):
+        target = np.uint64(key_hash(key))
+        position = int(np.searchsorted(self.hashes, target))
+        # Colliding hashes are adjacent; the manifest carries the key to tell them apart.
+        while position < len(self.hashes) and self.hashes[position] == target:
+            offset, length = self.locations[position]
+            manifest = self._manifest(int(offset), int(length))
+            if manifest["key"] == key:
+                return PackageFiles(self.blobs, manifest["files"])
+            position += 1
+        return default
+
+    def __getitem__(self, key: str) -> PackageFiles:
+        files = self.get(key)
+        if files is None:
+            raise KeyError(key)
+        return files
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def items(self):
+        """
+        Yields (key, PackageFiles) in key order by scanning the manifests sequentially.
+        """
+        start = 0
+        while start < len(self.manifests):
+            end = self.manifests.find(b"\n", start)
+            end = len(self.manifests) if end < 0 else end
+            manifest = self._manifest(start, end - start)
+            yield manifest["key"], PackageFiles(self.blobs, manifest["files"])
+            start = end + 1
+
+    def keys(self) -> list:
+        return [key for key, _ in self.items()]
+
+
+class CorpusWriter:
+    """
+    Appends packages to a new corpus directory. File contents are stored once per content hash.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.blobs = open(self.path / FILES["blobs"], "wb")
+        self.manifests = open(self.path / FILES["manifests"], "wb")
+        self.blob_offsets = {}
+        self.rows = []
+        self.stats = {"packages": 0, "files": 0, "bytes": 0, "stored_bytes": 0}
+
+    def _store(self, content: str) -> tuple:
+        data = content.encode("utf-8")
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest not in self.blob_offsets:
+            self.blob_offsets[digest] = (self.blobs.tell(), len(data))
+            self.blobs.write(data)
+            self.stats["stored_bytes"] += len(data)
+        self.stats["bytes"] += len(data)
+        return self.blob_offsets[digest]
+
+    def add(self, key: str, files_data: dict):
+        files = []
+        for filename, info in files_data.items():
+            offset, length = self._store(str(info.get("content") or ""))
+            files.append([filename, info.get("file path", filename), offset, length])
+        line = json.dumps({"key": key, "files": files}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.rows.append((key_hash(key), self.manifests.tell(), len(line)))
+        self.manifests.write(line + b"\n")
+        self.stats["packages"] += 1
+        self.stats["files"] += len(files)
+
+    def close(self):
+        self.blobs.close()
+        self.manifests.close()
+        rows = np.array(self.rows, dtype=np.uint64).reshape(-1, 3)
+        order = np.argsort(rows[:, 0], kind="stable")
+        np.save(self.path / FILES["hashes"], np.ascontiguousarray(rows[order, 0]))
+        np.save(self.path / FILES["locations"], np.ascontiguousarray(rows[order, 1:]))
+        with open(self.path / FILES["meta"], "w", encoding="utf-8") as file:
+            json.dump(self.stats, file)
+        return self.stats
+
+
+def convert(package_dir, output) -> dict:
+    """
+    Packs a `sample_packages`-style tree of per-package JSON files. Keys are the JSON paths relative to
+    `package_dir` (e.g. `pkg-1.0/pkg-1.0.json`), in sorted order like the ZSP runner's `rglob`.
+    """
+    package_dir = Path(package_dir)
+    writer = CorpusWriter(output)
+    errors = 0
+    for path in sorted(package_dir.rglob("*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                files_data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"❌ {path}: {e}")
+            errors += 1
+            continue
+        writer.add(path.relative_to(package_dir).as_posix(), files_data)
+    stats = writer.close()
+    saved = 1 - stats["stored_bytes"] / stats["bytes"] if stats["bytes"] else 0.0
+    print(f"✅ Packed {stats['packages']} packages ({stats['files']} files) into {output}: "
+          f"{stats['stored_bytes'] / 2 ** 20:.1f} MB of contents stored, {saved:.1%} saved by content dedupe, {errors} errors")
+    return stats
+
+
+def benchmark(path, lookups: int = 1000, seed: int = 0):
+    start = time.perf_counter()
+    corpus = Corpus(path)
+    opened = time.perf_counter() - start
+    keys = random.Random(seed).sample(corpus.keys(), min(lookups, len(corpus)))
+    start = time.perf_counter()
+    for key in keys:
+        files = corpus[key]
+        for filename in files:
+            files[filename]["content"]
+    elapsed = time.perf_counter() - start
+    print(f"{len(corpus)} packages: opened in {opened * 1000:.2f} ms, "
+          f"{elapsed / max(1, len(keys)) * 1e6:.0f} µs per package load (all files decoded)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packed, memory-mapped corpus of structured packages.")
+    parser.add_argument("command", choices=["build", "get", "benchmark"])
+    parser.add_argument("corpus", help="Corpus directory.")
+    parser.add_argument("--source", default="data/structured_output_plain/sample_packages",
+                        help="build: directory of per-package JSON files.")
+    parser.add_argument("--key", help="get: package key, e.g. pkg-1.0/pkg-1.0.json.")
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+    if args.command == "build":
+        convert(args.source, args.corpus)
+    elif args.command == "get":
+        print(json.dumps(Corpus(args.corpus)[args.key].to_dict(), indent=4, ensure_ascii=False))
+    else:
+        benchmark(args.corpus, args.lookups)
@@ -0,0 +1,281 @@
+import os
+import re
+import random
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+THRESHOLD = 0.9
+
+# Mersenne prime of the universal hash family, as in datasketch.
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+NAME_PART_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9]{2,}")
+
+
+def _hash32(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def mask_package_name(text: str, package_name: str) -> str:
+    """
+    Replaces the parts of the package name in the text, so `selfurlrandomver` and `selfintmaskreplace`
+    variants of one campaign template look alike.
+    """
+    for part in NAME_PART_PATTERN.findall(package_name or ""):
+        text = re.sub(re.escape(part), "PKG", text, flags=re.IGNORECASE)
+    return text
+
+
+def shingles(text: str, file_list=None, package_name: str = None, size: int = SHINGLE_SIZE) -> set:
+    """
+    Word `size`-grams of the (name-masked) setup.py, plus one shingle per (name-masked) file path.
+    """
+    words = WORD_PATTERN.findall(mask_package_name(text or "", package_name))
+    result = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    for path in file_list if isinstance(file_list, (list, tuple)) else []:
+        result.add("file:" + mask_package_name(str(path), package_name))
+    result.discard("")
+    return result
+
+
+class MinHasher:
+    """
+    MinHash signatures of shingle sets under `num_perm` universal hash functions.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set):
+        if not shingle_set:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((_hash32(shingle) for shingle in shingle_set), dtype=np.uint64, count=len(shingle_set))
+        permuted = ((hashes[:, None] * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0)
+
+
+def estimate_jaccard(first, second) -> float:
+    return float(np.mean(first == second))
+
+
+def lsh_parameters(threshold: float, num_perm: int) -> tuple:
+    """
+    Picks (bands, rows) with bands * rows = num_perm whose S-curve threshold (1 / bands) ** (1 / rows)
+    is closest to `threshold`.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1.0 / option[0]) ** (1.0 / option[1]) - threshold))
+
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing over MinHash signatures: documents sharing any band are candidates.
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, num_perm: int = NUM_PERM):
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+
+    def _keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def insert(self, key, signature):
+        for band, band_key in self._keys(signature):
+            self.buckets[band][band_key].append(key)
+
+    def query(self, signature) -> set:
+        candidates = set()
+        for band, band_key in self._keys(signature):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        return candidates
+
+
+def cluster(items, threshold: float = THRESHOLD, num_perm: int = NUM_PERM) -> dict:
+    """
+    Groups near-duplicate packages. `items` are (key, text, file_list, package_name) in processing order.
+    Returns {key: (representative key, estimated similarity)}; the representative is the first member
+    seen, and a package joins a cluster only if it is within `threshold` of that representative.
+    """
+    hasher = MinHasher(num_perm)
+    index = LSHIndex(threshold, num_perm)
+    signatures, assignment = {}, {}
+    for key, text, file_list, package_name in items:
+        signature = hasher.signature(shingles(text, file_list, package_name))
+        best, best_similarity = None, 0.0
+        for candidate in index.query(signature):
+            similarity = estimate_jaccard(signature, signatures[candidate])
+            if similarity >= threshold and similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            # Only representatives are indexed, so clusters do not chain away from their representative.
+            signatures[key] = signature
+            index.insert(key, signature)
+            assignment[key] = (key, 1.0)
+        else:
+            assignment[key] = (best, best_similarity)
+    return assignment
+
+
+def read_verdicts(path) -> dict:
+    """
+    Reads {package_name: (prediction, explanation)} from a `filename,label,llm_prediction,explanation` result file.
+    """
+    verdicts = {}
+    if not path or not os.path.exists(path):
+        return verdicts
+    with open(path, "r", encoding="utf-8") as file:
+        next(file, None)
+        for line in file:
+            fields = line.rstrip("\n").split(",", 3)
+            if len(fields) == 4:
+                verdicts[fields[0]] = (fields[2], fields[3])
+    return verdicts
+
+
+class Deduplicator:
+    """
+    Sends one representative of each near-duplicate cluster to the LLM and propagates its verdict to the
+    other members, re-classifying a `spot_check` share of them to measure the agreement.
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, num_perm: int = NUM_PERM, spot_check: float = 0.0, seed: int = 0):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.spot_check = spot_check
+        self.random = random.Random(seed)
+        self.assignment = {}
+        self.spot_checked = {}
+        self.stats = {"packages": 0, "clusters": 0, "propagated": 0, "spot_checks": 0, "agreements": 0, "orphans": 0}
+
+    def split(self, test_dataset, text_column: str = "setup.py"):
+        """
+        Returns the representatives' rows and [(index, representative, similarity)] of the other rows.
+        """
+        items = ((row["package_name"], row[text_column] if isinstance(row[text_column], str) else "",
+                  row.get("file_list"), row["package_name"]) for _, row in test_dataset.iterrows())
+        self.assignment = cluster(items, self.threshold, self.num_perm)
+        representatives, followers = [], []
+        for index, row in test_dataset.iterrows():
+            representative, similarity = self.assignment[row["package_name"]]
+            if representative == row["package_name"]:
+                representatives.append(index)
+            else:
+                followers.append((index, representative, similarity))
+        self.stats["packages"] += len(test_dataset)
+        self.stats["clusters"] += len(representatives)
+        return test_dataset.loc[representatives], followers
+
+    async def propagate(self, test_dataset, followers: list, verdicts: dict, write):
+        """
+        Writes `await write(row, representative, prediction, explanation)` for the followers whose representative
+        has a verdict, and returns the rows that still need the LLM: spot checks and members of failed representatives.
+        """
+        remaining = []
+        for index, representative, similarity in followers:
+            row = test_dataset.loc[index]
+            if row["package_name"] in verdicts:
+                continue
+            if representative not in verdicts:
+                self.stats["orphans"] += 1
+                remaining.append(index)
+                continue
+            if self.random.random() < self.spot_check:
+                self.spot_checked[row["package_name"]] = representative
+                remaining.append(index)
+                continue
+            prediction, explanation = verdicts[representative]
+            await write(row, representative, prediction, f"Near-duplicate ({similarity:.2f}) of {representative}: {explanation}")
+            self.stats["propagated"] += 1
+        return test_dataset.loc[remaining]
+
+    def check(self, verdicts: dict):
+        """
+        Compares the spot-checked members with the verdict of their representative.
+        """
+        for package_name, representative in self.spot_checked.items():
+            if package_name in verdicts and representative in verdicts:
+                self.stats["spot_checks"] += 1
+                self.stats["agreements"] += verdicts[package_name][0] == verdicts[representative][0]
+
+    def print_summary(self):
+        if not self.stats["packages"]:
+            return
+        print(f"Near-duplicates: {self.stats['packages']} packages in {self.stats['clusters']} clusters, "
+              f"{self.stats['propagated']} verdicts propagated, {self.stats['orphans']} re-classified after a failed representative")
+        if self.stats["spot_checks"]:
+            print(f"Spot checks: {self.stats['agreements']}/{self.stats['spot_checks']} agree with their representative")
+
+
+class DedupeConfig:
+    """
+    Whether runners classify near-duplicate packages once, and the deduplicator doing it.
+    """
+
+    def __init__(self, enabled: bool = False, deduplicator: Deduplicator = None):
+        self.enabled = enabled
+        self.deduplicator = deduplicator
+
+
+_config = DedupeConfig()
+
+
+def enabled() -> bool:
+    return _config.enabled
+
+
+async def run(test_dataset, classify, write, verdicts, text_column: str = "setup.py"):
+    """
+    Runs `await classify(rows)` on the cluster representatives, propagates the verdicts returned by `verdicts()`
+    ({package_name: (prediction, explanation)}) through `write(row, representative, prediction, explanation)`,
+    then classifies the spot checks and orphans. Without --dedupe, classifies the whole dataset.
+    """
+    if not _config.enabled:
+        await classify(test_dataset)
+        return
+    deduplicator = _config.deduplicator
+    representatives, followers = deduplicator.split(test_dataset, text_column)
+    print(f"🔍 {len(test_dataset)} packages form {len(representatives)} near-duplicate clusters")
+    await classify(representatives)
+    remaining = await deduplicator.propagate(test_dataset, followers, verdicts(), write)
+    if len(remaining):
+        await classify(remaining)
+    deduplicator.check(verdicts())
+
+
+def print_summary():
+    if _config.deduplicator is not None:
+        _config.deduplicator.print_summary()
+
+
+def add_arguments(parser):
+    """
+    Adds the near-duplicate options to an experiment's argument parser.
+    """
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Classify one representative per near-duplicate cluster and propagate its verdict.")
+    parser.add_argument("--dedupe_threshold", type=float, default=THRESHOLD,
+                        help="Estimated Jaccard similarity above which packages are near-duplicates.")
+    parser.add_argument("--dedupe_spot_check", type=float, default=0.0,
+                        help="Share of the propagated verdicts re-classified by the LLM to check the agreement.")
+
+
+def configure(enabled: bool = False, threshold: float = THRESHOLD, spot_check: float = 0.0) -> DedupeConfig:
+    global _config
+    deduplicator = Deduplicator(threshold=threshold, spot_check=spot_check) if enabled else None
+    _config = DedupeConfig(enabled=enabled, deduplicator=deduplicator)
+    return _config
+
+
+def configure_from_args(args) -> DedupeConfig:
+    return configure(enabled=args.dedupe, threshold=args.dedupe_threshold, spot_check=args.dedupe_spot_check)
@@ -0,0 +1,312 @@
+import re
+import json
+import time
+import zlib
+import argparse
+from functools import lru_cache
+from collections import defaultdict
+
+import numpy as np
+
+
+# Answers of each CRAG grader, in the order of the model's outputs
+LABELS = {"grade": ["no", "yes"], "relevance": ["low", "medium", "high"]}
+
+# Hashed n-gram features per model, plus the dense overlap features after them
+DIMENSIONS = 2 ** 18
+DENSE = 3
+# Tokens of a snippet or document that are looked at
+MAX_TOKENS = 512
+# Below this probability the local grader leaves the pair to the LLM
+MIN_CONFIDENCE = 0.9
+
+TOKEN = re.compile(r"[a-z_][a-z0-9_]+")
+
+
+def hash_feature(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % DIMENSIONS
+
+
+@lru_cache(maxsize=4096)
+def _text_features(namespace: str, text: str, bigrams: bool) -> tuple:
+    """
+    Hashed unigrams (and bigrams) of a text and its token set. Cached: the snippet of a package is graded
+    against every retrieved document, and the same knowledge-base documents come back for many packages.
+    """
+    tokens = TOKEN.findall(text.lower())[:MAX_TOKENS]
+    features = [f"{namespace}:{token}" for token in tokens]
+    if bigrams:
+        features += [f"{namespace}2:{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    return np.array(sorted({hash_feature(feature) for feature in features}), dtype=np.int64), frozenset(tokens)
+
+
+def vectorize(code_snippet: str, document: str) -> tuple:
+    """
+    Sparse features of a (snippet, document) pair as (indices, values): the snippet's words, the document's
+    words and word pairs, the words they share, and how much they overlap. Each group is L2-normalised.
+    """
+    snippet_indices, snippet_tokens = _text_features("s", code_snippet, False)
+    document_indices, document_tokens = _text_features("d", document, True)
+    shared = snippet_tokens & document_tokens
+    shared_indices = np.array(sorted({hash_feature(f"b:{token}") for token in shared}), dtype=np.int64)
+    return sparse_row([snippet_indices, document_indices, shared_indices],
+                      [len(shared) / max(1, len(document_tokens)), len(shared) / max(1, len(snippet_tokens)),
+                       len(shared) / max(1, len(snippet_tokens | document_tokens))])
+
+
+def sparse_row(groups: list, dense: list) -> tuple:
+    """
+    One (indices, values) row from groups of hashed indices, each L2-normalised, and dense values stored
+    after the hashed dimensions.
+    """
+    groups = [group for group in groups if len(group)]
+    indices = np.concatenate(groups + [np.arange(DIMENSIONS, DIMENSIONS + len(dense))])
+    values = np.concatenate([np.full(len(group), 1.0 / np.sqrt(len(group)), dtype=np.float32) for group in groups]
+                            + [np.asarray(dense, dtype=np.float32)])
+    # Hash collisions between groups: one index per feature, with the summed value
+    indices, inverse = np.unique(indices, return_inverse=True)
+    return indices, np.bincount(inverse, weights=values).astype(np.float32)
+
+
+class LinearModel:
+    """
+    Multinomial logistic regression over sparse (indices, values) rows of hashed features, trained with AdaGrad.
+    A prediction sums a few hundred weight rows.
+    """
+
+    def __init__(self, labels: list, dimensions: int = DIMENSIONS + DENSE, weights=None, bias=None):
+        self.labels = list(labels)
+        self.weights = np.zeros((dimensions, len(labels)), dtype=np.float32) if weights is None else weights
+        self.bias = np.zeros(len(labels), dtype=np.float32) if bias is None else bias
+
+    def row_probabilities(self, indices, values):
+        scores = values @ self.weights[indices] + self.bias
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def fit_rows(self, rows: list, epochs: int = 5, learning_rate: float = 0.5, seed: int = 0):
+        """
+        Trains on (indices, values, label) rows, in a new random order each epoch.
+        """
+        targets = [self.labels.index(label) for _, _, label in rows]
+        squared = np.zeros_like(self.weights)
+        squared_bias = np.zeros_like(self.bias)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            for position in rng.permutation(len(rows)):
+                indices, values, _ = rows[position]
+                weights = self.weights[indices]
+                scores = values @ weights + self.bias
+                probabilities = np.exp(scores - scores.max())
+                probabilities /= probabilities.sum()
+                probabilities[targets[position]] -= 1.0
+                gradient = np.outer(values, probabilities)
+                squared[indices] += gradient ** 2
+                self.weights[indices] = weights - learning_rate * gradient / np.sqrt(squared[indices] + 1e-8)
+                squared_bias += probabilities ** 2
+                self.bias -= learning_rate * probabilities / np.sqrt(squared_bias + 1e-8)
+        return self
+
+
+class GraderModel(LinearModel):
+    """
+    A CRAG grader learnt from the LLM's answers, over the features of `vectorize`.
+    """
+
+    def probabilities(self, code_snippet: str, document: str):
+        return self.row_probabilities(*vectorize(code_snippet, document))
+
+    def predict(self, code_snippet: str, document: str) -> tuple:
+        """
+        Returns (label, probability of the label).
+        """
+        probabilities = self.probabilities(code_snippet, document)
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+    def fit(self, examples: list, epochs: int = 5, learning_rate: float = 0.5, seed: int = 0):
+        """
+        Trains on (code_snippet, document, label) examples.
+        """
+        rows = [(*vectorize(code_snippet, document), label) for code_snippet, document, label in examples]
+        return self.fit_rows(rows, epochs, learning_rate, seed)
+
+
+def save_models(models: dict, path: str):
+    arrays = {}
+    for task, model in models.items():
+        arrays.update({f"{task}.weights": model.weights, f"{task}.bias": model.bias, f"{task}.labels": np.array(model.labels)})
+    with open(path, "wb") as file:
+        np.savez_compressed(file, **arrays)
+
+
+def load_models(path: str) -> dict:
+    with np.load(path) as arrays:
+        return {task: GraderModel([str(label) for label in arrays[f"{task}.labels"]], weights=arrays[f"{task}.weights"],
+                                  bias=arrays[f"{task}.bias"])
+                for task in LABELS if f"{task}.weights" in arrays}
+
+
+def read_logs(paths: list) -> dict:
+    """
+    The logged LLM answers by grader: {task: [(code_snippet, document, label)]}.
+    """
+    examples = defaultdict(list)
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("label") in LABELS.get(entry.get("task"), ()):
+                    examples[entry["task"]].append((entry["code_snippet"], entry["document"], entry["label"]))
+    return examples
+
+
+def split(examples: list, holdout: float) -> tuple:
+    """
+    Held-out examples are chosen by snippet, so the evaluation only sees packages the model was not trained on.
+    """
+    train, test = [], []
+    for example in examples:
+        (test if zlib.crc32(example[0].encode("utf-8")) % 1000 < holdout * 1000 else train).append(example)
+    return train, test
+
+
+def report(task: str, model: GraderModel, examples: list, thresholds=(0.6, 0.7, 0.8, 0.9, 0.95, 0.99)):
+    """
+    Agreement with the LLM's answers, and how many LLM calls each confidence threshold would save.
+    """
+    start = time.perf_counter()
+    predictions = [model.predict(code_snippet, document) for code_snippet, document, _ in examples]
+    elapsed = time.perf_counter() - start
+    labels = [label for _, _, label in examples]
+    agreement = np.mean([label == predicted for (predicted, _), label in zip(predictions, labels)])
+    print(f"{task}: {len(examples)} pairs, {100 * agreement:.1f}% agree with the LLM, "
+          f"{elapsed / max(1, len(examples)) * 1e6:.0f} µs per pair")
+    print(f"  {'confidence':>10}{'local %':>9}{'local agree %':>15}{'overall agree %':>17}")
+    for threshold in thresholds:
+        local = [(predicted, label) for (predicted, confidence), label in zip(predictions, labels) if confidence >= threshold]
+        agree = sum(predicted == label for predicted, label in local)
+        # The pairs left to the LLM get the LLM's answer
+        overall = (agree + len(examples) - len(local)) / max(1, len(examples))
+        print(f"  {threshold:>10.2f}{100 * len(local) / max(1, len(examples)):>9.1f}"
+              f"{100 * agree / max(1, len(local)):>15.1f}{100 * overall:>17.1f}")
+
+
+def train(paths: list, out: str, holdout: float = 0.2, epochs: int = 5, learning_rate: float = 0.5, seed: int = 0) -> dict:
+    """
+    Fits one model per grader on the logs, reports it on the held-out snippets, then refits on every pair.
+    """
+    models = {}
+    for task, examples in read_logs(paths).items():
+        labels = sorted({label for _, _, label in examples})
+        if len(labels) < 2:
+            print(f"⚠️ {task}: only '{labels[0]}' answers in {len(examples)} pairs, no model trained")
+            continue
+        train_examples, test_examples = split(examples, holdout)
+        if train_examples and test_examples:
+            model = GraderModel(LABELS[task]).fit(train_examples, epochs, learning_rate, seed)
+            report(task, model, test_examples)
+        else:
+            print(f"⚠️ {task}: too few snippets to hold some out, training on all {len(examples)} pairs without a report")
+        models[task] = GraderModel(LABELS[task]).fit(examples, epochs, learning_rate, seed)
+    if models:
+        save_models(models, out)
+        print(f"✅ Saved the {', '.join(models)} grader(s) to {out}")
+    return models
+
+
+class DistillConfig:
+    """
+    Where the LLM grader answers are logged, the local grader models, and how the pairs were answered so far.
+    """
+
+    def __init__(self, log_path: str = None, model_path: str = None, min_confidence: float = MIN_CONFIDENCE):
+        self.log_path = log_path
+        self.model_path = model_path
+        self.models = load_models(model_path) if model_path else {}
+        self.min_confidence = min_confidence
+        self.stats = defaultdict(lambda: {"local": 0, "llm": 0, "logged": 0})
+        self.log = None
+
+
+_config = DistillConfig()
+
+
+def local_grade(task: str, code_snippet: str, document: str):
+    """
+    The local grader's answer when it is confident enough, else None and the LLM is asked.
+    """
+    model = _config.models.get(task)
+    if model is None:
+        return None
+    label, confidence = model.predict(code_snippet, document)
+    if confidence < _config.min_confidence:
+        return None
+    _config.stats[task]["local"] += 1
+    return label
+
+
+def record(task: str, code_snippet: str, document: str, label: str):
+    """
+    Logs an answer of the LLM grader as a training example.
+    """
+    stats = _config.stats[task]
+    stats["llm"] += 1
+    if not _config.log_path:
+        return
+    if _config.log is None:
+        _config.log = open(_config.log_path, "a", encoding="utf-8")
+    _config.log.write(json.dumps({"task": task, "code_snippet": code_snippet, "document": document, "label": label}) + "\n")
+    _config.log.flush()
+    stats["logged"] += 1
+
+
+def print_summary():
+    for task, stats in _config.stats.items():
+        answered = stats["local"] + stats["llm"]
+        logged = f", {stats['logged']} logged to {_config.log_path}" if stats["logged"] else ""
+        print(f"Grader {task}: {stats['local']} of {answered} pairs answered locally "
+              f"({100 * stats['local'] / max(1, answered):.0f}%), {stats['llm']} LLM calls{logged}")
+
+
+def add_arguments(parser):
+    """
+    Adds the grader logging and local grader options to a CRAG runner's argument parser.
+    """
+    parser.add_argument("--grader_log", type=str, default=None,
+                        help="Append every LLM grader answer (snippet, document, answer) to this JSONL file, for `python -m common.distill train`.")
+    parser.add_argument("--grader_model", type=str, default=None,
+                        help="Local grader models trained by `python -m common.distill train`; the LLM is only asked below --grader_confidence.")
+    parser.add_argument("--grader_confidence", type=float, default=MIN_CONFIDENCE,
+                        help="Probability from which the local grader's answer is used.")
+
+
+def configure(log_path: str = None, model_path: str = None, min_confidence: float = MIN_CONFIDENCE) -> DistillConfig:
+    global _config
+    _config = DistillConfig(log_path=log_path, model_path=model_path, min_confidence=min_confidence)
+    return _config
+
+
+def configure_from_args(args) -> DistillConfig:
+    return configure(log_path=args.grader_log, model_path=args.grader_model, min_confidence=args.grader_confidence)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or evaluate the local relevance graders on logged LLM grader answers.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("logs", nargs="+", help="JSONL files written with --grader_log.")
+    parser.add_argument("--model", type=str, default="grader_model.npz", help="Models written by train, read by evaluate.")
+    parser.add_argument("--holdout", type=float, default=0.2, help="train: share of the snippets held out for the report.")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--learning_rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.command == "train":
+        train(args.logs, args.model, args.holdout, args.epochs, args.learning_rate, args.seed)
+    else:
+        models = load_models(args.model)
+        for task, examples in read_logs(args.logs).items():
+            if task in models:
+                report(task, models[task], examples)
@@ -0,0 +1,194 @@
+import os
+import csv
+import copy
+import random
+import asyncio
+import itertools
+
+from common import tracing, usage
+
+
+# Output tokens of a verdict-only answer, e.g. {"filename": "...", "result": {"prediction": true}}.
+VERDICT_MAX_TOKENS = 48
+
+POSITIVE_VERDICTS = (True, 1, "1", "true", "malicious")
+
+
+def _strip_explanations(schema: dict):
+    properties = schema.get("properties")
+    if not isinstance(properties, dict):
+        return
+    for key in [key for key in properties if "xplanation" in key]:
+        del properties[key]
+    if isinstance(schema.get("required"), list):
+        schema["required"] = [key for key in schema["required"] if "xplanation" not in key]
+    for value in properties.values():
+        if isinstance(value, dict):
+            _strip_explanations(value)
+
+
+def verdict_only_format(response_format: dict) -> dict:
+    """
+    Returns a copy of an OpenAI (`json_schema`) or TGI (`json`) response format without its explanation fields.
+    """
+    verdict_format = copy.deepcopy(response_format)
+    if verdict_format.get("type") == "json_schema":
+        verdict_format["json_schema"]["name"] += "_verdict"
+        _strip_explanations(verdict_format["json_schema"]["schema"])
+    else:
+        _strip_explanations(verdict_format["value"])
+    return verdict_format
+
+
+def is_positive(prediction) -> bool:
+    if isinstance(prediction, str):
+        return prediction.strip().lower() in POSITIVE_VERDICTS
+    return prediction in POSITIVE_VERDICTS
+
+
+class ExplanationQueue:
+    """
+    Generates explanations after the verdicts, off the verdict path.
+
+    Malicious verdicts are always explained, a `sample` share of the benign ones too. Jobs are served
+    positives first by a small pool of background workers, and the explanations are appended to a CSV file.
+    """
+
+    def __init__(self, path: str, workers: int = 1, sample: float = 0.0, seed: int = None):
+        self.path = path
+        self.workers = workers
+        self.sample = sample
+        self.random = random.Random(seed)
+        self.queue = None
+        self.tasks = []
+        self.order = itertools.count()
+        self.stats = {"verdicts": 0, "queued": 0, "explained": 0, "failed": 0}
+
+    def wants(self, prediction) -> bool:
+        return is_positive(prediction) or self.random.random() < self.sample
+
+    def submit(self, package_name: str, prediction, explain):
+        """
+        Queues `await explain()` (returning the explanation text) if the verdict should be explained.
+        """
+        self.stats["verdicts"] += 1
+        if not self.wants(prediction):
+            return
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+            self.tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        priority = 0 if is_positive(prediction) else 1
+        self.queue.put_nowait((priority, next(self.order), package_name, prediction, explain))
+        self.stats["queued"] += 1
+
+    async def _worker(self):
+        while True:
+            _, _, package_name, prediction, explain = await self.queue.get()
+            try:
+                with tracing.span("explain", package_name=package_name), usage.package(package_name):
+                    explanation = await explain()
+                self._write([package_name, prediction, explanation])
+                self.stats["explained"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"❌ Error explaining {package_name}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, row: list):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        file_exists = os.path.exists(self.path)
+        with open(self.path, "a", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            if not file_exists:
+                writer.writerow(["package_name", "llm_prediction", "explanation"])
+            writer.writerow(row)
+
+    async def drain(self):
+        """
+        Waits for the queued explanations and stops the workers.
+        """
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.queue = None
+
+    def print_summary(self):
+        if self.stats["verdicts"]:
+            print(f"Verdict-only mode: {self.stats['verdicts']} verdicts, {self.stats['explained']} explained, "
+                  f"{self.stats['failed']} failed explanations (written to {self.path})")
+
+
+class VerdictConfig:
+    """
+    Whether runners ask for verdicts only, and the queue that explains them afterwards.
+    """
+
+    def __init__(self, enabled: bool = False, max_tokens: int = VERDICT_MAX_TOKENS, queue: ExplanationQueue = None):
+        self.enabled = enabled
+        self.max_tokens = max_tokens
+        self.queue = queue
+
+
+_config = VerdictConfig()
+
+
+def enabled() -> bool:
+    return _config.enabled
+
+
+def verdict_max_tokens() -> int:
+    return _config.max_tokens
+
+
+def submit(package_name: str, prediction, explain):
+    _config.queue.submit(package_name, prediction, explain)
+
+
+async def drain():
+    if _config.queue is not None:
+        await _config.queue.drain()
+
+
+def print_summary():
+    if _config.queue is not None:
+        _config.queue.print_summary()
+
+
+def add_arguments(parser):
+    """
+    Adds the verdict-only options to an experiment's argument parser.
+    """
+    parser.add_argument("--verdict_only", action="store_true",
+                        help="Ask for the prediction only and explain the verdicts afterwards in the background.")
+    parser.add_argument("--verdict_max_tokens", type=int, default=VERDICT_MAX_TOKENS,
+                        help="max_tokens of the verdict-only calls.")
+    parser.add_argument("--explain_sample", type=float, default=0.0,
+                        help="Share of benign verdicts that are also explained (malicious ones always are).")
+    parser.add_argument("--explain_workers", type=int, default=1,
+                        help="Concurrent explanation calls running beside the verdict calls.")
+    parser.add_argument("--explanations_file", type=str, default=None,
+                        help="CSV file for the deferred explanations (default: next to the results).")
+
+
+def configure(enabled: bool = False, max_tokens: int = VERDICT_MAX_TOKENS, path: str = None,
+              workers: int = 1, sample: float = 0.0) -> VerdictConfig:
+    global _config
+    queue = ExplanationQueue(path, workers=workers, sample=sample) if enabled else None
+    _config = VerdictConfig(enabled=enabled, max_tokens=max_tokens, queue=queue)
+    return _config
+
+
+def configure_from_args(args, result_file: str) -> VerdictConfig:
+    """
+    Configures the verdict-only mode; explanations default to `<result_file stem>_explanations.csv`.
+    """
+    path = args.explanations_file
+    if path is None and result_file:
+        root, _ = os.path.splitext(str(result_file))
+        path = f"{root}_explanations.csv"
+    return configure(enabled=args.verdict_only, max_tokens=args.verdict_max_tokens, path=path,
+                     workers=args.explain_workers, sample=args.explain_sample)
@@ -0,0 +1,198 @@
+import asyncio
+from collections import defaultdict, deque
+
+from common import tracing
+
+
+# Default deadline (in seconds) of a single LLM call for each pipeline stage.
+DEFAULT_DEADLINES = {
+    "classify": 120.0,
+    "grade": 30.0,
+    "relevance": 30.0,
+    "file": 120.0,
+    "overall": 120.0,
+    "explain": 120.0,
+}
+
+
+class LatencyTracker:
+    """
+    Keeps a rolling window of observed call latencies per stage.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+
+    def observe(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def quantile(self, stage: str, q: float):
+        """
+        Returns the q-quantile of the stage latencies, or None while there are too few samples.
+        """
+        samples = self.samples.get(stage)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """
+    Caps the hedged calls to a fraction of the primary calls. It counts calls, not tokens: the tokens of the
+    cancelled requests are recorded by the usage ledger, where the token budgets apply to them.
+    """
+
+    def __init__(self, max_ratio: float = 0.05, max_hedges: int = None):
+        self.max_ratio = max_ratio
+        self.max_hedges = max_hedges
+        self.primary_calls = 0
+        self.hedged_calls = 0
+
+    def record_primary(self):
+        self.primary_calls += 1
+
+    def try_acquire(self) -> bool:
+        if self.max_hedges is not None and self.hedged_calls >= self.max_hedges:
+            return False
+        if self.hedged_calls + 1 > self.max_ratio * self.primary_calls:
+            return False
+        self.hedged_calls += 1
+        return True
+
+
+class HedgedCaller:
+    """
+    Runs LLM calls under a per-stage deadline and, optionally, hedges slow calls.
+
+    When hedging is enabled and the first request has not answered by the observed
+    p95 latency of its stage, a duplicate request is sent; the first one to answer
+    wins and the other is cancelled. `on_abandoned(result)` is called with the answer of an attempt
+    that finished but lost the race; attempts still running are cancelled.
+    """
+
+    def __init__(self, deadlines: dict = None, hedge: bool = False, hedge_quantile: float = 0.95,
+                 budget: HedgeBudget = None, tracker: LatencyTracker = None):
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        self.deadlines.update(deadlines or {})
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.budget = budget or HedgeBudget()
+        self.tracker = tracker or LatencyTracker()
+        self.stats = defaultdict(int)
+
+    def deadline(self, stage: str) -> float:
+        return self.deadlines.get(stage, max(self.deadlines.values()))
+
+    def hedge_delay(self, stage: str):
+        if not self.hedge:
+            return None
+        return self.tracker.quantile(stage, self.hedge_quantile)
+
+    async def call(self, stage: str, make_call, on_abandoned=None):
+        """
+        Awaits `make_call()` for the given stage and returns the first successful answer.
+        Raises asyncio.TimeoutError when the stage deadline expires.
+        """
+        with tracing.span("llm", stage=stage) as span:
+            return await self._call(stage, make_call, span, on_abandoned)
+
+    async def _call(self, stage: str, make_call, span, on_abandoned=None):
+        loop = asyncio.get_running_loop()
+        deadline = self.deadline(stage)
+        start = loop.time()
+
+        self.budget.record_primary()
+        self.stats["calls"] += 1
+        tasks = [asyncio.ensure_future(make_call())]
+        span.set_attribute("attempts", 1)
+        last_error = None
+        try:
+            delay = self.hedge_delay(stage)
+            if delay is not None and delay < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.budget.try_acquire():
+                    self.stats["hedges"] += 1
+                    span.add("hedges")
+                    span.add("attempts")
+                    tasks.append(asyncio.ensure_future(make_call()))
+
+            while tasks:
+                remaining = deadline - (loop.time() - start)
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        self.tracker.observe(stage, loop.time() - start)
+                        tracing.record_usage(task.result())
+                        return task.result()
+                    # A failed attempt that the other request makes up for is still counted on the span
+                    span.add("failed_attempts")
+                    span.set_attribute("last_error", type(task.exception()).__name__)
+                    last_error = task.exception()
+
+            if last_error is not None and not tasks:
+                raise last_error
+            self.stats["timeouts"] += 1
+            raise asyncio.TimeoutError(f"{stage} call exceeded its {deadline:g}s deadline")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    span.add("cancelled_attempts")
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None and on_abandoned is not None:
+                    on_abandoned(task.result())
+
+
+_default_caller = HedgedCaller()
+
+
+def default_caller() -> HedgedCaller:
+    """
+    Returns the process-wide caller shared by every LLM client.
+    """
+    return _default_caller
+
+
+def configure(deadlines: dict = None, hedge: bool = False, hedge_budget: float = 0.05, max_hedges: int = None):
+    """
+    Replaces the process-wide caller with one using the given deadlines and hedging policy.
+    """
+    global _default_caller
+    _default_caller = HedgedCaller(deadlines=deadlines, hedge=hedge,
+                                   budget=HedgeBudget(max_ratio=hedge_budget, max_hedges=max_hedges))
+    return _default_caller
+
+
+def parse_deadlines(values) -> dict:
+    """
+    Parses `stage=seconds` pairs given on the command line.
+    """
+    deadlines = {}
+    for value in values or []:
+        stage, _, seconds = value.partition("=")
+        if not seconds:
+            raise ValueError(f"Invalid deadline '{value}', expected STAGE=SECONDS")
+        deadlines[stage.strip()] = float(seconds)
+    return deadlines
+
+
+def add_arguments(parser):
+    """
+    Adds the deadline and hedging options to an experiment's argument parser.
+    """
+    parser.add_argument("--deadline", action="append", metavar="STAGE=SECONDS",
+                        help=f"Per-stage LLM call deadline, may be repeated (stages: {', '.join(DEFAULT_DEADLINES)}).")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Send a duplicate request when a call has not answered by the stage's p95 latency.")
+    parser.add_argument("--hedge_budget", type=float, default=0.05,
+                        help="Maximum ratio of hedged calls to primary calls (a count of calls, not of tokens).")
+
+
+def configure_from_args(args) -> HedgedCaller:
+    return configure(deadlines=parse_deadlines(args.deadline), hedge=args.hedge, hedge_budget=args.hedge_budget)
@@ -0,0 +1,210 @@
+import io
+import os
+import json
+import time
+import tarfile
+import zipfile
+import argparse
+from contextlib import nullcontext
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Members larger than this are skipped; malicious payloads worth reading fit well below it.
+MAX_MEMBER_BYTES = int(os.getenv("MAL_LLM_MAX_MEMBER_BYTES", str(512 * 1024)))
+# Stop reading a package after this many kept bytes or files.
+MAX_PACKAGE_BYTES = int(os.getenv("MAL_LLM_MAX_PACKAGE_BYTES", str(8 * 1024 * 1024)))
+MAX_FILES = 1000
+# Bytes sniffed for NUL characters to recognise binaries without a known suffix.
+SNIFF_BYTES = 8192
+
+ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".tar.bz2", ".tar", ".zip", ".whl")
+BINARY_SUFFIXES = {
+    ".so", ".pyd", ".dll", ".dylib", ".exe", ".bin", ".o", ".a", ".lib", ".pyc", ".pyo",
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".pdf", ".ttf", ".otf", ".woff", ".woff2",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".whl", ".egg", ".jar", ".mo", ".db", ".sqlite", ".npy", ".pkl",
+}
+
+
+def package_name(archive) -> str:
+    """
+    `requests-2.31.0.tar.gz` -> `requests-2.31.0`; wheels drop their tags, `x-1.0-py3-none-any.whl` -> `x-1.0`.
+    """
+    name = Path(archive).name
+    if name.endswith(".whl"):
+        return "-".join(name[:-len(".whl")].split("-")[:2])
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_binary(path: str, head: bytes) -> bool:
+    return Path(path).suffix.lower() in BINARY_SUFFIXES or b"\0" in head[:SNIFF_BYTES]
+
+
+class PackageReader:
+    """
+    Collects the text members of one archive into `{filename: {"content", "file path"}}`, the structure
+    `classify_files` expects, while counting what was skipped. Nothing is extracted to disk.
+    """
+
+    def __init__(self, max_member_bytes: int = MAX_MEMBER_BYTES, max_package_bytes: int = MAX_PACKAGE_BYTES,
+                 max_files: int = MAX_FILES):
+        self.max_member_bytes = max_member_bytes
+        self.max_package_bytes = max_package_bytes
+        self.max_files = max_files
+        self.files = {}
+        self.kept_bytes = 0
+        self.stats = {"files": 0, "binary": 0, "oversize": 0, "truncated": 0}
+
+    def full(self) -> bool:
+        return len(self.files) >= self.max_files or self.kept_bytes >= self.max_package_bytes
+
+    def add(self, path: str, size: int, read):
+        """
+        Adds a member of `size` bytes; `read(n)` returns at most n bytes of it.
+        """
+        if Path(path).suffix.lower() in BINARY_SUFFIXES:
+            self.stats["binary"] += 1
+            return
+        if size > self.max_member_bytes:
+            self.stats["oversize"] += 1
+            return
+        if self.full():
+            self.stats["truncated"] += 1
+            return
+        # Read one byte more than allowed, so a size field that lies cannot make us read a bomb.
+        data = read(self.max_member_bytes + 1)
+        if len(data) > self.max_member_bytes:
+            self.stats["oversize"] += 1
+            return
+        if is_binary(path, data):
+            self.stats["binary"] += 1
+            return
+        filename = Path(path).name
+        # Keys are file names, as in the structured dataset; a second `__init__.py` is keyed by its path.
+        key = filename if filename not in self.files else path
+        self.files[key] = {"content": data.decode("utf-8", errors="replace"), "file path": path}
+        self.kept_bytes += len(data)
+        self.stats["files"] += 1
+
+
+def read_tar(fileobj, reader: PackageReader):
+    # `r|*` reads the (compressed) tar as a forward-only stream, member after member.
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            handle = archive.extractfile(member)
+            reader.add(member.name, member.size, handle.read)
+
+
+def read_zip(fileobj, reader: PackageReader):
+    if not fileobj.seekable():
+        fileobj = io.BytesIO(fileobj.read())
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            # Members are only decompressed once the reader decided to keep them.
+            reader.add(info.filename, info.file_size, lambda size, info=info: _read_member(archive, info, size))
+
+
+def _read_member(archive, info, size: int) -> bytes:
+    with archive.open(info) as handle:
+        return handle.read(size)
+
+
+def read_archive(source, name: str = None, **limits) -> tuple:
+    """
+    Reads a `.tar.gz`, `.zip` or `.whl` from a path or a binary stream (e.g. an HTTP response) and returns
+    (files_data, stats).
+    """
+    name = name or str(source)
+    reader = PackageReader(**limits)
+    with (open(source, "rb") if isinstance(source, (str, Path)) else nullcontext(source)) as fileobj:
+        if name.endswith((".zip", ".whl")):
+            read_zip(fileobj, reader)
+        else:
+            read_tar(fileobj, reader)
+    return reader.files, reader.stats
+
+
+def output_path(output_dir, archive) -> Path:
+    """
+    `<output_dir>/<name>/<name>_structuredOutput.json`, the naming of the structured dataset.
+    """
+    name = package_name(archive)
+    return Path(output_dir) / name / f"{name}_structuredOutput.json"
+
+
+def ingest_archive(task) -> dict:
+    """
+    Worker: converts one archive and writes its structured JSON. Returns the archive's stats.
+    """
+    archive, output_dir, limits = task
+    target = output_path(output_dir, archive)
+    stats = {"archive": str(archive), "bytes": 0, "files": 0, "binary": 0, "oversize": 0, "truncated": 0, "error": None}
+    try:
+        # Inside the try, so an archive that vanished or cannot be read is reported instead of stopping the ingest
+        stats["bytes"] = os.path.getsize(archive)
+        files_data, reader_stats = read_archive(archive, str(archive), **limits)
+        stats.update(reader_stats)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "w", encoding="utf-8") as file:
+            json.dump(files_data, file, ensure_ascii=False)
+    except (OSError, tarfile.TarError, zipfile.BadZipFile, EOFError, ValueError) as e:
+        stats["error"] = f"{type(e).__name__}: {e}"
+    return stats
+
+
+def find_archives(paths: list) -> list:
+    archives = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            archives.extend(sorted(p for p in path.rglob("*") if p.name.endswith(ARCHIVE_SUFFIXES)))
+        else:
+            archives.append(path)
+    return archives
+
+
+def ingest(archives: list, output_dir, workers: int = None, overwrite: bool = False, **limits) -> dict:
+    """
+    Converts the archives with a process pool, skipping those already converted.
+    """
+    pending = [archive for archive in archives if overwrite or not output_path(output_dir, archive).exists()]
+    print(f"📂 {len(archives)} archives, {len(archives) - len(pending)} already converted")
+    totals = {"archives": 0, "bytes": 0, "files": 0, "binary": 0, "oversize": 0, "truncated": 0, "errors": 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = ((archive, output_dir, limits) for archive in pending)
+        # Small archives dominate PyPI uploads; chunks amortise the inter-process round trips.
+        for stats in executor.map(ingest_archive, tasks, chunksize=16):
+            totals["archives"] += 1
+            totals["bytes"] += stats["bytes"]
+            for key in ("files", "binary", "oversize", "truncated"):
+                totals[key] += stats[key]
+            if stats["error"]:
+                totals["errors"] += 1
+                print(f"❌ {stats['archive']}: {stats['error']}")
+    elapsed = time.perf_counter() - start
+    print(f"✅ {totals['archives']} archives ({totals['bytes'] / 2 ** 20:.1f} MB) in {elapsed:.1f}s: "
+          f"{totals['archives'] / elapsed if elapsed else 0:.0f} archives/s, {totals['files']} files kept, "
+          f"{totals['binary']} binary, {totals['oversize']} oversize, {totals['truncated']} over the package limit, "
+          f"{totals['errors']} errors")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert sdists and wheels into the structured package JSON of the ZSP classifier.")
+    parser.add_argument("archives", nargs="+", help="Archives, or directories searched recursively.")
+    parser.add_argument("--output", "-o", default="data/structured_output_plain/sample_packages")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: CPU count).")
+    parser.add_argument("--max_member_bytes", type=int, default=MAX_MEMBER_BYTES)
+    parser.add_argument("--max_package_bytes", type=int, default=MAX_PACKAGE_BYTES)
+    parser.add_argument("--max_files", type=int, default=MAX_FILES)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+    ingest(find_archives(args.archives), args.output, args.workers, args.overwrite,
+           max_member_bytes=args.max_member_bytes, max_package_bytes=args.max_package_bytes, max_files=args.max_files)
@@ -0,0 +1,73 @@
+import os
+import threading
+
+
+class Lazy:
+    """
+    Stands in for an object that is expensive to import or build (an LLM client, embeddings, a vector store):
+    `factory()` runs on first attribute access, so importing a module or running `--help` never pays for it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self._factory()
+                    self._built = True
+        return self._value
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the proxy itself, i.e. those of the wrapped object.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        return f"Lazy({self._value!r})" if self._built else f"Lazy(<not built: {self._factory!r}>)"
+
+
+def hugging_face_client(api_key: str = None, base_url: str = None) -> Lazy:
+    """
+    `AsyncInferenceClient` of the TGI endpoint; huggingface_hub is only imported when the first call is made.
+    """
+    def build():
+        from huggingface_hub import AsyncInferenceClient
+
+        return AsyncInferenceClient(base_url=base_url or os.getenv("HF_INFERENCE_BASE_URL"),
+                                    api_key=api_key or os.getenv("HUGGING_FACE_KEY"))
+
+    return Lazy(build)
+
+
+def openai_client(api_key: str = None) -> Lazy:
+    """
+    `AsyncOpenAI` client, built on first use.
+    """
+    def build():
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+
+    return Lazy(build)
+
+
+def openai_embeddings() -> Lazy:
+    """
+    `OpenAIEmbeddings` of the knowledge base, built on first use; langchain_openai takes a second to import.
+    """
+    def build():
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+
+    return Lazy(build)
@@ -0,0 +1,268 @@
+import os
+import json
+import math
+import time
+import argparse
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from common import usage, vectorstores
+
+
+# BM25 indexes are built from `<collection>.jsonl` exports of the knowledge base in this directory.
+LEXICAL_DIR = os.getenv("MAL_LLM_LEXICAL_DIR", vectorstores.LOCAL_KB_DIR)
+
+RRF_K = 60
+
+# How long the dense search stays disabled after the embedding API failed.
+DENSE_COOLDOWN = 60.0
+
+SUBTOKEN_SEPARATORS = str.maketrans({char: " " for char in "._:/-"})
+
+
+def tokenize(text: str) -> list:
+    """
+    Lower-cased code tokens (`discord.com/api/webhooks`, `b64decode`) followed by their dotted, slashed
+    and dashed parts, so both `discord.com` and `discord` match.
+    """
+    tokens = []
+    for token in vectorstores.TOKEN_PATTERN.findall((text or "").lower()):
+        tokens.append(token)
+        parts = token.translate(SUBTOKEN_SEPARATORS).split()
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index over the documents of a collection, scored with Okapi BM25.
+    """
+
+    def __init__(self, documents: list, k1: float = 1.5, b: float = 0.75, collection_name: str = None):
+        self.collection_name = collection_name
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for doc_id, doc in enumerate(documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self.postings[token].append((doc_id, count))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        count = len(documents)
+        self.idf = {token: math.log(1.0 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for token, posting in self.postings.items()}
+
+    @classmethod
+    def from_jsonl(cls, path, collection_name: str = None, **kwargs):
+        """
+        Loads documents from a JSONL file of {"page_content": ..., "metadata": {...}} records.
+        """
+        return cls(vectorstores.load_documents(path), collection_name=collection_name, **kwargs)
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        """
+        Returns the top `k` (document, BM25 score) pairs, best first.
+        """
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[token]:
+                norm = 1.0 - self.b + self.b * self.lengths[doc_id] / (self.average_length or 1.0)
+                scores[doc_id] += idf * count * (self.k1 + 1.0) / (count + self.k1 * norm)
+        top = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.documents[doc_id], score) for doc_id, score in top]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Fuses ranked document lists: each document scores sum(1 / (k + rank)) over the lists it appears in.
+    Returns (document, score) pairs, best first. Documents are matched on their content.
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            documents.setdefault(doc.page_content, doc)
+            scores[doc.page_content] += 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: -item[1])
+    return [(documents[content], score) for content, score in fused]
+
+
+class HybridRetriever:
+    """
+    Exposes `similarity_search` over a collection in `dense`, `lexical` or `hybrid` (RRF) mode.
+
+    In hybrid mode the search drops to lexical-only when the run's token budget is spent or when the embedding
+    API fails, in which case the dense search is skipped for `cooldown` seconds.
+    """
+
+    def __init__(self, collection_name: str, make_vectorstore, index: BM25Index = None, mode: str = "hybrid",
+                 candidates: int = 20, rrf_k: int = RRF_K, cooldown: float = DENSE_COOLDOWN):
+        self.collection_name = collection_name
+        self.make_vectorstore = make_vectorstore
+        self.vectorstore = None
+        self.index = index
+        self.mode = mode if index is not None else "dense"
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.cooldown = cooldown
+        self.dense_down_until = 0.0
+        self.stats = {"queries": 0, "hybrid": 0, "lexical_only": 0, "dense_errors": 0}
+        _retrievers.append(self)
+
+    def _dense(self, query: str, k: int) -> list:
+        if self.vectorstore is None:
+            self.vectorstore = self.make_vectorstore()
+        return self.vectorstore.similarity_search_with_score(query, k=k)
+
+    def _dense_available(self) -> bool:
+        remaining = usage.ledger().remaining()
+        return time.monotonic() >= self.dense_down_until and (remaining is None or remaining > 0)
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        """
+        Returns the top `k` (document, dense distance) pairs, best first. BM25 and RRF scores are not distances,
+        so the documents only BM25 found (all of them when the search is lexical-only) have a distance of None.
+        """
+        self.stats["queries"] += 1
+        if self.mode == "dense":
+            return self._dense(query, k)
+        lexical = self.index.similarity_search(query, k=max(k, self.candidates))
+        if self.mode == "lexical" or not self._dense_available():
+            self.stats["lexical_only"] += 1
+            return [(doc, None) for doc in lexical[:k]]
+        try:
+            dense = self._dense(query, max(k, self.candidates))
+        except Exception as e:
+            self.stats["dense_errors"] += 1
+            self.stats["lexical_only"] += 1
+            self.dense_down_until = time.monotonic() + self.cooldown
+            print(f"⚠️ Dense search on {self.collection_name} failed, using BM25 only for {self.cooldown:.0f}s: {e}")
+            return [(doc, None) for doc in lexical[:k]]
+        self.stats["hybrid"] += 1
+        distances = {doc.page_content: distance for doc, distance in dense}
+        fused = reciprocal_rank_fusion([[doc for doc, _ in dense], lexical], k=self.rrf_k)[:k]
+        return [(doc, distances.get(doc.page_content)) for doc, _ in fused]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def print_summary(self):
+        if self.mode != "dense" and self.stats["queries"]:
+            print(f"Retrieval '{self.mode}' on {self.collection_name}: {self.stats['queries']} queries, "
+                  f"{self.stats['hybrid']} fused, {self.stats['lexical_only']} lexical-only, "
+                  f"{self.stats['dense_errors']} embedding errors")
+
+
+class RetrievalConfig:
+    """
+    Retrieval mode of the runners and the location of the BM25 exports.
+    """
+
+    def __init__(self, mode: str = "dense", lexical_dir: str = LEXICAL_DIR, candidates: int = 20, rrf_k: int = RRF_K):
+        self.mode = mode
+        self.lexical_dir = lexical_dir
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+
+_config = RetrievalConfig()
+_retrievers = []
+
+
+def lexical_collection_path(collection_name: str, lexical_dir: str = None) -> Path:
+    return Path(lexical_dir or _config.lexical_dir) / f"{collection_name}.jsonl"
+
+
+def get_retriever(collection_name: str, embeddings):
+    """
+    Returns the retriever of a knowledge-base collection for the configured `--retrieval` mode.
+    The vector store is only opened on the first dense search, so lexical runs need neither PGVector nor embeddings.
+    """
+    if _config.mode == "dense":
+        return vectorstores.get_vectorstore(collection_name, embeddings)
+
+    path = lexical_collection_path(collection_name)
+    index = None
+    if path.exists():
+        index = BM25Index.from_jsonl(path, collection_name=collection_name)
+    elif _config.mode == "lexical":
+        raise FileNotFoundError(f"No BM25 export for {collection_name} at {path}, run `python -m common.lexical export`")
+    else:
+        print(f"⚠️ No BM25 export for {collection_name} at {path}, using dense retrieval only")
+    return HybridRetriever(collection_name, lambda: vectorstores.get_vectorstore(collection_name, embeddings),
+                           index=index, mode=_config.mode, candidates=_config.candidates, rrf_k=_config.rrf_k)
+
+
+def print_summary():
+    for retriever in _retrievers:
+        retriever.print_summary()
+
+
+def export_collection(collection_name: str, output_dir: str = None) -> Path:
+    """
+    Dumps the documents of a PGVector collection to `<output_dir>/<collection>.jsonl` for the BM25 index.
+    """
+    import psycopg
+
+    path = lexical_collection_path(collection_name, output_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    params = vectorstores.DB_PARAMS
+    with psycopg.connect(dbname=params["database"], user=params["user"], password=params["password"],
+                         host=params["host"], port=params["port"], options="-csearch_path=malware") as connection:
+        rows = connection.execute(
+            "SELECT e.document, e.cmetadata FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s",
+            (collection_name,),
+        )
+        count = 0
+        with open(path, "w", encoding="utf-8") as file:
+            for document, metadata in rows:
+                file.write(json.dumps({"page_content": document, "metadata": metadata or {}}) + "\n")
+                count += 1
+    print(f"✅ Exported {count} documents of {collection_name} to {path}")
+    return path
+
+
+def add_arguments(parser):
+    """
+    Adds the retrieval options to an experiment's argument parser.
+    """
+    parser.add_argument("--retrieval", choices=["dense", "lexical", "hybrid"], default="dense",
+                        help="Dense vector search, BM25 only, or both fused with reciprocal-rank fusion.")
+    parser.add_argument("--lexical_dir", type=str, default=LEXICAL_DIR,
+                        help="Directory of the <collection>.jsonl exports indexed with BM25.")
+    parser.add_argument("--retrieval_candidates", type=int, default=20,
+                        help="Results taken from each ranking before fusion.")
+    parser.add_argument("--rrf_k", type=int, default=RRF_K, help="Rank offset of reciprocal-rank fusion.")
+
+
+def configure(mode: str = "dense", lexical_dir: str = LEXICAL_DIR, candidates: int = 20, rrf_k: int = RRF_K) -> RetrievalConfig:
+    global _config
+    _config = RetrievalConfig(mode=mode, lexical_dir=lexical_dir, candidates=candidates, rrf_k=rrf_k)
+    return _config
+
+
+def configure_from_args(args) -> RetrievalConfig:
+    return configure(mode=args.retrieval, lexical_dir=args.lexical_dir,
+                     candidates=args.retrieval_candidates, rrf_k=args.rrf_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export knowledge-base collections for the BM25 index.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--collection", action="append",
+                        default=None, help="Collection to export, may be repeated (default: all three).")
+    parser.add_argument("--output_dir", type=str, default=LEXICAL_DIR)
+    args = parser.parse_args()
+    for name in args.collection or ["malware.yara_rules2", "github_advisories", "malicious_setup_py"]:
+        export_collection(name, args.output_dir)
@@ -0,0 +1,202 @@
+import time
+import asyncio
+import contextvars
+
+
+# Items waiting between two stages; a full queue makes the upstream stage wait (backpressure).
+QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline: `await process(item)` returns the item handed to the next stage, or None when the
+    item leaves the pipeline here. `workers` items go through the stage at the same time, unless
+    `--workers STAGE=N` says otherwise. Items for which `skip(item)` is true go on to the next stage untouched.
+    """
+
+    def __init__(self, name: str, process, workers: int = 1, skip=None):
+        self.name = name
+        self.process = process
+        self.workers = workers
+        self.skip = skip
+
+
+class _Entry:
+    """
+    An item in flight, with the context its stages run in and the scope opened for it.
+    """
+
+    __slots__ = ("item", "context", "scope")
+
+    def __init__(self, item, context, scope):
+        self.item = item
+        self.context = context
+        self.scope = scope
+
+
+class Pipeline:
+    """
+    Runs items through stages connected by bounded queues, each stage with its own pool of workers.
+    """
+
+    def __init__(self, stages: list, workers: dict = None, queue_size: int = None):
+        workers = _config.workers if workers is None else workers
+        self.stages = stages
+        self.workers = [workers.get(stage.name, stage.workers) for stage in stages]
+        self.queue_size = queue_size or _config.queue_size
+
+    async def run(self, items, scope=None, key=str, progress=None):
+        """
+        Feeds `items` to the first stage and returns once every item has left the pipeline. `scope(item)`, if
+        given, is a context manager held from the first stage to the last (e.g. the package's tracing span
+        and token budget); every stage of the item runs in its context. `key(item)` names the item in errors.
+        """
+        queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        started = time.perf_counter()
+
+        def finish(entry):
+            if entry.scope is not None:
+                entry.context.run(entry.scope.__exit__, None, None, None)
+            if progress is not None:
+                progress.update(1)
+
+        async def feed():
+            for item in items:
+                entry = _Entry(item, contextvars.copy_context(), scope(item) if scope is not None else None)
+                if entry.scope is not None:
+                    entry.context.run(entry.scope.__enter__)
+                await queues[0].put(entry)
+            for _ in range(self.workers[0]):
+                await queues[0].put(_DONE)
+
+        async def work(index):
+            stage, stats = self.stages[index], _stage_stats(self.stages[index].name)
+            last = index == len(self.stages) - 1
+            while True:
+                entry = await queues[index].get()
+                if entry is _DONE:
+                    return
+                if stage.skip is not None and stage.skip(entry.item):
+                    stats["skipped"] += 1
+                    if last:
+                        finish(entry)
+                    else:
+                        await queues[index + 1].put(entry)
+                    continue
+                begin = time.perf_counter()
+                try:
+                    # A task per call copies the item's context, so spans and budgets follow the item across workers
+                    result = await entry.context.run(asyncio.ensure_future, stage.process(entry.item))
+                except Exception as e:
+                    print(f"❌ Error in stage {stage.name} for {key(entry.item)}: {e}")
+                    stats["errors"] += 1
+                    result = None
+                else:
+                    stats["dropped"] += result is None and not last
+                stats["items"] += 1
+                stats["busy"] += time.perf_counter() - begin
+                if result is None or last:
+                    finish(entry)
+                    continue
+                entry.item = result
+                begin = time.perf_counter()
+                await queues[index + 1].put(entry)
+                stats["blocked"] += time.perf_counter() - begin
+
+        async def run_stage(index):
+            await asyncio.gather(*(work(index) for _ in range(self.workers[index])))
+            if index + 1 < len(self.stages):
+                for _ in range(self.workers[index + 1]):
+                    await queues[index + 1].put(_DONE)
+
+        tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(run_stage(index)) for index in range(len(self.stages))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for stage, workers in zip(self.stages, self.workers):
+                _stage_stats(stage.name)["workers"] = workers
+            _config.seconds += time.perf_counter() - started
+
+
+class PipelineConfig:
+    """
+    The worker count per stage and the queue size between stages, and the statistics of the stages run so far.
+    """
+
+    def __init__(self, workers: dict = None, queue_size: int = QUEUE_SIZE):
+        self.workers = workers or {}
+        self.queue_size = queue_size
+        self.stats = {}
+        self.seconds = 0.0
+
+
+_config = PipelineConfig()
+
+
+def _stage_stats(name: str) -> dict:
+    if name not in _config.stats:
+        _config.stats[name] = {"workers": 0, "items": 0, "skipped": 0, "dropped": 0, "errors": 0, "busy": 0.0, "blocked": 0.0}
+    return _config.stats[name]
+
+
+async def run(stages: list, items, scope=None, key=str, progress=None):
+    """
+    Runs `items` through `stages` with the configured workers and queue size, see `Pipeline.run`.
+    """
+    await Pipeline(stages).run(items, scope=scope, key=key, progress=progress)
+
+
+def print_summary():
+    """
+    Prints the time each stage spent working and waiting on the next one. The stage whose workers are busy
+    most of the run is the one to give more workers (`--workers STAGE=N`).
+    """
+    if not _config.stats or not _config.seconds:
+        return
+    print(f"{'stage':<12}{'workers':>8}{'items':>8}{'skipped':>9}{'dropped':>9}{'errors':>8}{'busy s':>10}{'blocked s':>11}{'busy %':>8}")
+    utilisation = {}
+    for name, stats in _config.stats.items():
+        utilisation[name] = stats["busy"] / (max(stats["workers"], 1) * _config.seconds)
+        print(f"{name:<12}{stats['workers']:>8}{stats['items']:>8}{stats['skipped']:>9}{stats['dropped']:>9}{stats['errors']:>8}"
+              f"{stats['busy']:>10.1f}{stats['blocked']:>11.1f}{100 * utilisation[name]:>8.0f}")
+    bottleneck = max(utilisation, key=utilisation.get)
+    print(f"🔍 Busiest stage: {bottleneck} ({100 * utilisation[bottleneck]:.0f}% of its workers' time over {_config.seconds:.1f}s)")
+
+
+def parse_workers(values) -> dict:
+    """
+    Parses `stage=count` pairs given on the command line.
+    """
+    workers = {}
+    for value in values or []:
+        stage, _, count = value.partition("=")
+        if not count.strip().isdigit() or int(count) < 1:
+            raise ValueError(f"Invalid worker count '{value}', expected STAGE=N with N >= 1")
+        workers[stage.strip()] = int(count)
+    return workers
+
+
+def add_arguments(parser, stages: dict = None):
+    """
+    Adds the stage concurrency options to an experiment's argument parser; `stages` maps the stage names to
+    their default worker counts, for the help text.
+    """
+    defaults = f" (defaults: {', '.join(f'{name}={count}' for name, count in stages.items())})" if stages else ""
+    parser.add_argument("--workers", action="append", metavar="STAGE=N",
+                        help=f"Workers of a pipeline stage, may be repeated{defaults}.")
+    parser.add_argument("--stage_queue_size", type=int, default=QUEUE_SIZE,
+                        help="Items waiting between two stages before the upstream stage pauses.")
+
+
+def configure(workers: dict = None, queue_size: int = QUEUE_SIZE) -> PipelineConfig:
+    global _config
+    _config = PipelineConfig(workers=workers, queue_size=queue_size)
+    return _config
+
+
+def configure_from_args(args) -> PipelineConfig:
+    return configure(workers=parse_workers(args.workers), queue_size=args.stage_queue_size)
@@ -0,0 +1,65 @@
+import os
+import json
+
+from common import usage
+
+
+def compact_json(value) -> str:
+    """
+    Serialises a value without indentation or spaces, e.g. the file list of a package.
+    """
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class PromptTemplate:
+    """
+    A chat prompt whose static messages (instructions, response format) always come first and byte-identical,
+    followed by the per-package messages, so provider and TGI prefix caches can reuse the static part.
+    """
+
+    def __init__(self, name: str, static_messages: list):
+        self.name = name
+        self.static_messages = [dict(message) for message in static_messages]
+        self.static_chars = sum(len(message["content"]) for message in self.static_messages)
+        self.renders = 0
+        self.total_chars = 0
+        _templates[name] = self
+
+    def render(self, *dynamic_messages) -> list:
+        """
+        Returns the static messages followed by the given per-package messages.
+        """
+        messages = [dict(message) for message in self.static_messages]
+        messages.extend(dynamic_messages)
+        self.renders += 1
+        self.total_chars += sum(len(str(message["content"])) for message in messages)
+        return messages
+
+    def prefix_tokens(self, model: str) -> int:
+        """
+        Number of prompt tokens shared by every render of this template.
+        """
+        return usage.count_tokens(self.static_messages, model)
+
+
+_templates = {}
+
+
+def templates() -> dict:
+    return dict(_templates)
+
+
+def print_summary(model: str = None):
+    """
+    Prints the cacheable prefix of every template used in this run and its share of the prompt characters.
+    """
+    used = [template for template in _templates.values() if template.renders]
+    if not used:
+        return
+    model = model or os.getenv("LLAMA_MODEL") or "gpt-4o-mini"
+    print(f"{'prompt':<24}{'renders':>9}{'prefix tokens':>15}{'mean chars':>12}{'cacheable':>11}")
+    for template in used:
+        mean_chars = template.total_chars / template.renders
+        share = template.static_chars / mean_chars if mean_chars else 0.0
+        print(f"{template.name:<24}{template.renders:>9}{template.prefix_tokens(model):>15}"
+              f"{mean_chars:>12.0f}{share:>11.1%}")
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from common import vectorstores
+
+
+# Set MAL_LLM_VECTORSTORE=quantized to search `<MAL_LLM_LOCAL_KB>/<collection>.quantized/` exports.
+QUANTIZATION = os.getenv("MAL_LLM_QUANTIZATION", "binary")
+# First-pass candidates per requested result that are re-ranked with the float vectors (the int8 codes without them).
+RERANK_FACTOR = int(os.getenv("MAL_LLM_RERANK_FACTOR", "10"))
+
+# Rows of int8 codes widened to float32 at a time by the int8 first pass.
+INT8_CHUNK = 4096
+
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+FILES = {
+    "documents": "documents.jsonl",
+    "binary": "binary.npy",
+    "int8": "int8.npy",
+    "scales": "scales.npy",
+    "float32": "float32.npy",
+    "meta": "meta.json",
+}
+
+
+def normalise(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix) -> tuple:
+    """
+    Symmetric per-dimension int8 quantization; returns (codes, scales) with matrix ≈ codes * scales.
+    """
+    scales = np.abs(matrix).max(axis=0) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(matrix):
+    """
+    One sign bit per dimension, packed 8 per byte (1536 dims -> 192 bytes).
+    """
+    return np.packbits(np.asarray(matrix) > 0, axis=-1)
+
+
+def hamming_distances(query_bits, codes):
+    return POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedVectorStore:
+    """
+    Two-pass search over a knowledge-base export: a Hamming (binary) or int8 dot-product first pass over
+    compact codes held in memory, then exact cosine re-ranking of the top `k * rerank_factor` candidates
+    with the float vectors, which stay memory-mapped on disk. Exports without the float copy re-rank the
+    binary candidates with the int8 codes instead. Exposes the PGVector search methods we use.
+    """
+
+    def __init__(self, documents: list, embeddings, binary=None, int8=None, scales=None, floats=None,
+                 mode: str = QUANTIZATION, rerank_factor: int = RERANK_FACTOR, collection_name: str = None):
+        self.collection_name = collection_name
+        self.documents = documents
+        self.embeddings = embeddings
+        self.binary = binary
+        self.int8 = int8
+        self.scales = scales
+        self.floats = floats
+        self.mode = mode
+        self.rerank_factor = rerank_factor
+
+    @classmethod
+    def from_vectors(cls, documents: list, vectors, embeddings, **kwargs):
+        matrix = normalise(vectors)
+        codes, scales = quantize_int8(matrix)
+        return cls(documents, embeddings, quantize_binary(matrix), codes, scales, matrix, **kwargs)
+
+    def save(self, path, floats: bool = True):
+        """
+        Writes the export; with `floats=False` the float32 copy, by far its largest file, is left out.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / FILES["documents"], "w", encoding="utf-8") as file:
+            for doc in self.documents:
+                file.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}) + "\n")
+        for name in ("binary", "int8", "scales"):
+            np.save(path / FILES[name], getattr(self, name))
+        if floats and self.floats is not None:
+            np.save(path / FILES["float32"], np.asarray(self.floats, dtype=np.float32))
+        else:
+            # A float copy left by an earlier export would not match these codes
+            (path / FILES["float32"]).unlink(missing_ok=True)
+        embeddings = "hashing" if isinstance(self.embeddings, vectorstores.HashingEmbeddings) else "pgvector"
+        with open(path / FILES["meta"], "w", encoding="utf-8") as file:
+            json.dump({"embeddings": embeddings, "dimensions": int(self.int8.shape[1]), "count": len(self.documents),
+                       "floats": (path / FILES["float32"]).exists()}, file)
+        return path
+
+    @classmethod
+    def load(cls, path, embeddings=None, **kwargs):
+        """
+        Loads an export. The binary and int8 codes are read into memory, the float vectors, when exported,
+        are memory-mapped.
+        """
+        path = Path(path)
+        with open(path / FILES["meta"], "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta["embeddings"] == "hashing":
+            embeddings = vectorstores.HashingEmbeddings(meta["dimensions"])
+        floats = path / FILES["float32"]
+        return cls(
+            vectorstores.load_documents(path / FILES["documents"]), embeddings,
+            binary=np.load(path / FILES["binary"]), int8=np.load(path / FILES["int8"]),
+            scales=np.load(path / FILES["scales"]), floats=np.load(floats, mmap_mode="r") if floats.exists() else None,
+            collection_name=kwargs.pop("collection_name", path.name.removesuffix(".quantized")), **kwargs,
+        )
+
+    def first_pass(self, query, candidates: int):
+        """
+        Returns the indices of the `candidates` best documents by Hamming distance or int8 dot product.
+        """
+        candidates = min(candidates, len(self.documents))
+        if self.mode == "binary":
+            scores = hamming_distances(quantize_binary(query), self.binary)
+        else:
+            scaled = query * self.scales
+            scores = -np.concatenate([self.int8[start:start + INT8_CHUNK].astype(np.float32) @ scaled
+                                      for start in range(0, len(self.int8), INT8_CHUNK)])
+        top = np.argpartition(scores, candidates - 1)[:candidates]
+        return top[np.argsort(scores[top], kind="stable")]
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, rerank: bool = True) -> list:
+        if not self.documents:
+            return []
+        query = normalise(embedding)
+        # Without the float copy only the binary first pass gains from re-ranking, with the int8 codes
+        rerank = rerank and (self.floats is not None or self.mode == "binary")
+        candidates = self.first_pass(query, k * self.rerank_factor if rerank else k)
+        if rerank and self.floats is not None:
+            # Sorted indices keep the reads from the memory-mapped float vectors sequential.
+            ordered = np.sort(candidates)
+            distances = 1.0 - np.asarray(self.floats[ordered]) @ query
+            best = np.argsort(distances, kind="stable")[:k]
+            return [(self.documents[ordered[i]], float(distances[i])) for i in best]
+        distances = 1.0 - (self.int8[candidates].astype(np.float32) * self.scales) @ query
+        best = np.argsort(distances, kind="stable")[:k] if rerank else range(min(k, len(candidates)))
+        return [(self.documents[candidates[i]], float(distances[i])) for i in best]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def memory_footprint(self) -> dict:
+        """
+        Bytes of each representation; only the codes and documents are held in memory when searching.
+        """
+        return {
+            "float32": int(np.prod(self.floats.shape)) * 4 if self.floats is not None else 0,
+            "int8": self.int8.nbytes + self.scales.nbytes,
+            "binary": self.binary.nbytes,
+            "documents": sum(len(doc.page_content.encode("utf-8")) for doc in self.documents),
+        }
+
+
+def quantized_collection_path(collection_name: str) -> Path:
+    return Path(vectorstores.LOCAL_KB_DIR) / f"{collection_name}.quantized"
+
+
+def fetch_pgvector(collection_name: str) -> tuple:
+    """
+    Reads the documents and stored embeddings of a PGVector collection.
+    """
+    import psycopg
+    from langchain_core.documents import Document
+
+    params = vectorstores.DB_PARAMS
+    documents, vectors = [], []
+    with psycopg.connect(dbname=params["database"], user=params["user"], password=params["password"],
+                         host=params["host"], port=params["port"], options="-csearch_path=malware") as connection:
+        rows = connection.execute(
+            "SELECT e.document, e.cmetadata, e.embedding::text FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid WHERE c.name = %s",
+            (collection_name,),
+        )
+        for document, metadata, embedding in rows:
+            documents.append(Document(page_content=document, metadata=metadata or {}))
+            vectors.append(np.array(json.loads(embedding), dtype=np.float32))
+    return documents, np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+def export_collection(collection_name: str, source: str = "pgvector", floats: bool = True) -> Path:
+    """
+    Writes `<collection>.quantized/` from PGVector, or from the local JSONL collection with hashing embeddings;
+    with `floats=False` the workers get the codes and documents only.
+    """
+    if source == "pgvector":
+        documents, vectors = fetch_pgvector(collection_name)
+        embeddings = None
+    else:
+        documents = vectorstores.load_documents(vectorstores.local_collection_path(collection_name))
+        embeddings = vectorstores.HashingEmbeddings()
+        vectors = embeddings.embed_documents([doc.page_content for doc in documents])
+    store = QuantizedVectorStore.from_vectors(documents, vectors, embeddings, collection_name=collection_name)
+    path = store.save(quantized_collection_path(collection_name), floats=floats)
+    size = sum(file.stat().st_size for file in path.iterdir())
+    print(f"✅ Exported {len(documents)} vectors of {collection_name} to {path} ({size / 2 ** 20:.2f} MB"
+          f"{'' if floats else ', without the float copy'})")
+    return path
+
+
+def report(collection_name: str, queries: int = 100, k: int = 4, seed: int = 0) -> list:
+    """
+    Recall@k and latency of each first pass, with and without re-ranking, against exact float search.
+    Stored vectors of the collection are used as queries, so the export needs its float copy.
+    """
+    store = QuantizedVectorStore.load(quantized_collection_path(collection_name))
+    if store.floats is None:
+        print(f"❌ {collection_name} was exported without the float vectors, export it again without --no_floats to report on it.")
+        return []
+    floats = np.asarray(store.floats)
+    rng = np.random.default_rng(seed)
+    sample = floats[rng.choice(len(floats), size=min(queries, len(floats)), replace=False)]
+    exact = [set(np.argsort(1.0 - floats @ query, kind="stable")[:k]) for query in sample]
+    positions = {id(doc): i for i, doc in enumerate(store.documents)}
+
+    rows = []
+    for mode in ("binary", "int8"):
+        for rerank in (False, True):
+            store.mode = mode
+            recalls, latencies = [], []
+            for query, truth in zip(sample, exact):
+                start = time.perf_counter()
+                results = store.similarity_search_by_vector_with_score(query, k, rerank=rerank)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len({positions[id(doc)] for doc, _ in results} & truth) / max(1, len(truth)))
+            rows.append({"search": f"{mode}{' + rerank' if rerank else ''}", "recall": float(np.mean(recalls)),
+                         "ms": 1000 * float(np.median(latencies))})
+
+    footprint = store.memory_footprint()
+    print(f"{collection_name}: {len(store.documents)} vectors of {floats.shape[1]} dims")
+    for name, size in footprint.items():
+        print(f"  {name:<10}{size / 2 ** 20:>9.2f} MB")
+    print(f"  in memory  {(footprint['binary'] + footprint['int8'] + footprint['documents']) / 2 ** 20:>9.2f} MB "
+          f"(float32 memory-mapped)")
+    print(f"{'search':<18}{f'recall@{k}':>10}{'p50 ms':>9}")
+    for row in rows:
+        print(f"{row['search']:<18}{row['recall']:>10.3f}{row['ms']:>9.3f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export quantized knowledge-base collections and report their recall.")
+    parser.add_argument("command", choices=["export", "report"])
+    parser.add_argument("--collection", action="append", default=None,
+                        help="Collection, may be repeated (default: all three).")
+    parser.add_argument("--source", choices=["pgvector", "local"], default="pgvector",
+                        help="Export the PGVector embeddings, or hash-embed the local JSONL collection.")
+    parser.add_argument("--no_floats", action="store_true",
+                        help="export: leave out the float32 copy; searches then re-rank with the int8 codes.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+    for name in args.collection or ["malware.yara_rules2", "github_advisories", "malicious_setup_py"]:
+        if args.command == "export":
+            export_collection(name, args.source, floats=not args.no_floats)
+        else:
+            report(name, args.queries, args.k)
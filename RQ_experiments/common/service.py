@@ -0,0 +1,390 @@
+import re
+import json
+import time
+import types
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from common import batch, snippets, usage
+
+
+# A micro-batch is flushed when it holds MAX_BATCH items or MAX_WAIT_MS after its first item arrived.
+MAX_BATCH = 32
+MAX_WAIT_MS = 5.0
+# Largest request body accepted by the HTTP server.
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# Upper bounds (seconds) of the request latency histogram.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Snippet score above which the local stand-in model answers "malicious".
+LOCAL_MALICIOUS_SCORE = 4.0
+WORD_PATTERN = re.compile(r"\w{4,}")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class MicroBatcher:
+    """
+    Groups the items submitted by concurrent requests and handles each group with one `process(items)` call,
+    which returns one result per item. A blocking `process` (embedding API, vector search) runs in a thread.
+    """
+
+    def __init__(self, name: str, process, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.name = name
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.worker = None
+        self.stats = {"batches": 0, "items": 0, "errors": 0}
+
+    async def submit(self, item):
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            pending = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.max_wait
+            while len(pending) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Requests that were cancelled meanwhile (client gone) do not need their item processed.
+            pending = [(item, future) for item, future in pending if not future.done()]
+            if pending:
+                await self._flush(pending)
+
+    async def _flush(self, pending: list):
+        items = [item for item, _ in pending]
+        self.stats["batches"] += 1
+        self.stats["items"] += len(items)
+        try:
+            if asyncio.iscoroutinefunction(self.process):
+                results = await self.process(items)
+            else:
+                results = await asyncio.to_thread(self.process, items)
+            results = list(results)
+            if len(results) != len(items):
+                # zip() would leave the waiters past the last result hanging
+                raise ValueError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            self.stats["errors"] += 1
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+
+
+def search_vectors(vectorstore, vectors: list, k: int) -> list:
+    """
+    Top-k (document, distance) pairs of every query vector: one matrix product on the local stores, one query
+    per vector otherwise.
+    """
+    if hasattr(vectorstore, "similarity_search_by_vectors_with_score"):
+        return vectorstore.similarity_search_by_vectors_with_score(vectors, k)
+    if hasattr(vectorstore, "similarity_search_with_score_by_vector"):
+        return [vectorstore.similarity_search_with_score_by_vector(vector, k=k) for vector in vectors]
+    if hasattr(vectorstore, "similarity_search_by_vector_with_score"):
+        return [vectorstore.similarity_search_by_vector_with_score(vector, k=k) for vector in vectors]
+    return [[(doc, None) for doc in vectorstore.similarity_search_by_vector(vector, k=k)] for vector in vectors]
+
+
+class VerdictCache:
+    """
+    LRU cache of verdicts keyed by a hash of the package name, snippet and file list.
+    """
+
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.blake2b(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.entries[key]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value):
+        if self.size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+class LocalChatClient:
+    """
+    Stand-in for `AsyncInferenceClient`/`AsyncOpenAI` chat completions, for running the service without a model.
+    It answers with a schema-valid JSON object: the verdict comes from the indicator score of the user messages
+    (see snippets.py), graders answer "yes"/"high" when the document shares tokens with the snippet.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+        self.calls = 0
+
+    @staticmethod
+    def _schema(response_format: dict) -> dict:
+        if not response_format:
+            return {}
+        if "json_schema" in response_format:
+            return response_format["json_schema"]["schema"]
+        return response_format.get("value", {})
+
+    def respond(self, messages: list, response_format: dict) -> str:
+        schema = self._schema(response_format)
+        answer = batch.example_from_schema(dict(schema, type="object"))
+        contents = [str(message["content"]) for message in messages if message["role"] == "user"]
+        _, scores = snippets.score_lines("\n".join(contents))
+        malicious = bool(scores.sum() >= LOCAL_MALICIOUS_SCORE)
+        related = len(contents) >= 2 and bool(set(WORD_PATTERN.findall(contents[0].lower())) &
+                                              set(WORD_PATTERN.findall(contents[-1].lower())))
+        self._fill(answer, malicious, related)
+        return json.dumps(answer)
+
+    def _fill(self, answer: dict, malicious: bool, related: bool):
+        for key, value in answer.items():
+            if isinstance(value, dict):
+                self._fill(value, malicious, related)
+            elif key == "prediction":
+                answer[key] = malicious
+            elif key == "explanation":
+                answer[key] = "Local stand-in verdict from the indicator score of the snippet."
+            elif key == "grade":
+                answer[key] = "yes" if related else "no"
+            elif key == "level":
+                answer[key] = "high" if related else "low"
+
+    async def chat_completion(self, messages: list, model: str = None, max_tokens: int = None, response_format: dict = None,
+                              stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.respond(messages, response_format)
+        counts = types.SimpleNamespace(prompt_tokens=usage.count_tokens(messages, model or "gpt-4o-mini"),
+                                       completion_tokens=usage.count_text_tokens(content, model or "gpt-4o-mini"))
+        if stream:
+            return self._stream(content, counts)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(role="assistant", content=content))], usage=counts)
+
+    @staticmethod
+    async def _stream(content: str, counts):
+        # The whole answer arrives as one chunk, with the usage that OpenAI sends last under include_usage
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(role="assistant", content=content))],
+                                    usage=counts)
+
+    async def create(self, model: str = None, messages: list = None, **kwargs):
+        return await self.chat_completion(messages, model=model, **kwargs)
+
+
+class Metrics:
+    """
+    Request counters and latency histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.latency = {}
+        self.in_flight = 0
+
+    def observe(self, route: str, status: int, seconds: float):
+        self.requests[(route, status)] = self.requests.get((route, status), 0) + 1
+        counts, total = self.latency.setdefault(route, ([0] * (len(LATENCY_BUCKETS) + 1), [0.0]))
+        counts[next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))] += 1
+        total[0] += seconds
+
+    def render(self, batchers: list = (), cache: VerdictCache = None, gauges: dict = None) -> str:
+        lines = [
+            "# TYPE mal_llm_uptime_seconds gauge",
+            f"mal_llm_uptime_seconds {time.time() - self.started:.3f}",
+            "# TYPE mal_llm_in_flight_requests gauge",
+            f"mal_llm_in_flight_requests {self.in_flight}",
+            "# TYPE mal_llm_requests_total counter",
+        ]
+        for (route, status), count in sorted(self.requests.items()):
+            lines.append(f'mal_llm_requests_total{{route="{route}",status="{status}"}} {count}')
+        lines.append("# TYPE mal_llm_request_seconds histogram")
+        for route, (counts, total) in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'mal_llm_request_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+            lines.append(f'mal_llm_request_seconds_sum{{route="{route}"}} {total[0]:.6f}')
+            lines.append(f'mal_llm_request_seconds_count{{route="{route}"}} {cumulative}')
+        # Each family is one group of samples under its own TYPE line, as the text format requires
+        for family, stat in (("batches", "batches"), ("batch_items", "items"), ("batch_errors", "errors")):
+            lines.append(f"# TYPE mal_llm_{family}_total counter")
+            for batcher in batchers:
+                lines.append(f'mal_llm_{family}_total{{batcher="{batcher.name}"}} {batcher.stats[stat]}')
+        if cache is not None:
+            for stat in ("hits", "misses"):
+                lines.append(f"# TYPE mal_llm_cache_{stat}_total counter")
+                lines.append(f"mal_llm_cache_{stat}_total {cache.stats[stat]}")
+        ledger = [(key.split("|", 1), totals) for key, totals in sorted(usage.ledger().summary().items())
+                  if not key.startswith("*|")]
+        lines.append("# TYPE mal_llm_llm_calls_total counter")
+        for (stage, model), totals in ledger:
+            lines.append(f'mal_llm_llm_calls_total{{stage="{stage}",model="{model}"}} {totals["calls"]}')
+        lines.append("# TYPE mal_llm_tokens_total counter")
+        for (stage, model), totals in ledger:
+            for kind in ("prompt_tokens", "completion_tokens"):
+                lines.append(f'mal_llm_tokens_total{{stage="{stage}",model="{model}",kind="{kind}"}} {totals[kind]}')
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE mal_llm_{name} gauge")
+            lines.append(f"mal_llm_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPService:
+    """
+    Minimal HTTP/1.1 server on asyncio streams, with keep-alive. `routes` maps (method, path) to
+    `async handler(payload)` returning a dict (sent as JSON) or a str (sent as text); the payload is the
+    decoded JSON body, or None without one. Handlers raise `HTTPError` for client errors.
+    """
+
+    def __init__(self, routes: dict, metrics: Metrics = None, max_body_bytes: int = MAX_BODY_BYTES):
+        self.routes = routes
+        self.metrics = metrics or Metrics()
+        self.max_body_bytes = max_body_bytes
+        self.server = None
+        self.connections = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        self.server = await asyncio.start_server(self._serve, host, port, limit=64 * 1024)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # Idle keep-alive connections would otherwise hold wait_closed() open.
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    self._respond(writer, e.status, "application/json", json.dumps({"error": str(e)}).encode("utf-8"), False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, content_type, data = await self._dispatch(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._respond(writer, status, content_type, data, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _respond(writer, status: int, content_type: str, data: bytes, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body_bytes:
+            raise HTTPError(413, f"body of {length} bytes, at most {self.max_body_bytes} accepted")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        start = time.perf_counter()
+        self.metrics.in_flight += 1
+        try:
+            handler = self.routes.get((method, path))
+            if handler is None:
+                allowed = any(route_path == path for _, route_path in self.routes)
+                raise HTTPError(405 if allowed else 404, f"{method} {path} is not served")
+            try:
+                payload = json.loads(body) if body else None
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise HTTPError(400, f"invalid JSON body: {e}")
+            result = await handler(payload)
+            status = 200
+        except HTTPError as e:
+            status, result = e.status, {"error": str(e)}
+        except Exception as e:
+            print(f"❌ {method} {path}: {type(e).__name__}: {e}")
+            status, result = 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.metrics.in_flight -= 1
+        self.metrics.observe(path if (method, path) in self.routes else "other", status, time.perf_counter() - start)
+        if isinstance(result, str):
+            return status, "text/plain; version=0.0.4", result.encode("utf-8")
+        return status, "application/json", json.dumps(result, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def add_arguments(parser):
+    """
+    Adds the service options to a server's argument parser.
+    """
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max_batch", type=int, default=MAX_BATCH,
+                        help="Most snippets embedded, or vectors searched, in one call.")
+    parser.add_argument("--max_wait_ms", type=float, default=MAX_WAIT_MS,
+                        help="How long a micro-batch waits for more requests after its first one.")
+    parser.add_argument("--max_concurrency", type=int, default=64, help="Packages classified at the same time.")
+    parser.add_argument("--cache_size", type=int, default=10000, help="Verdicts kept in the LRU cache (0 disables it).")
+    parser.add_argument("--local", action="store_true",
+                        help="Serve with the local stand-ins: hashing embeddings, the local vector store and a canned model.")
@@ -0,0 +1,216 @@
+import re
+import hashlib
+import argparse
+from pathlib import Path
+
+
+# Seed of the dataset shuffle, so every machine sees the packages of its shard in the same order.
+SEED = 42
+
+def parse_shard(value: str) -> tuple:
+    """
+    `"2/8"` -> (2, 8): shard 2 of 8, counted from 0.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value or "")
+    if not match:
+        raise argparse.ArgumentTypeError(f"--shard expects i/N, got {value!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise argparse.ArgumentTypeError(f"--shard {value}: i must be in 0..N-1")
+    return index, count
+
+
+def shard_of(package_name: str, count: int) -> int:
+    """
+    Stable shard of a package: unlike `hash()`, the same on every machine and Python run.
+    """
+    digest = hashlib.blake2b(str(package_name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % count
+
+
+class ShardConfig:
+    """
+    The shard this run processes; (0, 1) is the whole dataset.
+    """
+
+    def __init__(self, index: int = 0, count: int = 1, seed: int = SEED):
+        self.index = index
+        self.count = count
+        self.seed = seed
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+
+_config = ShardConfig()
+
+
+def shuffle(test_dataset):
+    """
+    Seeded replacement of `sample(frac=1).reset_index(drop=True)`.
+    """
+    return test_dataset.sample(frac=1, random_state=_config.seed).reset_index(drop=True)
+
+
+def select(test_dataset, column: str = "package_name"):
+    """
+    Keeps the rows of this run's shard.
+    """
+    if not _config.enabled:
+        return test_dataset
+    mask = test_dataset[column].map(lambda name: shard_of(name, _config.count) == _config.index)
+    selected = test_dataset[mask].reset_index(drop=True)
+    print(f"🔍 Shard {_config.index}/{_config.count}: {len(selected)} of {len(test_dataset)} packages")
+    return selected
+
+
+def select_paths(paths: list, package_name=lambda path: Path(path).parent.name) -> list:
+    """
+    Keeps the package files of this run's shard, for runners that iterate over files.
+    """
+    if not _config.enabled:
+        return paths
+    selected = [path for path in paths if shard_of(package_name(path), _config.count) == _config.index]
+    print(f"🔍 Shard {_config.index}/{_config.count}: {len(selected)} of {len(paths)} packages")
+    return selected
+
+
+def result_path(path, index: int = None, count: int = None):
+    """
+    `results.csv` -> `results.shard-2-of-8.csv` when sharding, unchanged otherwise.
+    """
+    index = _config.index if index is None else index
+    count = _config.count if count is None else count
+    if path is None or count <= 1:
+        return path
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.shard-{index}-of-{count}{path.suffix}"))
+
+
+def read_results(path) -> dict:
+    """
+    Reads {filename: row} of a result CSV; rows repeated by a resumed run keep their last value.
+    """
+    rows = {}
+    with open(path, "r", encoding="utf-8") as file:
+        next(file, None)
+        for line in file:
+            line = line.rstrip("\n")
+            if line:
+                rows[line.split(",", 1)[0]] = line
+    return rows
+
+
+def read_header(path) -> str:
+    with open(path, "r", encoding="utf-8") as file:
+        return file.readline().rstrip("\n")
+
+
+def check_headers(paths: list) -> tuple:
+    """
+    Returns the header line of the first result file and the problems of the files whose header differs:
+    files of different runners (or versions) must not be merged into one.
+    """
+    header, problems = None, []
+    for path in paths:
+        line = read_header(path)
+        if header is None:
+            header = line
+        elif line != header:
+            problems.append(f"{path} has the header {line!r}, not the {header!r} of {paths[0]}")
+    return header, problems
+
+
+def write_results(path, header: str, rows: dict):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(header + "\n")
+        for name in sorted(rows):
+            file.write(rows[name] + "\n")
+
+
+def merge(path, count: int, expected: list = None) -> dict:
+    """
+    Merges the shard files of `path` into `path`, under the header of the first one. Checks that all N shard
+    files exist, that every package sits in the shard its name hashes to and, given the expected package names,
+    that none is missing. Shard files with different headers are not merged.
+    """
+    merged, problems = {}, []
+    shard_paths = []
+    for index in range(count):
+        shard_path = result_path(path, index, count)
+        if not Path(shard_path).exists():
+            problems.append(f"missing shard file {shard_path}")
+            continue
+        shard_paths.append((index, shard_path))
+    header, mismatches = check_headers([shard_path for _, shard_path in shard_paths])
+    if header is None or mismatches:
+        for problem in problems + mismatches:
+            print(f"⚠️ {problem}")
+        print(f"❌ Nothing merged into {path}: {'the shard headers differ' if mismatches else 'no shard file'}")
+        return {"packages": 0, "missing": [], "problems": problems + (mismatches or ["no shard file"])}
+    for index, shard_path in shard_paths:
+        rows = read_results(shard_path)
+        misplaced = [name for name in rows if shard_of(name, count) != index]
+        if misplaced:
+            problems.append(f"{len(misplaced)} packages of {shard_path} belong to other shards, e.g. {misplaced[0]}")
+        duplicates = set(rows) & set(merged)
+        if duplicates:
+            problems.append(f"{len(duplicates)} packages of {shard_path} already seen in another shard")
+        merged.update(rows)
+        print(f"📂 {shard_path}: {len(rows)} packages")
+
+    missing = sorted(set(expected) - set(merged)) if expected is not None else []
+    if missing:
+        problems.append(f"{len(missing)} expected packages have no result, e.g. {missing[:5]}")
+
+    write_results(path, header, merged)
+    for problem in problems:
+        print(f"⚠️ {problem}")
+    status = "✅" if not problems else "❌"
+    print(f"{status} Merged {len(merged)} packages from {count} shards into {path}")
+    return {"packages": len(merged), "missing": missing, "problems": problems}
+
+
+def read_expected(paths: list) -> list:
+    """
+    Package names of the datasets a run was sharded over (the `package_name` of JSON/CSV files).
+    """
+    import pandas as pd
+
+    names = []
+    for path in paths:
+        frame = pd.read_json(path) if str(path).endswith(".json") else pd.read_csv(path)
+        names.extend(frame["package_name"].astype(str))
+    return names
+
+
+def add_arguments(parser):
+    """
+    Adds the sharding options to an experiment's argument parser.
+    """
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="Process shard i of N (i/N, counted from 0), chosen by a stable hash of the package name.")
+    parser.add_argument("--shuffle_seed", type=int, default=SEED, help="Seed of the dataset shuffle.")
+
+
+def configure(index: int = 0, count: int = 1, seed: int = SEED) -> ShardConfig:
+    global _config
+    _config = ShardConfig(index=index, count=count, seed=seed)
+    return _config
+
+
+def configure_from_args(args) -> ShardConfig:
+    return configure(index=args.shard[0], count=args.shard[1], seed=args.shuffle_seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the per-shard result files of a sharded run.")
+    parser.add_argument("command", choices=["merge"])
+    parser.add_argument("result_file", help="Result file passed to the runners with -r, e.g. results.csv.")
+    parser.add_argument("--shards", type=int, required=True, help="N of the --shard i/N runs.")
+    parser.add_argument("--expected", nargs="*", default=None,
+                        help="Dataset files (JSON/CSV with package_name) whose packages must all have a result.")
+    args = parser.parse_args()
+    report = merge(args.result_file, args.shards, read_expected(args.expected) if args.expected else None)
+    raise SystemExit(1 if report["problems"] else 0)
@@ -0,0 +1,239 @@
+import re
+import argparse
+
+import numpy as np
+
+from common import usage
+
+
+# Token budget of a selected snippet; 300 characters of setup.py are roughly 80-100 tokens.
+SNIPPET_TOKENS = 100
+# Lines per scored window.
+WINDOW_LINES = 3
+# Longer lines (minified or packed payloads) are cut in the snippet so one line cannot take the whole budget.
+MAX_LINE_CHARS = 240
+# Tokenizer used for the budget; the character estimate of `usage` is used when it is not installed.
+TOKEN_MODEL = "gpt-4o-mini"
+
+# (name, literals, pattern, weight) of the indicators scored on every line. A pattern only runs on files
+# containing one of its literals, which skips most of the regex work on ordinary setup.py files.
+INDICATORS = [
+    ("exec", ("exec", "eval", "compile"), r"\b(?:exec|eval|compile)\s*\(", 4.0),
+    ("decode", ("decode", "decompress", "unhexlify", "fromhex", "marshal"),
+     r"\b(?:b64decode|b32decode|b16decode|a85decode|decompress|unhexlify|fromhex)\b|marshal\.loads|codecs\.decode", 3.0),
+    ("process", ("subprocess", "os.", "Popen", "check_output"),
+     r"\bsubprocess\b|\bos\.(?:system|popen|exec\w*|spawn\w*)\b|\bPopen\b|\bcheck_output\b", 3.0),
+    ("dynamic_import", ("__import__", "importlib", "__builtins__"), r"__import__|\bimportlib\b|\bgetattr\s*\(\s*__builtins__", 2.0),
+    ("url", ("http",), r"https?://[^\s'\"]+", 2.0),
+    ("ip_address", (".",), r"\b\d{1,3}(?:\.\d{1,3}){3}\b", 2.0),
+    ("network", ("urlopen", "urlretrieve", "socket", "http.client", "requests."),
+     r"\b(?:urlopen|urlretrieve|socket|http\.client)\b|\brequests\.(?:get|post)\b", 2.0),
+    ("webhook", ("discord", "telegram"), r"discord(?:app)?\.com/api/webhooks|api\.telegram\.org", 3.0),
+    ("install_hook", ("cmdclass", "install", "develop", "egg_info"),
+     r"\bcmdclass\b|class\s+\w+\(\s*(?:install|develop|egg_info)\s*\)", 2.0),
+    ("escapes", ("\\x", "chr("), r"(?:\\x[0-9a-fA-F]{2}){4,}|(?:chr\(\d+\)\s*\+\s*){3,}", 2.0),
+    ("secrets", ("getpass", "environ", "APPDATA", "Login Data", ".ssh", "token", "password"),
+     r"\b(?:getpass|os\.environ|APPDATA|LOCALAPPDATA|Login Data|\.ssh|token|password)\b", 1.0),
+    ("filesystem", ("shutil", "os.remove", "chmod", "crontab", ".bashrc", "Startup"),
+     r"\b(?:shutil|os\.remove|chmod|crontab|\.bashrc|Startup)\b", 1.0),
+]
+# Candidate encoded blobs, scored only when their character entropy looks like base64, hex or compressed data.
+BLOB_PATTERN = re.compile(r"[A-Za-z0-9+/=_\-]{40,}")
+BLOB_ENTROPY = 4.0
+BLOB_WEIGHT = 3.0
+
+_INDICATORS = [(name, literals, re.compile(pattern), weight) for name, literals, pattern, weight in INDICATORS]
+
+
+def entropy(text: str) -> float:
+    """
+    Shannon entropy in bits per character.
+    """
+    counts = np.bincount(np.frombuffer(text.encode("utf-8"), dtype=np.uint8))
+    probabilities = counts[counts > 0] / counts.sum()
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+def score_lines(text: str) -> tuple:
+    """
+    Returns (lines, scores): the indicator matches of the whole file are mapped to their lines at once.
+    """
+    lines = text.splitlines()
+    if not lines:
+        return lines, np.zeros(0)
+    # Offset of the end of every line in `text`, newline included.
+    ends = np.cumsum([len(line) for line in text.splitlines(keepends=True)])
+    offsets, weights = [], []
+    for _, literals, pattern, weight in _INDICATORS:
+        if any(literal in text for literal in literals):
+            for match in pattern.finditer(text):
+                offsets.append(match.start())
+                weights.append(weight)
+    for match in BLOB_PATTERN.finditer(text):
+        if entropy(match.group()) >= BLOB_ENTROPY:
+            offsets.append(match.start())
+            weights.append(BLOB_WEIGHT)
+    if not offsets:
+        return lines, np.zeros(len(lines))
+    line_ids = np.searchsorted(ends, np.asarray(offsets), side="right")
+    return lines, np.bincount(line_ids, weights=weights, minlength=len(lines))[:len(lines)]
+
+
+def indicator_counts(text: str) -> dict:
+    """
+    Matches of each indicator in the whole file, plus "blob" for the high-entropy encoded strings.
+    """
+    counts = {}
+    for name, literals, pattern, _ in _INDICATORS:
+        if any(literal in text for literal in literals):
+            matches = sum(1 for _ in pattern.finditer(text))
+            if matches:
+                counts[name] = matches
+    blobs = sum(1 for match in BLOB_PATTERN.finditer(text) if entropy(match.group()) >= BLOB_ENTROPY)
+    if blobs:
+        counts["blob"] = blobs
+    return counts
+
+
+def window_scores(scores, window: int):
+    """
+    Sum of the line scores of every window of `window` consecutive lines, by first line.
+    """
+    window = max(1, min(window, len(scores)))
+    return np.convolve(scores, np.ones(window), mode="valid"), window
+
+
+def select(text: str, budget: int = SNIPPET_TOKENS, window: int = WINDOW_LINES, model: str = TOKEN_MODEL) -> str:
+    """
+    Assembles the highest-scoring line windows of `text` that fit in `budget` tokens, in file order and
+    marked with their line numbers. Files without indicators get their first lines, like the head snippet.
+    """
+    if not isinstance(text, str):
+        return text
+    lines, scores = score_lines(text)
+    if not lines:
+        return text
+    lines = [line if len(line) <= MAX_LINE_CHARS else line[:MAX_LINE_CHARS] + "…" for line in lines]
+    totals, window = window_scores(scores, window)
+    # Ties keep the earliest window, so the head of the file comes first when nothing stands out.
+    order = np.lexsort((np.arange(len(totals)), -totals))
+    chosen, taken, used = [], np.zeros(len(lines), dtype=bool), 0
+    for start in order:
+        rows = [row for row in range(start, start + window) if not taken[row]]
+        if not rows:
+            continue
+        tokens = usage.count_text_tokens("\n".join(lines[row] for row in rows), model)
+        if used + tokens > budget:
+            if chosen:
+                continue
+            # Not even the best window fits: keep as many of its lines as the budget allows.
+            while len(rows) > 1 and tokens > budget:
+                rows = rows[:-1]
+                tokens = usage.count_text_tokens("\n".join(lines[row] for row in rows), model)
+        taken[rows] = True
+        chosen.extend(rows)
+        used += tokens
+        if used >= budget:
+            break
+    return _render(lines, sorted(chosen))
+
+
+def _render(lines: list, rows: list) -> str:
+    """
+    Joins the selected lines, with a `# lines a-b` marker before each run of consecutive lines.
+    """
+    parts, run = [], []
+    for row in rows:
+        if run and row != run[-1] + 1:
+            parts.append(_render_run(lines, run))
+            run = []
+        run.append(row)
+    if run:
+        parts.append(_render_run(lines, run))
+    return "\n".join(parts)
+
+
+def _render_run(lines: list, run: list) -> str:
+    return f"# lines {run[0] + 1}-{run[-1] + 1}\n" + "\n".join(lines[row] for row in run)
+
+
+class SnippetConfig:
+    """
+    How the runners cut the `setup.py` snippet used for retrieval and prompting, and the selection stats.
+    """
+
+    def __init__(self, mode: str = "head", budget: int = SNIPPET_TOKENS, window: int = WINDOW_LINES, model: str = TOKEN_MODEL):
+        self.mode = mode
+        self.budget = budget
+        self.window = window
+        self.model = model
+        self.stats = {"files": 0, "tokens": 0, "beyond_head": 0}
+
+
+_config = SnippetConfig()
+
+
+def select_text(text, head):
+    """
+    Applies the configured selection to one `setup.py`: `head(text)` (the runner's usual cut) by default,
+    the ranked windows with `--snippets ranked`.
+    """
+    if not isinstance(text, str):
+        return text
+    if _config.mode == "head":
+        return head(text)
+    snippet = select(text, _config.budget, _config.window, _config.model)
+    _config.stats["files"] += 1
+    _config.stats["tokens"] += usage.count_text_tokens(snippet, _config.model)
+    _config.stats["beyond_head"] += not snippet.startswith("# lines 1-") or "\n# lines " in snippet
+    return snippet
+
+
+def select_column(column, head):
+    """
+    Applies `select_text` to a `setup.py` column.
+    """
+    return column.apply(lambda text: select_text(text, head))
+
+
+def print_summary():
+    stats = _config.stats
+    if not stats["files"]:
+        return
+    print(f"Snippets: {stats['files']} files, {stats['tokens'] / stats['files']:.0f} tokens on average "
+          f"(budget {_config.budget}), {stats['beyond_head']} with windows beyond the head of the file")
+
+
+def add_arguments(parser):
+    """
+    Adds the snippet selection options to an experiment's argument parser.
+    """
+    parser.add_argument("--snippets", choices=["head", "ranked"], default="head",
+                        help="Cut setup.py as before (head), or keep its most suspicious line windows (ranked).")
+    parser.add_argument("--snippet_tokens", type=int, default=SNIPPET_TOKENS,
+                        help="Token budget of a ranked snippet.")
+    parser.add_argument("--snippet_window", type=int, default=WINDOW_LINES,
+                        help="Lines per scored window.")
+
+
+def configure(mode: str = "head", budget: int = SNIPPET_TOKENS, window: int = WINDOW_LINES, model: str = TOKEN_MODEL) -> SnippetConfig:
+    global _config
+    _config = SnippetConfig(mode=mode, budget=budget, window=window, model=model)
+    return _config
+
+
+def configure_from_args(args) -> SnippetConfig:
+    return configure(mode=args.snippets, budget=args.snippet_tokens, window=args.snippet_window)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the ranked snippet selected from a file.")
+    parser.add_argument("file")
+    parser.add_argument("--tokens", type=int, default=SNIPPET_TOKENS)
+    parser.add_argument("--window", type=int, default=WINDOW_LINES)
+    args = parser.parse_args()
+    with open(args.file, "r", encoding="utf-8", errors="replace") as file:
+        content = file.read()
+    file_lines, line_scores = score_lines(content)
+    print(f"🔍 {len(file_lines)} lines, {int(np.count_nonzero(line_scores))} with indicators\n")
+    print(select(content, args.tokens, args.window))
@@ -0,0 +1,362 @@
+import re
+import json
+import asyncio
+import inspect
+
+
+WHITESPACE = " \t\r\n"
+LITERAL_END = WHITESPACE + ",:}]"
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\", "/": "/"}
+
+
+class IncrementalJSONParser:
+    """
+    Tolerant incremental parser for the JSON answers of the LLMs.
+
+    Text is fed as it arrives. Every scalar value is recorded under its (leaf) key as soon as it is complete,
+    so `prediction` is available before the explanation has been generated. Text before the first `{`
+    (e.g. a ```json fence), single-quoted strings, unquoted keys, `True`/`False` and a response cut off
+    in the middle of a string are all accepted.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.started = False
+        self.done = False
+        self._stack = []
+        self._expect_key = False
+        self._is_key = False
+        self._key = None
+        self._token = None
+        self._buffer = []
+        self._quote = '"'
+        self._escape = False
+
+    def feed(self, text: str) -> list:
+        """
+        Parses the next piece of text and returns the keys whose values were completed by it.
+        """
+        completed = []
+        for char in text:
+            if self.done:
+                break
+            if self._token == "string":
+                self._feed_string(char, completed)
+                continue
+            if self._token == "literal":
+                if char not in LITERAL_END:
+                    self._buffer.append(char)
+                    continue
+                self._end_literal(completed)
+            self._feed_structure(char)
+        return completed
+
+    def _feed_string(self, char: str, completed: list):
+        if self._escape:
+            self._escape = False
+            self._buffer.append("\\" + char)
+        elif char == "\\":
+            self._escape = True
+        elif char == self._quote:
+            self._token = None
+            self._set_value(self._decode(self._buffer), completed)
+        else:
+            self._buffer.append(char)
+
+    def _feed_structure(self, char: str):
+        if not self.started:
+            if char == "{":
+                self.started = True
+                self._open("{")
+            return
+        if char in WHITESPACE:
+            return
+        if char in "{[":
+            self._open(char)
+        elif char in "}]":
+            if self._stack:
+                self._stack.pop()
+            self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+            self._is_key = False
+            if not self._stack:
+                self.done = True
+        elif char == ":":
+            self._expect_key = False
+        elif char == ",":
+            self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+        elif char in "\"'":
+            self._start("string", quote=char)
+        else:
+            self._start("literal")
+            self._buffer.append(char)
+
+    def _open(self, char: str):
+        self._stack.append(char)
+        self._expect_key = char == "{"
+
+    def _start(self, token: str, quote: str = '"'):
+        self._token = token
+        self._quote = quote
+        self._buffer = []
+        self._is_key = self._expect_key and self._stack[-1] == "{"
+
+    def _end_literal(self, completed: list):
+        self._token = None
+        raw = "".join(self._buffer)
+        if self._is_key:
+            self._set_value(raw, completed)
+            return
+        lowered = raw.lower()
+        if lowered in ("true", "false"):
+            value = lowered == "true"
+        elif lowered in ("null", "none"):
+            value = None
+        else:
+            try:
+                value = int(raw)
+            except ValueError:
+                try:
+                    value = float(raw)
+                except ValueError:
+                    value = raw
+        self._set_value(value, completed)
+
+    def _set_value(self, value, completed: list):
+        if self._is_key:
+            self._key = value
+            self._is_key = False
+            self._expect_key = False
+            return
+        # Values inside arrays have no key of their own.
+        if self._stack and self._stack[-1] == "{" and self._key is not None:
+            self.fields[self._key] = value
+            completed.append(self._key)
+
+    @staticmethod
+    def _decode(buffer: list) -> str:
+        raw = "".join(buffer)
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return re.sub(r"\\(.)", lambda match: ESCAPES.get(match.group(1), match.group(1)), raw)
+
+    def partial(self):
+        """
+        Returns (key, text so far) of the string value being decoded, or None.
+        """
+        if self._token == "string" and not self._is_key and self._key is not None:
+            return self._key, self._decode(self._buffer)
+        return None
+
+    def finish(self) -> dict:
+        """
+        Closes a truncated response, keeping the string or literal that was being decoded.
+        """
+        if self._token == "string" and not self._is_key:
+            self._token = None
+            self._set_value(self._decode(self._buffer), [])
+        elif self._token == "literal":
+            self._end_literal([])
+        self._token = None
+        return dict(self.fields)
+
+
+def parse(text: str) -> dict:
+    """
+    Tolerantly parses a complete or truncated JSON answer into {leaf key: value}.
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(text or "")
+    return parser.finish()
+
+
+def first_sentences(text: str, count: int = 2) -> str:
+    sentences = re.split(r"(?<=[.!?])\s+", text or "")
+    return " ".join(sentences[:count])
+
+
+def extract_llm_output(raw_text: str) -> dict:
+    """
+    Extracts the prediction and a two-sentence explanation from a malformed JSON response.
+    """
+    fields = parse(raw_text)
+    prediction = fields.get("prediction", False)
+    if isinstance(prediction, str):
+        prediction = prediction.strip().lower() in ("true", "1", "malicious")
+    return {
+        "prediction": bool(prediction),
+        "explanation": first_sentences(str(fields.get("explanation") or "")),
+    }
+
+
+def _chunk_text(chunk) -> str:
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return ""
+    delta = getattr(choices[0], "delta", None)
+    return getattr(delta, "content", None) or ""
+
+
+class StructuredStream:
+    """
+    Consumes a streamed chat completion (OpenAI or TGI chunks) in the background and decodes it incrementally.
+
+    `await stream.wait_for("prediction")` returns as soon as the verdict is decoded, `await stream.result()`
+    once the whole answer has arrived, and `stream.cancel()` stops the generation of the rest.
+    """
+
+    def __init__(self, chunks, on_complete=None):
+        self.chunks = chunks
+        self.parser = IncrementalJSONParser()
+        self.parts = []
+        self.usage = None
+        self.error = None
+        self.cancelled = False
+        self._on_complete = on_complete
+        self._events = {}
+        self._finished = asyncio.Event()
+        self._task = asyncio.ensure_future(self._consume())
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def fields(self) -> dict:
+        return dict(self.parser.fields)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the fields decoded so far, including the string value still being generated.
+        """
+        fields = self.fields
+        partial = self.parser.partial()
+        if partial is not None:
+            fields.setdefault(*partial)
+        return fields
+
+    async def _consume(self):
+        try:
+            async for chunk in self.chunks:
+                self.usage = getattr(chunk, "usage", None) or self.usage
+                text = _chunk_text(chunk)
+                if not text:
+                    continue
+                self.parts.append(text)
+                for key in self.parser.feed(text):
+                    if key in self._events:
+                        self._events[key].set()
+        except asyncio.CancelledError:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+        finally:
+            await self._close()
+            self.parser.finish()
+            self._finished.set()
+            for event in self._events.values():
+                event.set()
+            if self._on_complete is not None:
+                self._on_complete(self)
+
+    async def _close(self):
+        close = getattr(self.chunks, "aclose", None) or getattr(self.chunks, "close", None)
+        if close is None:
+            return
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
+
+    async def wait_for(self, key: str):
+        """
+        Waits until `key` is decoded and returns its value, or None if the answer ended without it.
+        """
+        if key not in self.parser.fields and not self._finished.is_set():
+            await self._events.setdefault(key, asyncio.Event()).wait()
+        if key not in self.parser.fields and self.error is not None:
+            raise self.error
+        return self.parser.fields.get(key)
+
+    async def result(self) -> dict:
+        """
+        Waits for the end of the answer and returns every decoded field.
+        """
+        await self._finished.wait()
+        if not self.parser.fields and self.error is not None:
+            raise self.error
+        return self.fields
+
+    def cancel(self):
+        if not self._task.done():
+            self._task.cancel()
+
+
+class StreamingConfig:
+    """
+    Whether runners stream the answers, and what happens to the explanation once the verdict is known.
+    """
+
+    def __init__(self, enabled: bool = False, explanation: str = "keep"):
+        self.enabled = enabled
+        self.explanation = explanation
+        self.pending = set()
+
+
+_config = StreamingConfig()
+
+
+def enabled() -> bool:
+    return _config.enabled
+
+
+async def complete(stream: StructuredStream, write):
+    """
+    Hands the decoded fields to `write(fields)`. With `--stream_explanation keep` the explanation keeps
+    streaming in the background and the row is written when it ends; with `cancel` the generation is
+    stopped and the row is written right away with the explanation decoded so far.
+    """
+    if _config.explanation == "cancel":
+        stream.cancel()
+        await write(stream.snapshot())
+        return
+
+    async def finish():
+        try:
+            await write(await stream.result())
+        except Exception as e:
+            print(f"❌ Error finishing a streamed answer: {e}")
+
+    task = asyncio.ensure_future(finish())
+    _config.pending.add(task)
+    task.add_done_callback(_config.pending.discard)
+
+
+async def drain():
+    """
+    Waits for the explanations still streaming in the background.
+    """
+    while _config.pending:
+        await asyncio.gather(*list(_config.pending))
+
+
+def add_arguments(parser):
+    """
+    Adds the streaming options to an experiment's argument parser.
+    """
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the answers and decode the verdict as soon as it is generated.")
+    parser.add_argument("--stream_explanation", choices=["keep", "cancel"], default="keep",
+                        help="Finish the explanation in the background, or cancel it once the verdict is known.")
+
+
+def configure(enabled: bool = False, explanation: str = "keep") -> StreamingConfig:
+    global _config
+    _config = StreamingConfig(enabled=enabled, explanation=explanation)
+    return _config
+
+
+def configure_from_args(args) -> StreamingConfig:
+    return configure(enabled=args.stream, explanation=args.stream_explanation)
@@ -0,0 +1,250 @@
+import json
+import time
+import uuid
+import atexit
+import argparse
+import threading
+import contextvars
+from collections import defaultdict
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """
+    Stand-in returned while tracing is disabled, so instrumented code pays almost nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed pipeline stage, nested under the span that was current when it started.
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id", "parent_id",
+                 "start", "_perf_start", "duration", "error", "token", "otel_span")
+
+    def __init__(self, tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.error = None
+        self.token = None
+        self.otel_span = None
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def __enter__(self):
+        self.otel_span = self.tracer.start_otel_span(self)
+        self.token = _current_span.set(self)
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._perf_start
+        _current_span.reset(self.token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.export(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Exports finished spans as JSONL lines and, optionally, to OpenTelemetry.
+    """
+
+    def __init__(self, path: str = None, otel: bool = False):
+        self.path = path
+        self.enabled = bool(path) or otel
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8") if path else None
+        self.otel_tracer = None
+        if otel:
+            try:
+                from opentelemetry import trace as otel_trace
+            except ImportError:
+                print("⚠️ opentelemetry is not installed, spans are only written to the JSONL trace.")
+            else:
+                self.otel_tracer = otel_trace.get_tracer("mal-llm")
+        if self.file:
+            atexit.register(self.close)
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def start_otel_span(self, span: Span):
+        if self.otel_tracer is None:
+            return None
+        from opentelemetry import trace as otel_trace
+
+        parent = _current_span.get()
+        context = otel_trace.set_span_in_context(parent.otel_span) if parent and parent.otel_span else None
+        return self.otel_tracer.start_span(span.name, context=context)
+
+    def export(self, span: Span):
+        if span.otel_span is not None:
+            for key, value in span.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    span.otel_span.set_attribute(key, value)
+            span.otel_span.end()
+        if self.file:
+            line = json.dumps(span.to_dict(), default=str)
+            with self.lock:
+                self.file.write(line + "\n")
+
+    def close(self):
+        if self.file and not self.file.closed:
+            self.file.close()
+
+
+_tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """
+    Returns a context manager timing one pipeline stage, e.g. `with tracing.span("retrieve", collection=...)`.
+    """
+    return _tracer.span(name, **attributes)
+
+
+def current_span():
+    """
+    Returns the innermost active span, or a no-op span when tracing is disabled.
+    """
+    return _current_span.get() or NOOP_SPAN
+
+
+def record_usage(response):
+    """
+    Adds the token usage of a chat-completion response to the current span.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    active = current_span()
+    active.add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+    active.add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+
+def enabled() -> bool:
+    return _tracer.enabled
+
+
+def configure(path: str = None, otel: bool = False) -> Tracer:
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(path=path, otel=otel)
+    return _tracer
+
+
+def add_arguments(parser):
+    """
+    Adds the tracing options to an experiment's argument parser.
+    """
+    parser.add_argument("--trace", type=str, default=None, metavar="PATH",
+                        help="Write per-stage spans of every package to this JSONL file.")
+    parser.add_argument("--trace_otel", action="store_true",
+                        help="Also export spans through the configured OpenTelemetry tracer provider.")
+
+
+def configure_from_args(args) -> Tracer:
+    return configure(path=args.trace, otel=args.trace_otel)
+
+
+def summarize(path: str) -> dict:
+    """
+    Aggregates a JSONL trace into {span name: {count, total, mean, p50, p95, errors, tokens}}.
+    """
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    tokens = defaultdict(int)
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            name = record["name"]
+            stage = record["attributes"].get("stage")
+            if stage:
+                name = f"{name}.{stage}"
+            durations[name].append(record["duration"])
+            errors[name] += record["error"] is not None
+            tokens[name] += record["attributes"].get("prompt_tokens", 0) + record["attributes"].get("completion_tokens", 0)
+
+    summary = {}
+    for name, values in durations.items():
+        ordered = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "total": sum(values),
+            "mean": sum(values) / len(values),
+            "p50": ordered[int(0.50 * (len(ordered) - 1))],
+            "p95": ordered[int(0.95 * (len(ordered) - 1))],
+            "errors": errors[name],
+            "tokens": tokens[name],
+        }
+    return summary
+
+
+def print_summary(path: str = None):
+    """
+    Prints the time spent per stage, as a share of the total package time.
+    """
+    path = path or _tracer.path
+    if not path:
+        return
+    if _tracer.file:
+        _tracer.file.flush()
+    summary = summarize(path)
+    package_total = summary.get("package", {}).get("total") or sum(s["total"] for s in summary.values())
+    print(f"{'stage':<18}{'count':>7}{'total s':>10}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}{'share':>8}{'tokens':>10}{'errors':>8}")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+        share = stats["total"] / package_total if package_total else 0.0
+        print(f"{name:<18}{stats['count']:>7}{stats['total']:>10.2f}{stats['mean']:>9.3f}{stats['p50']:>9.3f}"
+              f"{stats['p95']:>9.3f}{share:>8.1%}{stats['tokens']:>10}{stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a JSONL trace by pipeline stage.")
+    parser.add_argument("trace", type=str, help="JSONL trace written with --trace.")
+    print_summary(parser.parse_args().trace)
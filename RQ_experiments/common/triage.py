@@ -0,0 +1,269 @@
+import time
+import zlib
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from common import dedupe, distill, explanations, snippets, typosquat
+
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+# Package files of each split, with their label
+TRAIN_FILES = {"train_malicious_packages_final.json": True, "train_benign_packages_final.json": False}
+TEST_FILES = {"test_malicious_packages_final.json": True, "test_benign_packages_final.json": False}
+MODEL_FILE = "triage_model.npz"
+
+# Share of the train packages held out to calibrate the thresholds
+CALIBRATION = 0.2
+# Accuracy the local verdicts must reach on the calibration packages
+TARGET_ACCURACY = 0.99
+# setup.py tokens that are looked at
+MAX_TOKENS = 4096
+LABELS = ["benign", "malicious"]
+DENSE = 5
+
+
+def _indices(features) -> np.ndarray:
+    return np.array(sorted({distill.hash_feature(feature) for feature in features}), dtype=np.int64)
+
+
+def vectorize(package_name: str, setup_py: str, file_list) -> tuple:
+    """
+    Sparse features of a package as (indices, values): the words and word pairs of setup.py, the indicators
+    of common/snippets.py it matches, the names and extensions of its files, the character trigrams of its
+    name, and its sizes and typosquat distance.
+    """
+    setup_py = setup_py if isinstance(setup_py, str) else ""
+    file_list = file_list if isinstance(file_list, (list, tuple)) else []
+    tokens = distill.TOKEN.findall(setup_py.lower())[:MAX_TOKENS]
+    code = [f"c:{token}" for token in tokens] + [f"c2:{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    counts = snippets.indicator_counts(setup_py)
+    files = []
+    for path in file_list:
+        name = str(path).replace("\\", "/").rsplit("/", 1)[-1].lower()
+        files += [f"f:{name}", f"x:{name.rsplit('.', 1)[-1] if '.' in name else ''}"]
+    name_features = typosquat.features(package_name)
+    name = f"^{name_features['name']}$"
+    trigrams = [f"n:{name[i:i + 3]}" for i in range(len(name) - 2)]
+    return distill.sparse_row(
+        [_indices(code), _indices(f"i:{indicator}" for indicator in counts), _indices(files), _indices(trigrams)],
+        [np.log1p(len(setup_py)) / 10, np.log1p(len(file_list)) / 5, np.log1p(sum(counts.values())) / 3,
+         float(name_features["typosquat"]), float(name_features["popular"])])
+
+
+class TriageModel(distill.LinearModel):
+    """
+    Logistic regression over hashed features of a package, with the calibrated thresholds of its cascade:
+    packages at or below the `low` malicious logit are benign, at or above `high` malicious, the rest go to
+    the LLM. The thresholds are logits because confident packages all round to a probability of 1.0.
+    """
+
+    def __init__(self, weights=None, bias=None, low: float = -np.inf, high: float = np.inf):
+        super().__init__(LABELS, distill.DIMENSIONS + DENSE, weights, bias)
+        self.low = low
+        self.high = high
+
+    def logit(self, package_name: str, setup_py: str, file_list) -> float:
+        """
+        Log-odds that the package is malicious, in float64.
+        """
+        indices, values = vectorize(package_name, setup_py, file_list)
+        scores = np.asarray(values, dtype=np.float64) @ self.weights[indices].astype(np.float64) + self.bias.astype(np.float64)
+        return float(scores[1] - scores[0])
+
+    def probability(self, package_name: str, setup_py: str, file_list) -> float:
+        """
+        Probability that the package is malicious.
+        """
+        return probability_of(self.logit(package_name, setup_py, file_list))
+
+    def decide(self, package_name: str, setup_py: str, file_list) -> tuple:
+        """
+        Returns (verdict, probability), the verdict being None when the LLM has to decide.
+        """
+        logit = self.logit(package_name, setup_py, file_list)
+        if logit <= self.low:
+            return False, probability_of(logit)
+        if logit >= self.high:
+            return True, probability_of(logit)
+        return None, probability_of(logit)
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            np.savez_compressed(file, weights=self.weights, bias=self.bias, logit_thresholds=np.array([self.low, self.high]))
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as arrays:
+            low, high = arrays["logit_thresholds"]
+            return cls(arrays["weights"], arrays["bias"], float(low), float(high))
+
+
+def probability_of(logit: float) -> float:
+    return float(1.0 / (1.0 + np.exp(-np.clip(logit, -700.0, 700.0))))
+
+
+def load_packages(files: dict, data_dir=DATA_DIR) -> list:
+    """
+    The packages of a split as (package_name, setup.py, file_list, malicious) tuples.
+    """
+    import pandas as pd
+
+    packages = []
+    for file_name, malicious in files.items():
+        frame = pd.read_json(Path(data_dir) / file_name)
+        packages += [(row["package_name"], row["setup.py"], row.get("file_list"), malicious) for _, row in frame.iterrows()]
+    return packages
+
+
+def calibrate(scores, labels, target: float = TARGET_ACCURACY) -> tuple:
+    """
+    The widest (low, high) thresholds whose local verdicts are at least `target` accurate: the packages at or
+    below `low` must be that share benign, those at or above `high` that share malicious. Thresholds sit on
+    distinct score values and count every package tied with them, as `decide` does. (-inf, inf) disable a side.
+    """
+    values, inverse = np.unique(np.asarray(scores, dtype=np.float64), return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(values))
+    malicious = np.bincount(inverse, weights=np.asarray(labels, dtype=np.float64), minlength=len(values))
+    # Packages at or below each value, and at or above it
+    below, malicious_below = np.cumsum(totals), np.cumsum(malicious)
+    above, malicious_above = np.cumsum(totals[::-1])[::-1], np.cumsum(malicious[::-1])[::-1]
+    low_ok = np.nonzero(1.0 - malicious_below / np.maximum(below, 1) >= target)[0]
+    high_ok = np.nonzero(malicious_above / np.maximum(above, 1) >= target)[0]
+    low = float(values[low_ok[-1]]) if len(low_ok) else -np.inf
+    high = float(values[high_ok[0]]) if len(high_ok) else np.inf
+    return low, max(high, float(np.nextafter(low, np.inf)))
+
+
+def train(data_dir=DATA_DIR, out: str = MODEL_FILE, calibration: float = CALIBRATION, target: float = TARGET_ACCURACY,
+          epochs: int = 5, learning_rate: float = 0.5, seed: int = 0) -> TriageModel:
+    """
+    Fits the model on the train split less the calibration packages (chosen by name), then picks the thresholds
+    on the calibration packages. The model is not refitted afterwards, so the thresholds stay calibrated.
+    """
+    packages = load_packages(TRAIN_FILES, data_dir)
+    held_out = [zlib.crc32(str(package[0]).encode("utf-8")) % 1000 < calibration * 1000 for package in packages]
+    fit = [package for package, hold in zip(packages, held_out) if not hold]
+    check = [package for package, hold in zip(packages, held_out) if hold]
+    print(f"🚀 Training on {len(fit)} packages, calibrating on {len(check)}")
+    model = TriageModel().fit_rows([(*vectorize(name, setup_py, file_list), LABELS[malicious])
+                                    for name, setup_py, file_list, malicious in fit], epochs, learning_rate, seed)
+    logits = [model.logit(name, setup_py, file_list) for name, setup_py, file_list, _ in check]
+    model.low, model.high = calibrate(logits, [malicious for *_, malicious in check], target)
+    decided = sum(logit <= model.low or logit >= model.high for logit in logits)
+    print(f"Logit thresholds for {100 * target:.1f}% accurate local verdicts: benign <= {model.low:.4f}, malicious >= {model.high:.4f} "
+          f"({100 * decided / max(1, len(check)):.1f}% of the calibration packages decided locally)")
+    model.save(out)
+    print(f"✅ Saved the triage model to {out}")
+    return model
+
+
+def _accuracy(pairs) -> str:
+    pairs = list(pairs)
+    return f"{100 * sum(verdict == label for verdict, label in pairs) / len(pairs):.1f}%" if pairs else "n/a"
+
+
+def evaluate(model_path: str = MODEL_FILE, data_dir=DATA_DIR, llm_results: str = None):
+    """
+    Runs the cascade over the test split: the accuracy of the local verdicts and the share of LLM calls they
+    avoid, and with the result file of an LLM run on the same split, the accuracy of the cascade against the
+    LLM alone.
+    """
+    model = TriageModel.load(model_path)
+    packages = load_packages(TEST_FILES, data_dir)
+    start = time.perf_counter()
+    decisions = [model.decide(name, setup_py, file_list)[0] for name, setup_py, file_list, _ in packages]
+    elapsed = time.perf_counter() - start
+    labels = [malicious for *_, malicious in packages]
+    local = [(verdict, label) for verdict, label in zip(decisions, labels) if verdict is not None]
+    print(f"{len(packages)} test packages in {elapsed:.2f}s ({elapsed / max(1, len(packages)) * 1e3:.2f} ms per package)")
+    print(f"  decided locally: {len(local)} ({100 * len(local) / max(1, len(packages)):.1f}% of the LLM calls avoided), "
+          f"{sum(verdict is False for verdict, _ in local)} benign, {sum(verdict is True for verdict, _ in local)} malicious, "
+          f"{_accuracy(local)} accurate")
+    if not llm_results:
+        return
+    verdicts = dedupe.read_verdicts(llm_results)
+    rows = [(verdict, explanations.is_positive(verdicts[package[0]][0]), label)
+            for package, verdict, label in zip(packages, decisions, labels) if package[0] in verdicts]
+    print(f"  against {llm_results} ({len(rows)} of the packages): LLM alone {_accuracy((llm, label) for _, llm, label in rows)}, "
+          f"cascade {_accuracy((llm if verdict is None else verdict, label) for verdict, llm, label in rows)}, "
+          f"{sum(verdict is None for verdict, _, _ in rows)} LLM calls instead of {len(rows)}")
+
+
+class TriageConfig:
+    """
+    The triage model in front of the LLM, if any, and the packages it decided.
+    """
+
+    def __init__(self, model_path: str = None):
+        self.model = TriageModel.load(model_path) if model_path else None
+        self.stats = {"benign": 0, "malicious": 0, "llm": 0}
+
+
+_config = TriageConfig()
+
+
+def enabled() -> bool:
+    return _config.model is not None
+
+
+def decide(package_name: str, setup_py: str, file_list) -> tuple:
+    """
+    (verdict, probability) of the configured model, counted in the summary; the verdict is None for the LLM.
+    """
+    verdict, probability = _config.model.decide(package_name, setup_py, file_list)
+    _config.stats["llm" if verdict is None else "malicious" if verdict else "benign"] += 1
+    return verdict, probability
+
+
+def explanation(probability: float) -> str:
+    return f"Decided by the triage model (malicious probability {probability:.4f})"
+
+
+def print_summary():
+    stats = _config.stats
+    total = sum(stats.values())
+    if not enabled() or not total:
+        return
+    local = stats["benign"] + stats["malicious"]
+    print(f"Triage: {local} of {total} packages decided without the LLM ({100 * local / total:.0f}%), "
+          f"{stats['benign']} benign, {stats['malicious']} malicious; logit thresholds {_config.model.low:.4f} / {_config.model.high:.4f}")
+
+
+def add_arguments(parser):
+    """
+    Adds the triage option to an experiment's argument parser.
+    """
+    parser.add_argument("--triage", type=str, default=None, metavar="MODEL",
+                        help="Decide the packages the triage model is confident about (`python -m common.triage train`) without the LLM.")
+
+
+def configure(model_path: str = None) -> TriageConfig:
+    global _config
+    _config = TriageConfig(model_path=model_path)
+    return _config
+
+
+def configure_from_args(args) -> TriageConfig:
+    return configure(model_path=args.triage)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and evaluate the CPU triage model placed in front of the LLM runners.")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--model", type=str, default=MODEL_FILE, help="Model written by train, read by evaluate.")
+    parser.add_argument("--data_dir", type=str, default=str(DATA_DIR), help="Folder of the train_* and test_* package files.")
+    parser.add_argument("--calibration", type=float, default=CALIBRATION, help="train: share of the packages held out for the thresholds.")
+    parser.add_argument("--target_accuracy", type=float, default=TARGET_ACCURACY,
+                        help="train: accuracy the local verdicts must reach on the calibration packages.")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--learning_rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm_results", type=str, default=None,
+                        help="evaluate: result file of an LLM run on the test split, to compare the cascade with the LLM alone.")
+    args = parser.parse_args()
+    if args.command == "train":
+        train(args.data_dir, args.model, args.calibration, args.target_accuracy, args.epochs, args.learning_rate, args.seed)
+    else:
+        evaluate(args.model, args.data_dir, args.llm_results)
@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import time
+import argparse
+import urllib.request
+from functools import lru_cache
+from pathlib import Path
+
+
+POPULAR_NAMES_FILE = os.getenv("MAL_LLM_POPULAR_NAMES", str(Path(__file__).resolve().parent / "popular_pypi_names.txt"))
+TOP_PYPI_URL = "https://hugovk.github.io/top-pypi-packages/top-pypi-packages-30-days.min.json"
+
+MAX_DISTANCE = 2
+# Short names are a few edits away from many popular ones (`xx`/`six`, `aws`/`art`): names of at most
+# EXACT_LENGTH characters only match exactly, names shorter than TWO_EDITS_LENGTH within one edit.
+EXACT_LENGTH = 3
+TWO_EDITS_LENGTH = 6
+# Shortest name that can be flagged as a typosquat
+MIN_TYPOSQUAT_LENGTH = EXACT_LENGTH + 1
+# As in SymSpell, deletes are only generated for the first characters of a name; candidates are then verified
+# on the full name, which keeps the dictionary and the per-query work small.
+PREFIX_LENGTH = 7
+
+SEPARATORS = re.compile(r"[-_.]+")
+# Dataset folders look like `2022-11-07-beautifulsup4-0.1`.
+RELEASE_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}-")
+RELEASE_VERSION = re.compile(r"-v?\d+(\.\d+)*([a-z]+\d*)?$")
+
+
+def normalise(name: str) -> str:
+    """
+    PEP 503 name normalisation: lower case, runs of `-`, `_` and `.` replaced by `-`.
+    """
+    return SEPARATORS.sub("-", name.strip().lower())
+
+
+def strip_release(name: str) -> str:
+    """
+    Removes the publication date prefix and version suffix of the dataset's package folders.
+    """
+    return RELEASE_VERSION.sub("", RELEASE_DATE.sub("", name))
+
+
+def allowed_distance(length: int, max_distance: int = MAX_DISTANCE) -> int:
+    """
+    Edits allowed between names whose shorter one has `length` characters (separators excluded).
+    """
+    if length <= EXACT_LENGTH:
+        return 0
+    return min(max_distance, 1 if length < TWO_EDITS_LENGTH else 2)
+
+
+def deletes(word: str, max_distance: int) -> set:
+    """
+    Every string obtained by deleting up to `max_distance` characters of `word`, `word` included.
+    """
+    result, frontier = {word}, {word}
+    for _ in range(max_distance):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        result |= frontier
+    return result
+
+
+def edit_distance(first: str, second: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions, adjacent transpositions),
+    or max_distance + 1 as soon as it is known to exceed `max_distance`.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    # Only the diagonal band |i - j| <= max_distance can stay within the bound; cells outside it count as too far.
+    too_far = max_distance + 1
+    previous_previous, previous = None, [j if j <= max_distance else too_far for j in range(len(second) + 1)]
+    for i in range(1, len(first) + 1):
+        current = [too_far] * (len(second) + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(len(second), i + max_distance) + 1):
+            cost = first[i - 1] != second[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return min(previous[-1], too_far)
+
+
+class TyposquatIndex:
+    """
+    SymSpell-style deletion dictionary over popular package names. `lookup(name)` returns the popular names
+    within `max_distance` edits, fewer for short names (see `allowed_distance`), nearest (then most popular) first.
+    """
+
+    def __init__(self, names: list, max_distance: int = MAX_DISTANCE, prefix_length: int = PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.rank = {}
+        self.deletes = {}
+        for name in names:
+            name = normalise(name)
+            if not name or name in self.rank:
+                continue
+            self.rank[name] = len(self.rank)
+            for key in self._keys(name):
+                self.deletes.setdefault(key, []).append(name)
+        self.lookup = lru_cache(maxsize=65536)(self._lookup)
+
+    def _keys(self, name: str) -> set:
+        keys = deletes(name[:self.prefix_length], self.max_distance)
+        # Separator-free variants, so `python3flask` and `pythondateutil` meet `python3-flask`, `python-dateutil`.
+        compact = name.replace("-", "")
+        if compact != name:
+            keys |= deletes(compact[:self.prefix_length], self.max_distance)
+        return keys
+
+    @classmethod
+    def from_file(cls, path: str = POPULAR_NAMES_FILE, **kwargs):
+        with open(path, "r", encoding="utf-8") as file:
+            names = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+        return cls(names, **kwargs)
+
+    def is_popular(self, name: str) -> bool:
+        return normalise(name) in self.rank
+
+    def _lookup(self, name: str) -> tuple:
+        name = normalise(name)
+        if name in self.rank:
+            return ((name, 0),)
+        candidates = set()
+        for key in self._keys(name):
+            candidates.update(self.deletes.get(key, ()))
+        compact = name.replace("-", "")
+        matches = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(name)) > self.max_distance and abs(len(candidate) - len(compact)) > self.max_distance:
+                continue
+            allowed = allowed_distance(min(len(compact), len(candidate.replace("-", ""))), self.max_distance)
+            if not allowed:
+                continue
+            distance = edit_distance(name, candidate, allowed)
+            if distance > 1:
+                distance = min(distance, edit_distance(compact, candidate.replace("-", ""), allowed))
+            if distance <= allowed:
+                matches.append((candidate, distance))
+        return tuple(sorted(matches, key=lambda match: (match[1], self.rank[match[0]])))
+
+    def features(self, package_name: str) -> dict:
+        """
+        Name features for the prompts and the triage: the nearest popular name and its edit distance.
+        `typosquat` is true for a name of at least MIN_TYPOSQUAT_LENGTH characters within the allowed edits of
+        a popular name without being one.
+        """
+        name = normalise(strip_release(package_name))
+        matches = self.lookup(name)
+        nearest, distance = matches[0] if matches else (None, None)
+        return {
+            "name": name,
+            "popular": distance == 0,
+            "nearest": nearest,
+            "distance": distance,
+            "typosquat": bool(distance) and len(name.replace("-", "")) >= MIN_TYPOSQUAT_LENGTH,
+            "candidates": [candidate for candidate, _ in matches[:3]],
+        }
+
+
+_index = None
+
+
+def index() -> TyposquatIndex:
+    global _index
+    if _index is None:
+        _index = TyposquatIndex.from_file()
+    return _index
+
+
+def features(package_name: str) -> dict:
+    return index().features(package_name)
+
+
+class HintConfig:
+    """
+    Whether the runners tell the LLM about names that look like typosquats.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+
+
+_config = HintConfig()
+
+
+def hint(package_name: str) -> str:
+    """
+    A line for the package message of the prompts, e.g. `Name check: ... 1 edit from the popular package
+    beautifulsoup4.`, or "" when disabled or when the name is not close to a popular one.
+    """
+    if not _config.enabled:
+        return ""
+    name_features = features(package_name)
+    if not name_features["typosquat"]:
+        return ""
+    edits = "edit" if name_features["distance"] == 1 else "edits"
+    return (f"\nName check: `{name_features['name']}` is {name_features['distance']} {edits} from the popular "
+            f"package `{name_features['nearest']}` (possible typosquat).")
+
+
+def add_arguments(parser):
+    """
+    Adds the typosquat option to an experiment's argument parser.
+    """
+    parser.add_argument("--typosquat_hint", action="store_true",
+                        help="Add the nearest popular package name to the prompt when the name looks like a typosquat.")
+
+
+def configure(enabled: bool = False) -> HintConfig:
+    global _config
+    _config = HintConfig(enabled=enabled)
+    return _config
+
+
+def configure_from_args(args) -> HintConfig:
+    return configure(enabled=args.typosquat_hint)
+
+
+def update_names(path: str = POPULAR_NAMES_FILE, top: int = 5000, url: str = TOP_PYPI_URL):
+    """
+    Refreshes the popular names from the top-pypi-packages download counts.
+    """
+    with urllib.request.urlopen(url, timeout=60) as response:
+        rows = json.load(response)["rows"]
+    names = [normalise(row["project"]) for row in rows[:top]]
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("# Popular PyPI project names (PEP 503-normalised), one per line, used by common/typosquat.py.\n"
+                   "# Refresh with `python -m common.typosquat update` (top-pypi-packages download counts).\n")
+        file.write("\n".join(names) + "\n")
+    print(f"✅ Wrote {len(names)} popular names to {path}")
+
+
+def benchmark(names: list):
+    typosquat_index = index()
+    start = time.perf_counter()
+    for name in names:
+        typosquat_index._lookup(normalise(strip_release(name)))
+    elapsed = time.perf_counter() - start
+    print(f"{len(names)} names in {elapsed:.3f}s ({elapsed / max(1, len(names)) * 1e6:.1f} µs per name, "
+          f"{len(names) / elapsed * 60 if elapsed else 0:,.0f} names per minute)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Typosquat lookups against popular PyPI names.")
+    parser.add_argument("command", choices=["check", "update", "benchmark"])
+    parser.add_argument("names", nargs="*", help="Package names (check), or a file of names (benchmark).")
+    parser.add_argument("--top", type=int, default=5000, help="Names kept by `update`.")
+    args = parser.parse_args()
+    if args.command == "update":
+        update_names(top=args.top)
+    elif args.command == "benchmark":
+        with open(args.names[0], "r", encoding="utf-8") as file:
+            benchmark([line.strip() for line in file if line.strip()])
+    else:
+        for package_name in args.names:
+            print(json.dumps(features(package_name)))
@@ -0,0 +1,316 @@
+import types
+import asyncio
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from common import hedging, structured
+
+
+# USD per million (prompt, completion) tokens. Add self-hosted or HF endpoints with --price MODEL=IN,OUT.
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Cheaper model to switch to under the `downgrade` budget policy.
+DOWNGRADES = {
+    "gpt-4o": "gpt-4o-mini",
+    "meta-llama/Llama-3.3-70B-Instruct": "meta-llama/Llama-3.1-8B-Instruct",
+}
+
+# Approximate per-message overhead of the chat templates.
+TOKENS_PER_MESSAGE = 4
+
+TRUNCATION_MARKER = "\n[...truncated]"
+
+# Ledger row of the requests cancelled before they answered: hedge losers and calls past their deadline.
+CANCELLED_STAGE = "cancelled"
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a call would exceed the per-package or per-run token budget under the `skip` policy.
+    """
+
+
+@lru_cache(maxsize=None)
+def _tokenizer(model: str):
+    """
+    Returns an `encode(text) -> list` function for the model, or None to fall back to a character estimate.
+    """
+    if "gpt" in model:
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model).encode
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base").encode
+    try:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(model)
+    except Exception:
+        return None
+    return lambda text: tokenizer.encode(text, add_special_tokens=False)
+
+
+def count_text_tokens(text: str, model: str) -> int:
+    encode = _tokenizer(model)
+    if encode is None:
+        return (len(text) + 3) // 4
+    return len(encode(text))
+
+
+def count_tokens(messages: list, model: str) -> int:
+    """
+    Counts the prompt tokens of a list of chat messages locally, before sending them.
+    """
+    return sum(count_text_tokens(str(message.get("content", "")), model) + TOKENS_PER_MESSAGE
+               for message in messages)
+
+
+def truncate_messages(messages: list, model: str, max_prompt_tokens: int) -> list:
+    """
+    Shortens the longest messages until the prompt fits in `max_prompt_tokens`.
+    """
+    messages = [dict(message) for message in messages]
+    marker_tokens = count_text_tokens(TRUNCATION_MARKER, model)
+    excess = count_tokens(messages, model) - max_prompt_tokens
+    while excess > 0:
+        longest = max(messages, key=lambda message: len(str(message.get("content", ""))))
+        content = str(longest.get("content", "")).removesuffix(TRUNCATION_MARKER)
+        tokens = count_text_tokens(content, model)
+        if tokens <= marker_tokens:
+            break
+        keep = max(0, tokens - excess - marker_tokens)
+        # Always drop at least one character so the loop terminates with approximate tokenizers.
+        cut = min(len(content) - 1, int(len(content) * keep / tokens))
+        longest["content"] = content[:cut] + TRUNCATION_MARKER
+        excess = count_tokens(messages, model) - max_prompt_tokens
+    return messages
+
+
+class UsageLedger:
+    """
+    Records the tokens of every LLM call and aggregates them per stage, model, package and run.
+    """
+
+    def __init__(self, per_package: int = None, per_run: int = None, policy: str = "truncate", prices: dict = None):
+        self.per_package = per_package
+        self.per_run = per_run
+        self.policy = policy
+        self.prices = dict(PRICES)
+        self.prices.update(prices or {})
+        self.totals = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self.run_tokens = 0
+        self.skipped = 0
+        self.truncated = 0
+        self.downgraded = 0
+        self._package = contextvars.ContextVar("package_tokens", default=None)
+
+    @contextmanager
+    def package(self, package_name: str):
+        """
+        Scopes the per-package token budget to the calls made inside this block.
+        """
+        token = self._package.set({"name": package_name, "tokens": 0})
+        try:
+            yield
+        finally:
+            self._package.reset(token)
+
+    def remaining(self):
+        limits = []
+        if self.per_run is not None:
+            limits.append(self.per_run - self.run_tokens)
+        current = self._package.get()
+        if self.per_package is not None and current is not None:
+            limits.append(self.per_package - current["tokens"])
+        return min(limits) if limits else None
+
+    def preflight(self, messages: list, model: str, max_tokens: int):
+        """
+        Applies the budget policy to a call before it is sent and returns the (messages, model) to use.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return messages, model
+        if count_tokens(messages, model) + max_tokens <= remaining:
+            return messages, model
+
+        if self.policy == "downgrade" and model in DOWNGRADES:
+            self.downgraded += 1
+            model = DOWNGRADES[model]
+            if count_tokens(messages, model) + max_tokens <= remaining:
+                return messages, model
+        if self.policy in ("truncate", "downgrade") and remaining - max_tokens > 0:
+            self.truncated += 1
+            return truncate_messages(messages, model, remaining - max_tokens), model
+
+        self.skipped += 1
+        current = self._package.get()
+        name = current["name"] if current else "run"
+        raise BudgetExceeded(f"Token budget exhausted for {name} ({remaining} tokens left)")
+
+    def record(self, stage: str, model: str, response, estimated_prompt_tokens: int = 0):
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or estimated_prompt_tokens
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+
+        for key in ((stage, model), ("*", model)):
+            totals = self.totals[key]
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+        self.run_tokens += prompt_tokens + completion_tokens
+        current = self._package.get()
+        if current is not None:
+            current["tokens"] += prompt_tokens + completion_tokens
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def summary(self) -> dict:
+        rows = {}
+        for (stage, model), totals in self.totals.items():
+            rows[f"{stage}|{model}"] = dict(totals, cost=self.cost(model, totals["prompt_tokens"], totals["completion_tokens"]))
+        return rows
+
+    def print_summary(self):
+        if not self.totals:
+            return
+        print(f"{'stage':<12}{'model':<36}{'calls':>7}{'prompt':>11}{'completion':>12}{'cost $':>10}")
+        for (stage, model), totals in sorted(self.totals.items(), key=lambda item: (item[0][0] == "*", item[0])):
+            cost = self.cost(model, totals["prompt_tokens"], totals["completion_tokens"])
+            label = "run total" if stage == "*" else stage
+            print(f"{label:<12}{model:<36}{totals['calls']:>7}{totals['prompt_tokens']:>11}"
+                  f"{totals['completion_tokens']:>12}{cost:>10.4f}")
+        if self.truncated or self.skipped or self.downgraded:
+            print(f"Budget policy '{self.policy}': {self.truncated} truncated, {self.downgraded} downgraded, "
+                  f"{self.skipped} skipped calls")
+
+
+_ledger = UsageLedger()
+
+
+def ledger() -> UsageLedger:
+    return _ledger
+
+
+def package(package_name: str):
+    """
+    Scopes the per-package token budget, e.g. `with usage.package(package_name):`.
+    """
+    return _ledger.package(package_name)
+
+
+async def metered_call(stage: str, model: str, messages: list, max_tokens: int, make_call):
+    """
+    Enforces the token budget, runs `make_call(messages, model)` under the stage deadline and records its usage.
+    """
+    messages, model = _ledger.preflight(messages, model, max_tokens)
+    estimated_prompt_tokens = count_tokens(messages, model)
+
+    def abandon(response=None):
+        _ledger.record(CANCELLED_STAGE, model, response, estimated_prompt_tokens)
+
+    async def attempt():
+        try:
+            return await make_call(messages, model)
+        except asyncio.CancelledError:
+            # The prompt was sent all the same
+            abandon()
+            raise
+
+    response = await hedging.default_caller().call(stage, attempt, on_abandoned=abandon)
+    _ledger.record(stage, model, response, estimated_prompt_tokens)
+    return response
+
+
+async def metered_stream(stage: str, model: str, messages: list, max_tokens: int, open_stream, early_key: str = "prediction"):
+    """
+    Like `metered_call`, for `open_stream(messages, model)` returning streamed chunks. Returns a
+    `structured.StructuredStream` once `early_key` is decoded; the stage deadline covers the time to that key.
+    The usage is recorded when the stream ends or is cancelled, under CANCELLED_STAGE for the streams that lost.
+    """
+    messages, model = _ledger.preflight(messages, model, max_tokens)
+    estimated_prompt_tokens = count_tokens(messages, model)
+    abandoned = set()
+
+    def record(stream):
+        response = stream
+        if stream.usage is None:
+            response = types.SimpleNamespace(usage=types.SimpleNamespace(
+                prompt_tokens=estimated_prompt_tokens, completion_tokens=count_text_tokens(stream.text, model)))
+        _ledger.record(CANCELLED_STAGE if stream in abandoned else stage, model, response, estimated_prompt_tokens)
+
+    def abandon(stream):
+        abandoned.add(stream)
+        stream.cancel()
+
+    async def make_call():
+        try:
+            chunks = await open_stream(messages, model)
+        except asyncio.CancelledError:
+            _ledger.record(CANCELLED_STAGE, model, None, estimated_prompt_tokens)
+            raise
+        stream = structured.StructuredStream(chunks, on_complete=record)
+        try:
+            await stream.wait_for(early_key)
+        except asyncio.CancelledError:
+            abandon(stream)
+            raise
+        except BaseException:
+            stream.cancel()
+            raise
+        return stream
+
+    return await hedging.default_caller().call(stage, make_call, on_abandoned=abandon)
+
+
+def print_summary():
+    _ledger.print_summary()
+
+
+def parse_prices(values) -> dict:
+    """
+    Parses `model=prompt_price,completion_price` pairs (USD per million tokens).
+    """
+    prices = {}
+    for value in values or []:
+        model, _, pair = value.rpartition("=")
+        prompt_price, _, completion_price = pair.partition(",")
+        if not model or not completion_price:
+            raise ValueError(f"Invalid price '{value}', expected MODEL=PROMPT,COMPLETION")
+        prices[model] = (float(prompt_price), float(completion_price))
+    return prices
+
+
+def add_arguments(parser):
+    """
+    Adds the token budget and pricing options to an experiment's argument parser.
+    """
+    parser.add_argument("--package_token_budget", type=int, default=None,
+                        help="Maximum prompt + completion tokens spent on one package.")
+    parser.add_argument("--run_token_budget", type=int, default=None,
+                        help="Maximum prompt + completion tokens spent on the whole run.")
+    parser.add_argument("--budget_policy", choices=["truncate", "skip", "downgrade"], default="truncate",
+                        help="What to do with a call that would exceed the budget.")
+    parser.add_argument("--price", action="append", metavar="MODEL=PROMPT,COMPLETION",
+                        help="USD per million prompt/completion tokens of a model, may be repeated.")
+
+
+def configure(per_package: int = None, per_run: int = None, policy: str = "truncate", prices: dict = None):
+    global _ledger
+    _ledger = UsageLedger(per_package=per_package, per_run=per_run, policy=policy, prices=prices)
+    return _ledger
+
+
+def configure_from_args(args) -> UsageLedger:
+    return configure(per_package=args.package_token_budget, per_run=args.run_token_budget,
+                     policy=args.budget_policy, prices=parse_prices(args.price))
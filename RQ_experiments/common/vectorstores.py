@@ -0,0 +1,187 @@
+import os
+import json
+import hashlib
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+
+
+DB_PARAMS = {
+    "database": "malware_kb",
+    "user": "malware_admin",
+    "password": "admin_secure_password",
+    "host": "localhost",
+    "port": "5432"
+}
+PGVECTOR_CONNECTION_STRING = (
+    f"postgresql+psycopg://{DB_PARAMS['user']}:{DB_PARAMS['password']}@"
+    f"{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['database']}?options=-csearch_path=malware"
+)
+
+# Query-time recall/speed trade-off of the ANN indexes (see knowledge_base_setup/manage_indexes.py).
+# None keeps the pgvector defaults (hnsw.ef_search = 40, ivfflat.probes = 1).
+HNSW_EF_SEARCH = None
+IVFFLAT_PROBES = None
+
+# Set MAL_LLM_VECTORSTORE=local to serve retrieval from JSONL files in MAL_LLM_LOCAL_KB instead of PGVector,
+# or MAL_LLM_VECTORSTORE=quantized to search the quantized exports there (see common/quantized.py).
+VECTORSTORE_BACKEND = os.getenv("MAL_LLM_VECTORSTORE", "pgvector")
+LOCAL_KB_DIR = os.getenv("MAL_LLM_LOCAL_KB", "local_kb")
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_.:/\-]+")
+
+
+def load_documents(path) -> list:
+    """
+    Loads documents from a JSONL file of {"page_content": ..., "metadata": {...}} records.
+    """
+    from langchain_core.documents import Document
+
+    documents = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                documents.append(Document(page_content=record["page_content"], metadata=record.get("metadata", {})))
+    return documents
+
+
+class HashingEmbeddings:
+    """
+    Deterministic bag-of-tokens embeddings that need no API, used with the local vector store.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest, "little")
+            vector[bucket % self.dim] += 1.0 if (bucket >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+class LocalVectorStore:
+    """
+    In-memory exact cosine search over a list of documents, exposing the PGVector search methods we use.
+    """
+
+    def __init__(self, documents: list, embeddings, collection_name: str = None):
+        self.collection_name = collection_name
+        self.documents = documents
+        self.embeddings = embeddings
+        vectors = embeddings.embed_documents([doc.page_content for doc in documents]) if documents else []
+        self.matrix = self._normalise(np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1))
+
+    @staticmethod
+    def _normalise(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @classmethod
+    def from_jsonl(cls, path, embeddings, collection_name: str = None):
+        """
+        Loads documents from a JSONL file of {"page_content": ..., "metadata": {...}} records.
+        """
+        return cls(load_documents(path), embeddings, collection_name)
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4) -> list:
+        if not self.documents:
+            return []
+        query = self._normalise(np.asarray(embedding, dtype=np.float32))
+        distances = 1.0 - self.matrix @ query
+        top = np.argsort(distances)[:k]
+        return [(self.documents[i], float(distances[i])) for i in top]
+
+    def similarity_search_by_vectors_with_score(self, embeddings: list, k: int = 4) -> list:
+        """
+        Searches several query vectors with one matrix product, e.g. a micro-batch of the classification service.
+        """
+        if not self.documents:
+            return [[] for _ in embeddings]
+        queries = self._normalise(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        distances = 1.0 - queries @ self.matrix.T
+        top = np.argsort(distances, axis=1)[:, :k]
+        return [[(self.documents[i], float(row[i])) for i in indices] for row, indices in zip(distances, top)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+def pgvector_connection_string(ef_search: int = None, probes: int = None) -> str:
+    """
+    Returns the PGVector connection string, setting `hnsw.ef_search` and `ivfflat.probes` for its sessions.
+    """
+    options = ["-csearch_path=malware"]
+    if ef_search is not None:
+        options.append(f"-chnsw.ef_search={ef_search}")
+    if probes is not None:
+        options.append(f"-civfflat.probes={probes}")
+    if len(options) == 1:
+        return PGVECTOR_CONNECTION_STRING
+    base = PGVECTOR_CONNECTION_STRING.split("?", 1)[0]
+    return f"{base}?options={quote(' '.join(options))}"
+
+
+def local_collection_path(collection_name: str) -> Path:
+    return Path(LOCAL_KB_DIR) / f"{collection_name}.jsonl"
+
+
+def get_vectorstore(collection_name: str, embeddings):
+    """
+    Returns the vector store of a knowledge-base collection.
+    """
+    if VECTORSTORE_BACKEND == "local":
+        return LocalVectorStore.from_jsonl(local_collection_path(collection_name), HashingEmbeddings(), collection_name)
+    if VECTORSTORE_BACKEND == "quantized":
+        from common import quantized
+
+        return quantized.QuantizedVectorStore.load(quantized.quantized_collection_path(collection_name), embeddings)
+
+    from langchain_postgres.vectorstores import PGVector
+
+    return PGVector(
+        embeddings=embeddings,
+        collection_name=collection_name,
+        connection=pgvector_connection_string(HNSW_EF_SEARCH, IVFFLAT_PROBES),
+        use_jsonb=True,
+        async_mode=False,
+    )
+
+
+def add_arguments(parser):
+    """
+    Adds the ANN query-time options to an experiment's argument parser.
+    """
+    parser.add_argument("--ef_search", type=int, default=None,
+                        help="hnsw.ef_search of the PGVector sessions (higher = better recall, slower).")
+    parser.add_argument("--ivfflat_probes", type=int, default=None,
+                        help="ivfflat.probes of the PGVector sessions (higher = better recall, slower).")
+
+
+def configure(ef_search: int = None, probes: int = None):
+    global HNSW_EF_SEARCH, IVFFLAT_PROBES
+    HNSW_EF_SEARCH = ef_search
+    IVFFLAT_PROBES = probes
+
+
+def configure_from_args(args):
+    configure(ef_search=args.ef_search, probes=args.ivfflat_probes)
@@ -0,0 +1,528 @@
+import os
+import time
+import glob
+import socket
+import asyncio
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+
+from common import shards
+
+
+# Seconds a claimed batch stays leased without a heartbeat; workers renew their leases every third of it.
+LEASE_SECONDS = 300.0
+# Claims per package before it is moved to the dead letters.
+MAX_ATTEMPTS = 3
+# Delay before a failed package can be claimed again, times its attempts.
+RETRY_BACKOFF = 30.0
+# Packages claimed at once by a worker.
+BATCH_SIZE = 1
+# How often an idle worker checks for expired leases while other workers still hold some.
+POLL_INTERVAL = 10.0
+
+STATES = ("pending", "leased", "done", "dead")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    queue TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (queue, key)
+);
+CREATE INDEX IF NOT EXISTS ix_tasks_claim ON tasks (queue, state, available_at);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SQLiteQueue:
+    """
+    Work queue in a SQLite file shared by the workers of one host (or an NFS-free shared disk). Each call opens
+    its own connection, so the queue can be used from the heartbeat thread and from forked processes.
+    Claims run in `BEGIN IMMEDIATE` transactions, which serialises them between processes.
+    """
+
+    def __init__(self, path: str, name: str = "default", lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, retry_backoff: float = RETRY_BACKOFF):
+        self.path = path
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return _Closing(connection)
+
+    def enqueue(self, keys: list) -> int:
+        """
+        Adds the keys that are not queued yet; every worker can enqueue the same dataset. Returns how many were new.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO tasks (queue, key, updated_at) VALUES (?, ?, ?)",
+                                   [(self.name, str(key), now) for key in keys])
+            added = connection.total_changes - before
+            connection.execute("COMMIT")
+        return added
+
+    def _expire(self, connection, now: float):
+        # A lease that was not renewed means its worker died: retry the package, or give up after max_attempts.
+        connection.execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, owner = NULL, "
+            "lease_expires = NULL, last_error = 'lease expired', updated_at = ? "
+            "WHERE queue = ? AND state = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, self.name, now))
+
+    def claim(self, worker_id: str, count: int = 1) -> list:
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._expire(connection, now)
+            keys = [row[0] for row in connection.execute(
+                "SELECT key FROM tasks WHERE queue = ? AND state = 'pending' AND available_at <= ? "
+                "ORDER BY rowid LIMIT ?", (self.name, now, count))]
+            connection.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE queue = ? AND key = ?",
+                [(worker_id, now + self.lease_seconds, now, self.name, key) for key in keys])
+            connection.execute("COMMIT")
+        return keys
+
+    def heartbeat(self, worker_id: str, keys: list) -> int:
+        """
+        Renews the leases `worker_id` still holds on `keys`; returns how many it holds.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND state = 'leased' AND owner = ?",
+                [(now + self.lease_seconds, now, self.name, key, worker_id) for key in keys])
+            return connection.total_changes - before
+
+    def complete(self, worker_id: str, keys: list):
+        # A result was written, so the package is done even if its lease expired in the meantime.
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE tasks SET state = 'done', owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND state != 'done'",
+                [(now, self.name, key) for key in keys])
+
+    def fail(self, worker_id: str, keys: list, error: str):
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, "
+                "available_at = ? + ? * attempts, owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND state = 'leased' AND owner = ?",
+                [(self.max_attempts, now, self.retry_backoff, error[:1000], now, self.name, key, worker_id)
+                 for key in keys])
+
+    def counts(self) -> dict:
+        with self._connect() as connection:
+            counts = dict(connection.execute(
+                "SELECT state, count(*) FROM tasks WHERE queue = ? GROUP BY state", (self.name,)).fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def keys(self, state: str) -> list:
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(
+                "SELECT key FROM tasks WHERE queue = ? AND state = ? ORDER BY rowid", (self.name, state))]
+
+    def dead_letters(self) -> list:
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT key, attempts, last_error FROM tasks WHERE queue = ? AND state = 'dead' ORDER BY rowid",
+                (self.name,)).fetchall()
+
+    def requeue_dead(self) -> int:
+        with self._connect() as connection:
+            before = connection.total_changes
+            connection.execute("UPDATE tasks SET state = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                               "WHERE queue = ? AND state = 'dead'", (time.time(), self.name))
+            return connection.total_changes - before
+
+
+class _Closing:
+    """
+    `with` block that closes the connection (sqlite3's own context manager only ends the transaction).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None and self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+        self.connection.close()
+        return False
+
+
+# Redis layout of a queue `<prefix>`: pending and leased keys are sorted sets scored by availability and lease
+# expiry; attempts, owners and errors are hashes; done and dead are sets; `all` makes enqueueing idempotent.
+_REDIS_CLAIM = """
+local prefix, now, lease, max_attempts, count, owner = KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), ARGV[5]
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':leased', '-inf', now)) do
+    redis.call('ZREM', prefix .. ':leased', key)
+    redis.call('HDEL', prefix .. ':owners', key)
+    redis.call('HSET', prefix .. ':errors', key, 'lease expired')
+    if tonumber(redis.call('HGET', prefix .. ':attempts', key) or '0') >= max_attempts then
+        redis.call('SADD', prefix .. ':dead', key)
+    else
+        redis.call('ZADD', prefix .. ':pending', now, key)
+    end
+end
+local keys = redis.call('ZRANGEBYSCORE', prefix .. ':pending', '-inf', now, 'LIMIT', 0, count)
+for _, key in ipairs(keys) do
+    redis.call('ZREM', prefix .. ':pending', key)
+    redis.call('ZADD', prefix .. ':leased', now + lease, key)
+    redis.call('HSET', prefix .. ':owners', key, owner)
+    redis.call('HINCRBY', prefix .. ':attempts', key, 1)
+end
+return keys
+"""
+
+_REDIS_HEARTBEAT = """
+local prefix, expires, owner, held = KEYS[1], tonumber(ARGV[1]), ARGV[2], 0
+for i = 3, #ARGV do
+    if redis.call('HGET', prefix .. ':owners', ARGV[i]) == owner then
+        redis.call('ZADD', prefix .. ':leased', 'XX', expires, ARGV[i])
+        held = held + 1
+    end
+end
+return held
+"""
+
+_REDIS_COMPLETE = """
+local prefix = KEYS[1]
+for i = 1, #ARGV do
+    redis.call('ZREM', prefix .. ':leased', ARGV[i])
+    redis.call('ZREM', prefix .. ':pending', ARGV[i])
+    redis.call('HDEL', prefix .. ':owners', ARGV[i])
+    redis.call('SREM', prefix .. ':dead', ARGV[i])
+    redis.call('SADD', prefix .. ':done', ARGV[i])
+end
+return #ARGV
+"""
+
+_REDIS_FAIL = """
+local prefix, now, backoff, max_attempts, owner, error = KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4], ARGV[5]
+for i = 6, #ARGV do
+    local key = ARGV[i]
+    if redis.call('HGET', prefix .. ':owners', key) == owner then
+        redis.call('ZREM', prefix .. ':leased', key)
+        redis.call('HDEL', prefix .. ':owners', key)
+        redis.call('HSET', prefix .. ':errors', key, error)
+        local attempts = tonumber(redis.call('HGET', prefix .. ':attempts', key) or '0')
+        if attempts >= max_attempts then
+            redis.call('SADD', prefix .. ':dead', key)
+        else
+            redis.call('ZADD', prefix .. ':pending', now + backoff * attempts, key)
+        end
+    end
+end
+return 1
+"""
+
+
+class RedisQueue:
+    """
+    The same queue in Redis, for workers spread over several hosts. Claims, heartbeats and failures are
+    Lua scripts, so each of them is atomic.
+    """
+
+    def __init__(self, url: str, name: str = "default", lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, retry_backoff: float = RETRY_BACKOFF):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.name = name
+        self.prefix = f"mal-llm:queue:{name}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._claim = self.client.register_script(_REDIS_CLAIM)
+        self._heartbeat = self.client.register_script(_REDIS_HEARTBEAT)
+        self._complete = self.client.register_script(_REDIS_COMPLETE)
+        self._fail = self.client.register_script(_REDIS_FAIL)
+
+    def enqueue(self, keys: list) -> int:
+        pipeline = self.client.pipeline()
+        for key in keys:
+            pipeline.sadd(f"{self.prefix}:all", str(key))
+        added = [str(key) for key, new in zip(keys, pipeline.execute()) if new]
+        if added:
+            self.client.zadd(f"{self.prefix}:pending", {key: 0 for key in added})
+        return len(added)
+
+    def claim(self, worker_id: str, count: int = 1) -> list:
+        return self._claim(keys=[self.prefix], args=[time.time(), self.lease_seconds, self.max_attempts, count, worker_id])
+
+    def heartbeat(self, worker_id: str, keys: list) -> int:
+        return self._heartbeat(keys=[self.prefix], args=[time.time() + self.lease_seconds, worker_id, *keys])
+
+    def complete(self, worker_id: str, keys: list):
+        if keys:
+            self._complete(keys=[self.prefix], args=list(keys))
+
+    def fail(self, worker_id: str, keys: list, error: str):
+        if keys:
+            self._fail(keys=[self.prefix], args=[time.time(), self.retry_backoff, self.max_attempts, worker_id, error[:1000], *keys])
+
+    def counts(self) -> dict:
+        return {
+            "pending": self.client.zcard(f"{self.prefix}:pending"),
+            "leased": self.client.zcard(f"{self.prefix}:leased"),
+            "done": self.client.scard(f"{self.prefix}:done"),
+            "dead": self.client.scard(f"{self.prefix}:dead"),
+        }
+
+    def keys(self, state: str) -> list:
+        if state in ("pending", "leased"):
+            return self.client.zrange(f"{self.prefix}:{state}", 0, -1)
+        return sorted(self.client.smembers(f"{self.prefix}:{state}"))
+
+    def dead_letters(self) -> list:
+        keys = self.keys("dead")
+        attempts = self.client.hmget(f"{self.prefix}:attempts", keys) if keys else []
+        errors = self.client.hmget(f"{self.prefix}:errors", keys) if keys else []
+        return [(key, int(count or 0), error) for key, count, error in zip(keys, attempts, errors)]
+
+    def requeue_dead(self) -> int:
+        keys = self.keys("dead")
+        if keys:
+            pipeline = self.client.pipeline()
+            pipeline.srem(f"{self.prefix}:dead", *keys)
+            pipeline.hdel(f"{self.prefix}:attempts", *keys)
+            pipeline.zadd(f"{self.prefix}:pending", {key: 0 for key in keys})
+            pipeline.execute()
+        return len(keys)
+
+
+def open_queue(url: str, name: str = "default", **kwargs):
+    """
+    `sqlite:///path/queue.db` (or a plain path) or `redis://host:6379/0`.
+    """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url, name, **kwargs)
+    return SQLiteQueue(url.removeprefix("sqlite:///").removeprefix("sqlite://"), name, **kwargs)
+
+
+class Heartbeat:
+    """
+    Renews the leases of the claimed packages from a thread, so a blocking call on the event loop cannot
+    let them expire while the worker is alive.
+    """
+
+    def __init__(self, queue, worker_id: str, keys: list):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.keys = keys
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                if self.queue.heartbeat(self.worker_id, self.keys) < len(self.keys):
+                    print(f"⚠️ {self.worker_id} lost a lease; another worker may classify the same package")
+            except Exception as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+class QueueConfig:
+    """
+    The work queue the runner pulls its packages from, if any.
+    """
+
+    def __init__(self, queue=None, worker_id: str = None, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stats = {"claimed": 0, "done": 0, "failed": 0}
+
+
+_config = QueueConfig()
+
+
+def enabled() -> bool:
+    return _config.queue is not None
+
+
+def result_path(path):
+    """
+    `results.csv` -> `results.worker-<worker id>.csv` with a queue, so workers never append to the same file.
+    """
+    if path is None or not enabled():
+        return path
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.worker-{_config.worker_id}{path.suffix}"))
+
+
+async def run(test_dataset, classify, written, key_column: str = "package_name"):
+    """
+    Enqueues the dataset's packages, then repeatedly claims a batch, runs `await classify(rows)` on it and marks
+    the claimed packages that have a result as done; the others are retried, then dead-lettered. `written()` is
+    called once: it returns the set of keys with a result, which the runner adds to as it writes its rows.
+    Returns when nothing is pending or leased. Without --queue, classifies the whole dataset.
+    """
+    if not enabled():
+        await classify(test_dataset)
+        return
+    queue, worker_id = _config.queue, _config.worker_id
+    rows = {str(key): index for index, key in zip(test_dataset.index, test_dataset[key_column])}
+    added = queue.enqueue(list(rows))
+    done = written()
+    print(f"🚀 Worker {worker_id} on queue {queue.name}: {added} packages added, {queue.counts()}")
+    while True:
+        keys = queue.claim(worker_id, _config.batch_size)
+        if not keys:
+            counts = queue.counts()
+            if not counts["leased"] and not counts["pending"]:
+                break
+            # Other workers hold leases (or failed packages wait for their retry): wait for them to finish or expire.
+            await asyncio.sleep(_config.poll_interval)
+            continue
+        unknown = [key for key in keys if key not in rows]
+        if unknown:
+            queue.fail(worker_id, unknown, f"not in the dataset of worker {worker_id}")
+        keys = [key for key in keys if key in rows]
+        _config.stats["claimed"] += len(keys)
+        error = "no result written"
+        with Heartbeat(queue, worker_id, keys):
+            try:
+                await classify(test_dataset.loc[[rows[key] for key in keys]])
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        finished = [key for key in keys if key in done]
+        failed = [key for key in keys if key not in done]
+        queue.complete(worker_id, finished)
+        if failed:
+            queue.fail(worker_id, failed, error)
+        _config.stats["done"] += len(finished)
+        _config.stats["failed"] += len(failed)
+
+
+def print_summary():
+    if not enabled():
+        return
+    stats = _config.stats
+    print(f"Work queue: worker {_config.worker_id} claimed {stats['claimed']} packages, {stats['done']} done, "
+          f"{stats['failed']} failed; queue {_config.queue.counts()}")
+
+
+def merge(path, queue) -> dict:
+    """
+    Merges the per-worker result files of `path` into `path`, under the header of the first one, and checks them
+    against the queue: every done package must have a row, and pending, leased or dead packages are reported.
+    Worker files with different headers are not merged.
+    """
+    root = Path(path)
+    worker_files = sorted(glob.glob(str(root.with_name(f"{root.stem}.worker-*{root.suffix}"))))
+    header, mismatches = shards.check_headers(worker_files)
+    if header is None or mismatches:
+        for problem in mismatches:
+            print(f"⚠️ {problem}")
+        print(f"❌ Nothing merged into {path}: {'the worker headers differ' if mismatches else 'no worker file'}")
+        return {"packages": 0, "problems": mismatches or ["no worker file"]}
+    merged = {}
+    for worker_file in worker_files:
+        rows = shards.read_results(worker_file)
+        print(f"📂 {worker_file}: {len(rows)} packages")
+        merged.update(rows)
+    problems = []
+    missing = [key for key in queue.keys("done") if key not in merged]
+    if missing:
+        problems.append(f"{len(missing)} done packages have no result row, e.g. {missing[:5]}")
+    counts = queue.counts()
+    if counts["pending"] or counts["leased"]:
+        problems.append(f"{counts['pending']} packages pending and {counts['leased']} leased: the run is not finished")
+    for key, attempts, error in queue.dead_letters()[:20]:
+        problems.append(f"dead letter {key} after {attempts} attempts: {error}")
+    if counts["dead"] > 20:
+        problems.append(f"... {counts['dead'] - 20} more dead letters")
+    shards.write_results(path, header, merged)
+    for problem in problems:
+        print(f"⚠️ {problem}")
+    print(f"{'✅' if not problems else '❌'} Merged {len(merged)} packages into {path}; queue {counts}")
+    return {"packages": len(merged), "problems": problems}
+
+
+def add_arguments(parser):
+    """
+    Adds the work-queue options to an experiment's argument parser.
+    """
+    parser.add_argument("--queue", type=str, default=None,
+                        help="Pull packages from a shared work queue: sqlite:///path/queue.db or redis://host:6379/0.")
+    parser.add_argument("--queue_name", type=str, default=None,
+                        help="Name of the run in the queue (default: the result file name).")
+    parser.add_argument("--worker_id", type=str, default=None, help="Worker name (default: host-pid).")
+    parser.add_argument("--queue_batch", type=int, default=BATCH_SIZE, help="Packages claimed at once.")
+    parser.add_argument("--lease_seconds", type=float, default=LEASE_SECONDS,
+                        help="Lease of a claimed batch; renewed by heartbeats, re-queued when a worker dies.")
+    parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Claims of a package before it is dead-lettered.")
+
+
+def configure(url: str = None, name: str = "default", worker_id: str = None, batch_size: int = BATCH_SIZE,
+              lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS) -> QueueConfig:
+    global _config
+    queue = open_queue(url, name, lease_seconds=lease_seconds, max_attempts=max_attempts) if url else None
+    _config = QueueConfig(queue=queue, worker_id=worker_id, batch_size=batch_size)
+    return _config
+
+
+def configure_from_args(args, result_file) -> QueueConfig:
+    name = args.queue_name or (Path(result_file).name if result_file else "default")
+    return configure(args.queue, name, args.worker_id, args.queue_batch, args.lease_seconds, args.max_attempts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a work queue and merge the results of its workers.")
+    parser.add_argument("command", choices=["status", "requeue", "merge"])
+    parser.add_argument("--queue", required=True, help="sqlite:///path/queue.db or redis://host:6379/0.")
+    parser.add_argument("--queue_name", default=None, help="Name of the run (default: the result file name).")
+    parser.add_argument("--result_file", "-r", default=None, help="merge: result file passed to the workers with -r.")
+    args = parser.parse_args()
+    work_queue = open_queue(args.queue, args.queue_name or (Path(args.result_file).name if args.result_file else "default"))
+    if args.command == "status":
+        print(work_queue.counts())
+        for dead_key, dead_attempts, dead_error in work_queue.dead_letters():
+            print(f"💀 {dead_key} ({dead_attempts} attempts): {dead_error}")
+    elif args.command == "requeue":
+        print(f"✅ Re-queued {work_queue.requeue_dead()} dead letters")
+    else:
+        report = merge(args.result_file, work_queue)
+        raise SystemExit(1 if report["problems"] else 0)
@@ -0,0 +1,356 @@
+"""
+Tokenizes the fine-tuning CSVs once, packs the examples into rows of `--max_length` tokens and writes them as
+memory-mapped arrays, so a training session loads them instantly instead of tokenizing and padding each time:
+
+    python packed_dataset.py build --tokenizer meta-llama/Llama-3.1-8B       # data/packed/{train,validation}/
+    python packed_dataset.py validate
+    python packed_dataset.py report --batch_size 8
+
+In the notebook, `PackedDataset("data/packed/train")` gives rows of input_ids, labels and position_ids; the
+position ids restart at 0 for every example, which keeps attention inside each example with
+flash_attention_2. Building and validating needs no GPU.
+"""
+import json
+import time
+import bisect
+import hashlib
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+OUTPUT_DIR = DATA_DIR / "packed"
+SPLITS = ["train", "validation"]
+MAX_LENGTH = 2048
+
+TEXT_COLUMNS = ("text", "textual_description", "description", "code_description")
+LABEL_COLUMNS = ("label", "labels", "is_malicious")
+ANSWERS = {0: "benign", 1: "malicious"}
+# Prompt of each example; the answer (ANSWERS) and the end-of-sequence token follow it and are the only tokens trained on
+TEMPLATE = "Classify the following Python package, described by its code, as benign or malicious.\n\n{text}\n\nAnswer: "
+
+IGNORE_INDEX = -100
+FILES = {"tokens": "tokens.bin", "loss_mask": "loss_mask.bin", "rows": "rows.npy", "sequences": "sequences.npy", "meta": "meta.json"}
+
+
+class ByteTokenizer:
+    """
+    UTF-8 bytes as token ids, plus BOS and EOS: a stand-in to build and check the packing without downloading a model.
+    """
+
+    name_or_path = "bytes"
+    bos_token_id = 256
+    eos_token_id = 257
+    pad_token_id = 257
+    vocab_size = 258
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list:
+        return list(text.encode("utf-8"))
+
+    def decode(self, ids) -> str:
+        return bytes(int(i) for i in ids if i < 256).decode("utf-8", errors="replace")
+
+
+def load_tokenizer(name: str):
+    if name == "bytes":
+        return ByteTokenizer()
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name)
+
+
+def answer_of(label):
+    """
+    The answer of a label (0/1, true/false, benign/malicious), or None when it is missing or not one of these.
+    """
+    if isinstance(label, str):
+        label = label.strip().lower()
+        if label in ANSWERS.values():
+            return label
+        label = {"0": 0, "1": 1, "false": 0, "true": 1, "0.0": 0, "1.0": 1}.get(label)
+    if isinstance(label, (bool, np.bool_)):
+        return ANSWERS[int(label)]
+    if isinstance(label, (int, float, np.integer, np.floating)) and label in (0, 1):
+        return ANSWERS[int(label)]
+    return None
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenize(frame, tokenizer, max_length: int, template: str, text_column: str, label_column: str) -> tuple:
+    """
+    Returns (sequences, loss masks, CSV row of each sequence, truncated count, dropped count). A sequence is
+    BOS + prompt + answer + EOS; the text is cut so that the sequence fits in `max_length`, the template and the
+    answer are always kept. Rows without a valid label are dropped rather than trained on as either answer.
+    Without a label column, every token of BOS + text + EOS is trained on.
+    """
+    prefix, _, suffix = template.partition("{text}")
+    bos = [tokenizer.bos_token_id] if tokenizer.bos_token_id is not None else []
+    eos = [tokenizer.eos_token_id]
+    prefix_ids = tokenizer.encode(prefix, add_special_tokens=False) if label_column else []
+    suffix_ids = tokenizer.encode(suffix, add_special_tokens=False) if label_column else []
+    answers = {answer: tokenizer.encode(answer, add_special_tokens=False) for answer in ANSWERS.values()}
+    sequences, masks, source_rows, truncated, dropped = [], [], [], 0, 0
+    for position, (_, row) in enumerate(frame.iterrows()):
+        answer = answer_of(row[label_column]) if label_column else None
+        if label_column and answer is None:
+            dropped += 1
+            continue
+        text = row[text_column] if isinstance(row[text_column], str) else ""
+        text_ids = tokenizer.encode(text, add_special_tokens=False)
+        answer_ids = answers[answer] if label_column else []
+        budget = max_length - len(bos) - len(prefix_ids) - len(suffix_ids) - len(answer_ids) - len(eos)
+        if len(text_ids) > budget:
+            text_ids = text_ids[:max(0, budget)]
+            truncated += 1
+        prompt = bos + prefix_ids + text_ids + suffix_ids
+        sequences.append(prompt + answer_ids + eos)
+        source_rows.append(position)
+        if label_column:
+            masks.append([0] * len(prompt) + [1] * (len(answer_ids) + len(eos)))
+        else:
+            masks.append([0] * len(bos) + [1] * (len(text_ids) + len(eos)))
+    return sequences, masks, source_rows, truncated, dropped
+
+
+def pack(lengths: list, max_length: int) -> list:
+    """
+    Best-fit decreasing: each sequence, longest first, goes into the fullest row it still fits in.
+    Returns the rows as lists of sequence indices.
+    """
+    rows, free = [], []  # free: sorted (remaining capacity, row)
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        position = bisect.bisect_left(free, (lengths[index], -1))
+        if position < len(free):
+            remaining, row = free.pop(position)
+        else:
+            remaining, row = max_length, len(rows)
+            rows.append([])
+        rows[row].append(index)
+        bisect.insort(free, (remaining - lengths[index], row))
+    return rows
+
+
+def build_split(split: str, tokenizer, output_dir: Path, max_length: int = MAX_LENGTH, template: str = TEMPLATE,
+                text_column: str = None, label_column: str = None, seed: int = 0, data_dir=DATA_DIR) -> dict:
+    """
+    Writes `<output_dir>/<split>/`: the packed tokens and loss mask back to back (no padding stored), each row's
+    (offset, length), each sequence's (row, start in the row, length, CSV row), and meta.json.
+    """
+    import pandas as pd
+
+    source = Path(data_dir) / f"{split}.csv"
+    frame = pd.read_csv(source)
+    text_column = text_column or next((column for column in TEXT_COLUMNS if column in frame.columns), None)
+    if text_column is None:
+        raise ValueError(f"No text column in {source} (columns: {', '.join(frame.columns)}), use --text_column")
+    if label_column is None:
+        label_column = next((column for column in LABEL_COLUMNS if column in frame.columns), None)
+
+    start = time.perf_counter()
+    sequences, masks, source_rows, truncated, dropped = tokenize(frame, tokenizer, max_length, template, text_column, label_column)
+    tokenized = time.perf_counter() - start
+    lengths = [len(sequence) for sequence in sequences]
+    rows = pack(lengths, max_length)
+    # Rows come out of the packing sorted by their longest sequence; shuffle them so batches mix lengths
+    rows = [rows[i] for i in np.random.default_rng(seed).permutation(len(rows))]
+
+    vocab_size = max(len(tokenizer), tokenizer.vocab_size) if hasattr(tokenizer, "__len__") else tokenizer.vocab_size
+    dtype = np.uint16 if vocab_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+    split_dir = output_dir / split
+    split_dir.mkdir(parents=True, exist_ok=True)
+    tokens = np.memmap(split_dir / FILES["tokens"], dtype=dtype, mode="w+", shape=(max(1, sum(lengths)),))
+    loss_mask = np.memmap(split_dir / FILES["loss_mask"], dtype=np.uint8, mode="w+", shape=(max(1, sum(lengths)),))
+    row_index = np.zeros((len(rows), 2), dtype=np.int64)
+    sequence_index = np.zeros((len(sequences), 4), dtype=np.int64)
+    offset = 0
+    for row_number, members in enumerate(rows):
+        row_index[row_number] = (offset, sum(lengths[i] for i in members))
+        position = 0
+        for i in members:
+            tokens[offset + position:offset + position + lengths[i]] = sequences[i]
+            loss_mask[offset + position:offset + position + lengths[i]] = masks[i]
+            sequence_index[i] = (row_number, position, lengths[i], source_rows[i])
+            position += lengths[i]
+        offset += position
+    tokens.flush()
+    loss_mask.flush()
+    np.save(split_dir / FILES["rows"], row_index)
+    np.save(split_dir / FILES["sequences"], sequence_index)
+
+    meta = {
+        "split": split,
+        "source": str(source),
+        "source_sha256": file_digest(source),
+        "tokenizer": getattr(tokenizer, "name_or_path", str(tokenizer)),
+        "vocab_size": int(vocab_size),
+        "dtype": np.dtype(dtype).name,
+        "max_length": max_length,
+        "pad_token_id": int(tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id),
+        "eos_token_id": int(tokenizer.eos_token_id),
+        "template": template if label_column else None,
+        "text_column": text_column,
+        "label_column": label_column,
+        "source_rows": len(frame),
+        "examples": len(sequences),
+        "dropped": dropped,
+        "rows": len(rows),
+        "tokens": int(sum(lengths)),
+        "truncated": truncated,
+    }
+    with open(split_dir / FILES["meta"], "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=4)
+    if dropped:
+        print(f"⚠️ {split}: dropped {dropped} of {len(frame)} rows without a valid {label_column}")
+    print(f"✅ {split}: {len(sequences)} examples ({truncated} truncated), {sum(lengths)} tokens in {len(rows)} rows of "
+          f"{max_length}, tokenized in {tokenized:.1f}s -> {split_dir}")
+    return meta
+
+
+class PackedDataset:
+    """
+    The rows of a packed split, read from the memory-mapped files. Each item is a dict of `max_length` arrays:
+    input_ids (padded with the pad token), labels (IGNORE_INDEX outside the answers and on padding) and
+    position_ids (restarting at 0 for each example).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / FILES["meta"], "r", encoding="utf-8") as file:
+            self.meta = json.load(file)
+        self.tokens = np.memmap(self.path / FILES["tokens"], dtype=self.meta["dtype"], mode="r")
+        self.loss_mask = np.memmap(self.path / FILES["loss_mask"], dtype=np.uint8, mode="r")
+        self.rows = np.load(self.path / FILES["rows"])
+        self.sequences = np.load(self.path / FILES["sequences"])
+        # Sequences sorted by row, so a row's boundaries are one slice
+        self.order = np.lexsort((self.sequences[:, 1], self.sequences[:, 0]))
+        self.row_starts = np.searchsorted(self.sequences[self.order, 0], np.arange(len(self.rows) + 1))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def boundaries(self, index: int) -> np.ndarray:
+        """
+        (start in the row, length) of the examples packed in row `index`.
+        """
+        return self.sequences[self.order[self.row_starts[index]:self.row_starts[index + 1]]][:, 1:3]
+
+    def __getitem__(self, index: int) -> dict:
+        max_length = self.meta["max_length"]
+        offset, length = self.rows[index]
+        input_ids = np.full(max_length, self.meta["pad_token_id"], dtype=np.int64)
+        labels = np.full(max_length, IGNORE_INDEX, dtype=np.int64)
+        position_ids = np.arange(max_length, dtype=np.int64)
+        input_ids[:length] = self.tokens[offset:offset + length]
+        labels[:length] = np.where(self.loss_mask[offset:offset + length] == 1, input_ids[:length], IGNORE_INDEX)
+        for start, size in self.boundaries(index):
+            position_ids[start:start + size] = np.arange(size)
+        position_ids[length:] = np.arange(max_length - length)
+        return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+
+
+def collate(items: list) -> dict:
+    """
+    Stacks PackedDataset items into torch tensors, e.g. `Trainer(..., data_collator=collate)`.
+    """
+    import torch
+
+    return {key: torch.from_numpy(np.stack([item[key] for item in items])) for key in items[0]}
+
+
+def validate(path, tokenizer=None) -> bool:
+    """
+    Checks a packed split: the index covers the token file exactly, rows fit in max_length, token ids are in
+    the vocabulary, every example ends with EOS and is trained on, and the CSV has not changed since the build.
+    """
+    dataset = PackedDataset(path)
+    meta, problems = dataset.meta, []
+    offsets, lengths = dataset.rows[:, 0], dataset.rows[:, 1]
+    if len(offsets) and (offsets[0] != 0 or np.any(offsets[1:] != offsets[:-1] + lengths[:-1])):
+        problems.append("rows are not contiguous")
+    if int(lengths.sum()) != meta["tokens"] or lengths.max(initial=0) > meta["max_length"]:
+        problems.append("row lengths do not match meta.json or exceed max_length")
+    packed_rows = np.unique(dataset.sequences[:, 3])
+    if (len(dataset.sequences) != meta["examples"] or len(packed_rows) != meta["examples"]
+            or meta["examples"] + meta["dropped"] != meta["source_rows"] or packed_rows.max(initial=0) >= meta["source_rows"]):
+        problems.append("every CSV row with a label must be packed exactly once")
+    if meta["tokens"] and int(dataset.tokens[:meta["tokens"]].max()) >= meta["vocab_size"]:
+        problems.append("token ids beyond the vocabulary")
+    ends = dataset.rows[dataset.sequences[:, 0], 0] + dataset.sequences[:, 1] + dataset.sequences[:, 2] - 1
+    if len(ends) and np.any(dataset.tokens[ends] != meta["eos_token_id"]):
+        problems.append("examples not ending with EOS")
+    if len(ends) and np.any(dataset.loss_mask[ends] != 1):
+        problems.append("examples with no trained tokens")
+    if Path(meta["source"]).exists() and file_digest(Path(meta["source"])) != meta["source_sha256"]:
+        problems.append(f"{meta['source']} changed since the build, rebuild")
+    for problem in problems:
+        print(f"❌ {meta['split']}: {problem}")
+    if not problems:
+        print(f"✅ {meta['split']}: {meta['examples']} examples in {meta['rows']} rows are consistent")
+        if tokenizer is not None and len(dataset):
+            start, size = dataset.boundaries(0)[0]
+            offset = dataset.rows[0, 0] + start
+            print(f"🔍 First example of row 0:\n{tokenizer.decode(dataset.tokens[offset:offset + size])}")
+    return not problems
+
+
+def report(path, batch_size: int = 8):
+    """
+    Share of the tokens of a batch that are real tokens, padding to max_length, padding to the longest example
+    of each batch (in CSV order), and packed.
+    """
+    dataset = PackedDataset(path)
+    meta = dataset.meta
+    lengths = dataset.sequences[np.argsort(dataset.sequences[:, 3]), 2]
+    real, max_length = int(lengths.sum()), meta["max_length"]
+    longest = sum(int(lengths[i:i + batch_size].max()) * len(lengths[i:i + batch_size]) for i in range(0, len(lengths), batch_size))
+    print(f"{meta['split']}: {meta['examples']} examples, {real} tokens (mean {real / max(1, len(lengths)):.0f}, "
+          f"max {lengths.max(initial=0)}), max_length {max_length}")
+    print(f"  {'layout':<28}{'sequences':>10}{'padded tokens':>15}{'efficiency':>12}")
+    for name, count, padded in [("pad to max_length", len(lengths), len(lengths) * max_length),
+                                (f"pad to longest of {batch_size}", len(lengths), longest),
+                                ("packed", len(dataset), len(dataset) * max_length)]:
+        print(f"  {name:<28}{count:>10}{padded:>15}{100 * real / max(1, padded):>11.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-tokenized, packed, memory-mapped fine-tuning datasets.")
+    parser.add_argument("command", choices=["build", "validate", "report"])
+    parser.add_argument("--splits", nargs="+", default=SPLITS, choices=["train", "validation", "test"])
+    parser.add_argument("--data_dir", type=str, default=str(DATA_DIR), help="build: folder of the split CSVs.")
+    parser.add_argument("--output_dir", type=str, default=str(OUTPUT_DIR))
+    parser.add_argument("--tokenizer", type=str, default=None,
+                        help="Hugging Face tokenizer (e.g. meta-llama/Llama-3.1-8B), or `bytes` to try the packing without one.")
+    parser.add_argument("--max_length", type=int, default=MAX_LENGTH, help="build: tokens per packed row.")
+    parser.add_argument("--template", type=str, default=TEMPLATE, help="build: prompt of each example, with {text}.")
+    parser.add_argument("--text_column", type=str, default=None, help=f"build: default the first of {', '.join(TEXT_COLUMNS)}.")
+    parser.add_argument("--label_column", type=str, default=None,
+                        help=f"build: default the first of {', '.join(LABEL_COLUMNS)}; without one the whole text is trained on.")
+    parser.add_argument("--seed", type=int, default=0, help="build: order of the packed rows.")
+    parser.add_argument("--batch_size", type=int, default=8, help="report: batch size of the padding baselines.")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    if args.command == "build":
+        if not args.tokenizer:
+            parser.error("build needs --tokenizer")
+        tokenizer = load_tokenizer(args.tokenizer)
+        for split in args.splits:
+            build_split(split, tokenizer, output_dir, args.max_length, args.template, args.text_column, args.label_column,
+                        args.seed, args.data_dir)
+            report(output_dir / split, args.batch_size)
+    elif args.command == "validate":
+        tokenizer = load_tokenizer(args.tokenizer) if args.tokenizer else None
+        valid = [validate(output_dir / split, tokenizer) for split in args.splits]
+        raise SystemExit(0 if all(valid) else 1)
+    else:
+        for split in args.splits:
+            report(output_dir / split, args.batch_size)
@@ -0,0 +1,82 @@
+"""
+Single entry point for the experiments and tools:
+
+    python mal_llm.py <command> [options]      e.g. python mal_llm.py crag-code -r results.csv
+
+Nothing but this file is imported until a command is chosen; the command's script then imports what it needs,
+and the LLM clients, embeddings and vector stores are built on their first call (see common/lazy.py).
+"""
+import os
+import sys
+import runpy
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent
+
+# command: (kind, script path or module, description). Scripts run with their directory on sys.path, as
+# `python <script>` does; `cwd` commands also run from their directory, for the relative data paths they use.
+COMMANDS = {
+    "yara-rag": ("script", "RAG_experiments/Simple_RAG/simulate_yara_rag.py", "Simple_RAG with the YARA rules"),
+    "git-adv-rag": ("script", "RAG_experiments/Simple_RAG/simulate_git_adv_rag.py", "Simple_RAG with the GitHub advisories"),
+    "mal-code-rag": ("script", "RAG_experiments/Simple_RAG/simulate_mal_code_rag.py", "Simple_RAG with the malicious setup.py files"),
+    "crag-code": ("script", "RAG_experiments/CRAG/main_crag_code_flow.py", "CRAG on the setup.py code"),
+    "crag-ast": ("script", "RAG_experiments/CRAG/main_crag_ast_flow.py", "CRAG on the AST dataset"),
+    "zero-shot": ("script", "Zero_shot_baseline_llama3_1_8b/simulate_test.py", "Zero-shot baseline (Llama 3.1 8B / GPT)"),
+    "zsp": ("cwd", "zero_shot_prompting_baseline_package_classifier/main.py", "Zero-shot prompting package classifier (per file)"),
+    "serve": ("script", "RAG_experiments/CRAG/classification_service.py", "HTTP classification service (CRAG or Simple_RAG flow)"),
+    "check": ("script", "RAG_experiments/CRAG/classification_service.py", "Classify one setup.py and exit: check SETUP_PY [options]"),
+    "pack": ("script", "finetuning_experiments/packed_dataset.py", "Build, validate or report the packed fine-tuning datasets"),
+    "ingest": ("module", "common.ingest", "Convert sdists and wheels into structured package JSON"),
+    "corpus": ("module", "common.corpus", "Build or query a packed package corpus"),
+    "shards": ("module", "common.shards", "Merge the results of a sharded run"),
+    "queue": ("module", "common.workqueue", "Inspect a work queue and merge its workers' results"),
+    "lexical": ("module", "common.lexical", "Export knowledge-base collections for BM25"),
+    "quantized": ("module", "common.quantized", "Build and evaluate the quantized knowledge base"),
+    "snippets": ("module", "common.snippets", "Show the ranked snippet of a file"),
+    "distill": ("module", "common.distill", "Train the local relevance graders on logged LLM grader answers"),
+    "triage": ("module", "common.triage", "Train and evaluate the CPU triage model placed in front of the LLM"),
+    "typosquat": ("module", "common.typosquat", "Nearest popular PyPI name of package names"),
+    "traces": ("module", "common.tracing", "Summarise a JSONL trace"),
+}
+
+
+def usage_text() -> str:
+    lines = [__doc__.strip().splitlines()[2].strip(), "", "commands:"]
+    lines.extend(f"  {name:<14}{description}" for name, (_, _, description) in COMMANDS.items())
+    lines.append("\n`python mal_llm.py <command> --help` shows the options of a command.")
+    return "\n".join(lines)
+
+
+def run(command: str, argv: list):
+    kind, target, _ = COMMANDS[command]
+    if command == "check":
+        argv = ["--check", *argv]
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    if kind == "module":
+        sys.argv = [target, *argv]
+        runpy.run_module(target, run_name="__main__", alter_sys=True)
+        return
+    script = ROOT / target
+    sys.path.insert(0, str(script.parent))
+    if kind == "cwd":
+        os.chdir(script.parent)
+    sys.argv = [str(script), *argv]
+    runpy.run_path(str(script), run_name="__main__")
+
+
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage_text())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"❌ Unknown command {argv[0]!r}\n\n{usage_text()}", file=sys.stderr)
+        return 2
+    run(argv[0], argv[1:])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The tests import the shared helpers as the experiment scripts do: `from common import ...`
+sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,61 @@
+import json
+import asyncio
+
+import pytest
+
+from common import batch
+
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "verdict",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "result": {
+                    "type": "object",
+                    "properties": {"prediction": {"type": "boolean"}, "explanation": {"type": "string"}},
+                },
+            },
+        },
+    },
+}
+
+
+def requests(count: int) -> list:
+    return [batch.build_request(str(i), "model", [{"role": "user", "content": f"package {i}"}], RESPONSE_FORMAT)
+            for i in range(count)]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        batch.BatchBackend()
+
+
+def test_local_backend_submit_poll_download(tmp_path):
+    backend = batch.LocalBatchBackend(tmp_path / "backend")
+    [input_path] = batch.write_batch_files(requests(3), tmp_path / "batches")
+
+    batch_id = backend.submit(input_path)
+    assert backend.poll(batch_id) == "completed"
+    assert backend.poll("batch_unknown") == "failed"
+
+    results = batch.read_batch_results(backend.download(batch_id, tmp_path / "output.jsonl"))
+    assert set(results) == {"0", "1", "2"}
+    assert json.loads(results["0"]) == {"result": {"prediction": False, "explanation": "mock"}}
+
+
+def test_run_batch_collects_every_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "MAX_REQUESTS_PER_FILE", 2)
+    backend = batch.LocalBatchBackend(tmp_path / "backend", responder=lambda body: body["messages"][0]["content"])
+
+    results = asyncio.run(batch.run_batch(requests(5), tmp_path / "batches", backend, poll_interval=0))
+
+    assert results == {str(i): f"package {i}" for i in range(5)}
+    assert len(list((tmp_path / "batches").glob("batch_*_output.jsonl"))) == 3
+
+
+def test_canned_response_accepts_tgi_formats():
+    body = {"response_format": {"type": "json", "value": {"type": "object", "properties": {"grade": {"enum": ["yes", "no"]}}}}}
+    assert json.loads(batch.LocalBatchBackend.canned_response(body)) == {"grade": "yes"}
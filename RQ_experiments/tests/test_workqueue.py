@@ -0,0 +1,91 @@
+import time
+
+from common import workqueue
+
+
+LEASE = 0.1
+
+
+def queue(tmp_path, **kwargs) -> workqueue.SQLiteQueue:
+    options = dict(lease_seconds=LEASE, max_attempts=3, retry_backoff=0.0)
+    options.update(kwargs)
+    return workqueue.SQLiteQueue(str(tmp_path / "queue.db"), "test", **options)
+
+
+def test_enqueue_is_idempotent(tmp_path):
+    tasks = queue(tmp_path)
+    assert tasks.enqueue(["a", "b"]) == 2
+    assert tasks.enqueue(["b", "c"]) == 1
+    assert tasks.counts() == {"pending": 3, "leased": 0, "done": 0, "dead": 0}
+
+
+def test_a_lease_blocks_other_workers_until_it_expires(tmp_path):
+    tasks = queue(tmp_path)
+    tasks.enqueue(["a"])
+    assert tasks.claim("w1") == ["a"]
+    assert tasks.claim("w2") == []
+
+    time.sleep(LEASE * 1.5)
+    assert tasks.claim("w2") == ["a"]
+    # The first worker lost its lease: it can neither renew nor fail it
+    assert tasks.heartbeat("w1", ["a"]) == 0
+    tasks.fail("w1", ["a"], "late")
+    assert tasks.counts()["leased"] == 1
+
+
+def test_heartbeats_keep_the_lease(tmp_path):
+    tasks = queue(tmp_path)
+    tasks.enqueue(["a"])
+    tasks.claim("w1")
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert tasks.heartbeat("w1", ["a"]) == 1
+    assert tasks.claim("w2") == []
+
+
+def test_a_dead_workers_packages_are_reclaimed(tmp_path):
+    tasks = queue(tmp_path)
+    tasks.enqueue(["a", "b", "c"])
+    assert tasks.claim("dead", count=2) == ["a", "b"]
+    assert tasks.claim("alive") == ["c"]
+    tasks.complete("alive", ["c"])
+
+    time.sleep(LEASE * 1.5)
+    assert tasks.claim("alive", count=5) == ["a", "b"]
+    tasks.complete("alive", ["a", "b"])
+    assert tasks.counts() == {"pending": 0, "leased": 0, "done": 3, "dead": 0}
+
+
+def test_failed_packages_back_off(tmp_path):
+    tasks = queue(tmp_path, retry_backoff=0.3)
+    tasks.enqueue(["a"])
+    tasks.claim("w1")
+    tasks.fail("w1", ["a"], "rate limited")
+
+    # Backoff times the attempts: 0.3 s after the first failure
+    assert tasks.claim("w1") == []
+    time.sleep(0.35)
+    assert tasks.claim("w1") == ["a"]
+    tasks.fail("w1", ["a"], "rate limited")
+
+    # 0.6 s after the second one
+    time.sleep(0.35)
+    assert tasks.claim("w1") == []
+    time.sleep(0.35)
+    assert tasks.claim("w1") == ["a"]
+
+
+def test_packages_go_to_the_dead_letters_after_max_attempts(tmp_path):
+    tasks = queue(tmp_path, max_attempts=2)
+    tasks.enqueue(["failing", "expiring"])
+    for _ in range(2):
+        assert tasks.claim("w1", count=2) == ["failing", "expiring"]
+        tasks.fail("w1", ["failing"], "ValueError: bad answer")
+        time.sleep(LEASE * 1.5)
+
+    assert tasks.claim("w1", count=2) == []
+    assert tasks.dead_letters() == [("failing", 2, "ValueError: bad answer"), ("expiring", 2, "lease expired")]
+    assert tasks.counts()["dead"] == 2
+
+    assert tasks.requeue_dead() == 2
+    assert tasks.claim("w1", count=2) == ["failing", "expiring"]
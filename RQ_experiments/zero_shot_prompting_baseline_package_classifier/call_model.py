@@ -2,11 +2,13 @@ import os
 import json
 import dotenv
 import asyncio
-from openai import OpenAI
-from huggingface_hub import InferenceClient
-from huggingface_hub import AsyncInferenceClient
+import sys
+from pathlib import Path
 
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common import lazy, usage
+
 dotenv.load_dotenv()
 
 
@@ -25,11 +27,11 @@ class LLM:
 
         if "gpt" in model:  # OpenAI model detection
             self.USE_HUGGINGFACE = False
-            self.llm = OpenAI(api_key=self.API_KEY)
+            self.llm = lazy.openai_client(self.API_KEY)
         else:  # Hugging Face model detection (LLaMA-3 or other instruct models)
 
             self.USE_HUGGINGFACE = True
-            self.llm  = AsyncInferenceClient(api_key=self.API_KEY)
+            self.llm = lazy.hugging_face_client(self.API_KEY)
             
           
     def convert_json_schema(self,original_schema):
@@ -70,30 +72,35 @@ class LLM:
         
         return converted_schema
           
-    async def call_llm(self, prompt, response_format) -> str:
+    async def call_llm(self, prompt, response_format, stage="classify", max_tokens=500) -> str:
         """
         Calls the selected LLM model API (Hugging Face for text generation or OpenAI GPT for chat completion).
+        The call runs under the deadline and token budget configured for `stage`.
+        `max_tokens` is lowered for verdict-only answers.
         """
         try:
             if self.USE_HUGGINGFACE:
                 # ✅ Use chat_completion() for instruct models
                 grammer =self.convert_json_schema(response_format)
-                stream = await self.llm.chat_completion(messages=prompt, model=self.LLM_MODEL, max_tokens=500,
-                                                    response_format=grammer)
+                stream = await usage.metered_call(stage, self.LLM_MODEL, prompt, max_tokens, lambda messages, model: self.llm.chat_completion(
+                    messages=messages, model=model, max_tokens=max_tokens, response_format=grammer))
                 response = stream.choices[0].message.content
                 return response
     
             else:
                 # ✅ OpenAI chat model
                 
-                stream = await self.llm.chat.completions.create(model='gpt-4o-mini',messages =prompt,
-                                                          response_format= response_format)
+                stream = await usage.metered_call(stage, self.LLM_MODEL, prompt, max_tokens, lambda messages, model: self.llm.chat.completions.create(
+                    model=model, messages=messages, max_tokens=max_tokens, response_format=response_format))
                 
                 response = stream.choices[0].message.content
                 
 
 
             return response 
+        except usage.BudgetExceeded:
+            # Under --budget_policy skip the package is left unwritten, so a resumed run or the queue retries it
+            raise
         except Exception as e:
             print(f" LLM API Error: {e}")
             return "Error in LLM inference."
@@ -1,32 +1,35 @@
-from langchain_core.messages import (
-    HumanMessage,
-    SystemMessage,
-)
+import sys
+from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common import prompts
 
 
-def generate_zeroshot_file_analysis_prompt(file_name, file_content):
-    """
-    Generates a structured prompt for LLM analysis of an individual file.
-    """
-    messages=[
-        {
-            "role": "developer", 
-            "content": f"You are a cybersecurity expert analyzing potential malware. \
-    Read the file content in {file_name} below and determine if it is Malicious or Benign. \
+
+FILE_ANALYSIS_PROMPT = prompts.PromptTemplate("zsp_file", [
+    {
+        "role": "developer", 
+        "content": "You are a cybersecurity expert analyzing potential malware. \
+    Read the file content below and determine if it is Malicious or Benign. \
     Explain your decision in detail. \
     Answer in this format: \
     - **Predicted Classification**: (Malicious or Benign) \
     - **Malicious Score**: (0-100, where 100 means highly malicious) \
     - **Explanation**: (Brief description of why is it classified this way in two sentences?)"
-        },
+    },
+])
+
+
+def generate_zeroshot_file_analysis_prompt(file_name, file_content):
+    """
+    Generates a structured prompt for LLM analysis of an individual file.
+    """
+    return FILE_ANALYSIS_PROMPT.render(
         {
             "role": "user", 
-            "content": f"file content: {file_content}"
+            "content": f"file name: {file_name}\nfile content: {file_content}"
         }
-    ] 
-
-    return messages
+    )
 
 
 def generate_overall_analysis_prompt(malicious_count, benign_count, avg_malicious_score,package_info):
@@ -1,16 +1,40 @@
 import json
 import os
 import asyncio
+import argparse
 import dotenv
+import pandas as pd
 from pathlib import Path
-from zeroshot_classifiers import classify_files  # Import the function directly
+from zeroshot_classifiers import classify_files, explain_files  # Import the functions directly
+from common import corpus, dedupe, explanations, hedging, prompts, shards, tracing, usage, workqueue
 
 dotenv.load_dotenv()
 
+parser = argparse.ArgumentParser(description="Run the zero-shot prompting baseline package classifier.")
+hedging.add_arguments(parser)
+tracing.add_arguments(parser)
+usage.add_arguments(parser)
+explanations.add_arguments(parser)
+dedupe.add_arguments(parser)
+shards.add_arguments(parser)
+workqueue.add_arguments(parser)
+parser.add_argument("--corpus", type=str, default=None,
+                    help="Read the packages from a packed corpus (python -m common.corpus build) instead of the JSON tree.")
+args = parser.parse_args()
+if args.queue and (args.shard[1] > 1 or args.dedupe):
+    parser.error("--queue replaces --shard and cannot be combined with --dedupe")
+shards.configure_from_args(args)
+hedging.configure_from_args(args)
+tracing.configure_from_args(args)
+usage.configure_from_args(args)
+dedupe.configure_from_args(args)
+
 # Define root directory
 package_dir = Path("../data/structured_output_plain/sample_packages")
 results_dir = Path("../Results/zero_shot_prompting_baseline_package_classifier/llama-3.3-70B-Instruct")  # Change to "gpt-4o" if using OpenAI
 log_file_path = Path("../processed_files_log.txt") # Log file to keep track of processed packages
+workqueue.configure_from_args(args, results_dir)
+explanations.configure_from_args(args, workqueue.result_path(shards.result_path(results_dir / "verdicts.csv")))
 
 # Define Model and API Key
 MODEL_NAME = "meta-llama/Llama-3.3-70B-Instruct"  # Change to "gpt-4o" if using OpenAI
@@ -20,46 +44,91 @@ API_KEY = os.getenv("HUGGING_FACE_KEY")  # Fetch API key chane to "OPENAI_API_KE
 if not API_KEY:
     raise ValueError("API Key not found! Set OPENAI_API_KEY in the environment.")
 
-# Get all JSON files in the root directory and subdirectories
-mal_packages_files = sorted(list(package_dir.rglob("*.json")))  # ✅ Enforce sorted order
+# Get all JSON files in the root directory and subdirectories, or the keys of the packed corpus
+package_corpus = corpus.Corpus(args.corpus) if args.corpus else None
+if package_corpus is not None:
+    mal_packages_files = [package_dir / key for key in package_corpus.keys()]  # ✅ Stored in sorted order
+else:
+    mal_packages_files = sorted(list(package_dir.rglob("*.json")))  # ✅ Enforce sorted order
+# Each package writes its own result JSON, so shards only need disjoint package lists
+mal_packages_files = shards.select_paths(mal_packages_files)
 
-# Get already processed files
-processed_files = set()
 
-async def process_files():
-    for root, dirs, files in os.walk(results_dir):
-        for file in files:
-            processed_files.add(Path(root) / file)
+def load_files_data(mal_package):
+    """
+    The `{filename: {content, file path}}` data of a package, from the packed corpus or its JSON file.
+    """
+    if package_corpus is not None:
+        return package_corpus[mal_package.relative_to(package_dir).as_posix()]
+    with open(mal_package, "r", encoding="utf-8") as file:
+        return json.load(file)
 
-    print(f"📂 Total JSON files found: {len(mal_packages_files)}")
+# Get already processed files: walked once, then added to as packages are processed
+processed_files = None
+# Names of the packages with a result JSON, for the work queue
+written_packages = None
 
-    for mal_package in mal_packages_files:
+
+def load_processed_files() -> set:
+    global processed_files
+    if processed_files is None:
+        processed_files = {Path(root) / file for root, dirs, files in os.walk(results_dir) for file in files}
+    return processed_files
+
+
+def load_written_packages() -> set:
+    global written_packages
+    if written_packages is None:
+        written_packages = {path.parent.name for path in load_processed_files() if path.suffix == ".json"}
+    return written_packages
+
+
+async def process_files(package_files):
+    processed = load_processed_files()
+
+    print(f"📂 Total JSON files found: {len(package_files)}")
+
+    for mal_package in package_files:
         relative_path = mal_package.relative_to(package_dir)
         result_file = results_dir / relative_path
 
-        if result_file in processed_files:
+        if result_file in processed:
             print(f"⚠️ Skipping already processed file: {mal_package.name}")
             continue
 
         print(f'🚀 Processing package: {mal_package.name}')
 
         try:
-            with open(mal_package, "r", encoding="utf-8") as file:
-                files_data = json.load(file)
-
-            # Debugging: Print order of files before classification
-            print(f"🔍 Processing file: {mal_package.name}")
-
-            # Run classification sequentially
-            result = await classify_files(files_data, MODEL_NAME, API_KEY)
-
-            # Ensure directory exists
-            result_dir = result_file.parent
-            result_dir.mkdir(parents=True, exist_ok=True)  
-
-            # Save results
-            with open(result_file, "w", encoding="utf-8") as json_file:
-                json.dump(result, json_file, indent=4, ensure_ascii=False)
+            with tracing.span("package", package_name=mal_package.parent.name), usage.package(mal_package.parent.name):
+                with tracing.span("load"):
+                    files_data = load_files_data(mal_package)
+
+                # Debugging: Print order of files before classification
+                print(f"🔍 Processing file: {mal_package.name}")
+
+                # Run classification sequentially
+                result = await classify_files(files_data, MODEL_NAME, API_KEY, verdict_only=explanations.enabled())
+
+                # Ensure directory exists
+                result_dir = result_file.parent
+                result_dir.mkdir(parents=True, exist_ok=True)  
+
+                # Save results
+                with tracing.span("write"):
+                    with open(result_file, "w", encoding="utf-8") as json_file:
+                        json.dump(result, json_file, indent=4, ensure_ascii=False)
+                processed.add(result_file)
+                if written_packages is not None:
+                    written_packages.add(mal_package.parent.name)
+
+                if explanations.enabled():
+                    async def explain(files_data=files_data, result=result, result_file=result_file):
+                        # Only the overall call is made again, from the per-file verdicts already in the result
+                        explained = await explain_files(files_data, result, MODEL_NAME, API_KEY)
+                        with open(result_file, "w", encoding="utf-8") as json_file:
+                            json.dump(explained, json_file, indent=4, ensure_ascii=False)
+                        return explained["overall_explanation"]
+                    explanations.submit(mal_package.parent.name, result["overall_prediction"], explain)
 
             # Update the log file
             with open(log_file_path, "a", encoding="utf-8") as log_file:
@@ -73,6 +142,75 @@ async def process_files():
             print(f"❌ Error processing {mal_package.name}: {e}")
         finally:
             print(f"Finished processing package: {mal_package.name}")
-            
+
+    await explanations.drain()
+
+
+def load_packages() -> pd.DataFrame:
+    """
+    One row per package with its file contents and paths, for the near-duplicate clustering.
+    """
+    rows = []
+    for mal_package in mal_packages_files:
+        try:
+            files_data = load_files_data(mal_package)
+        except (OSError, json.JSONDecodeError, KeyError):
+            files_data = {}
+        rows.append({
+            "package_name": mal_package.parent.name,
+            "content": "\n".join(str(info.get("content", "")) for info in files_data.values()),
+            "file_list": [info.get("file path", name) for name, info in files_data.items()],
+            "path": mal_package,
+        })
+    return pd.DataFrame(rows)
+
+
+def read_verdicts() -> dict:
+    verdicts = {}
+    for result_file in results_dir.rglob("*.json"):
+        try:
+            with open(result_file, "r", encoding="utf-8") as file:
+                result = json.load(file)
+            verdicts[result_file.parent.name] = (result["overall_prediction"], result.get("overall_explanation", ""))
+        except (OSError, json.JSONDecodeError, KeyError, TypeError):
+            continue
+    return verdicts
+
+
+async def main():
+    if workqueue.enabled():
+        # Package names and paths only: a claimed batch loads its files in process_files
+        packages = pd.DataFrame({"package_name": [path.parent.name for path in mal_packages_files], "path": mal_packages_files})
+        await workqueue.run(packages, lambda rows: process_files(list(rows["path"])), load_written_packages)
+        return
+    if not dedupe.enabled():
+        await process_files(mal_packages_files)
+        return
+    packages = load_packages()
+    paths = dict(zip(packages["package_name"], packages["path"]))
+
+    async def write_propagated(row, representative, prediction, explanation):
+        # Copy the representative's result, per-file analyses included
+        with open(results_dir / paths[representative].relative_to(package_dir), "r", encoding="utf-8") as file:
+            result = json.load(file)
+        result["overall_explanation"] = explanation
+        result["propagated_from"] = representative
+        result_file = results_dir / row["path"].relative_to(package_dir)
+        result_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(result_file, "w", encoding="utf-8") as json_file:
+            json.dump(result, json_file, indent=4, ensure_ascii=False)
+        with open(log_file_path, "a", encoding="utf-8") as log_file:
+            log_file.write(f"{row['path'].relative_to(package_dir)}\n")
+
+    await dedupe.run(packages, lambda rows: process_files(list(rows["path"])), write_propagated, read_verdicts,
+                     text_column="content")
+
 # Run the async function
-asyncio.run(process_files())
+if __name__ == "__main__":
+    asyncio.run(main())
+    tracing.print_summary()
+    usage.print_summary()
+    prompts.print_summary(MODEL_NAME)
+    explanations.print_summary()
+    dedupe.print_summary()
+    workqueue.print_summary()
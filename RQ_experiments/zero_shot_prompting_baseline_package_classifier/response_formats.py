@@ -1,3 +1,6 @@
+from common import explanations
+
+
 RESPONSE_FORMAT = {
     "type": "json_schema",
     "json_schema": {
@@ -74,4 +77,9 @@ OVERALL_RESPONSE_FORMAT = {
             "additionalProperties": False
         }
     }
-}
\ No newline at end of file
+}
+
+
+# Same schemas without the explanations, for --verdict_only
+VERDICT_RESPONSE_FORMAT = explanations.verdict_only_format(RESPONSE_FORMAT)
+OVERALL_VERDICT_RESPONSE_FORMAT = explanations.verdict_only_format(OVERALL_RESPONSE_FORMAT)
@@ -3,6 +3,7 @@ import asyncio
 import generate_prompt as gp
 import response_formats as rf
 from call_model import LLM
+from common import explanations
 from typing import Dict, Any
 
 class FileAnalyzer:
@@ -12,12 +13,17 @@ class FileAnalyzer:
         """
         self.llm = LLM(model, api_key)
 
-    async def analyze_file(self, file_name: str, file_content: str) -> Dict[str, Any]:
+    async def analyze_file(self, file_name: str, file_content: str, verdict_only: bool = False) -> Dict[str, Any]:
         """
         Uses LLM to analyze whether a file is malicious and provides a detailed explanation.
+        With `verdict_only`, only the classification and score are asked for.
         """
         prompt = gp.generate_zeroshot_file_analysis_prompt(file_name, file_content)
-        result_text = await self.llm.call_llm(prompt,rf.RESPONSE_FORMAT)
+        if verdict_only:
+            result_text = await self.llm.call_llm(prompt, rf.VERDICT_RESPONSE_FORMAT, stage="file",
+                                                  max_tokens=explanations.verdict_max_tokens())
+        else:
+            result_text = await self.llm.call_llm(prompt, rf.RESPONSE_FORMAT, stage="file")
 
         try:
             # ✅ Convert string response to a dictionary
@@ -26,11 +32,11 @@ class FileAnalyzer:
             if self.llm.USE_HUGGINGFACE:
                 classification = result_json["Predicted Classification"]
                 score = result_json["Malicious Score"]
-                explanation = result_json["Explanation"]
+                explanation = result_json.get("Explanation", "")
             else:
                 classification = result_json['result']["Predicted Classification"]
                 score = result_json['result']["Malicious Score"]
-                explanation = result_json['result']["Explanation"]
+                explanation = result_json['result'].get("Explanation", "")
 
             return {"classification": classification, "score": score, "explanation": explanation}
         
@@ -38,17 +44,16 @@ class FileAnalyzer:
             print(f"❌ JSON Parsing Error: {e}")
             return {"classification": "Unknown", "score": 0, "explanation": "Error parsing response."}
 
-async def classify_files(files_data: Dict[str, Dict[str, str]], model: str, api_key: str) -> Dict[str, Any]:
+async def classify_files(files_data: Dict[str, Dict[str, str]], model: str, api_key: str, verdict_only: bool = False) -> Dict[str, Any]:
     """
     Processes multiple files, assigns a classification, and determines an overall package risk assessment.
+    With `verdict_only`, every call asks for the classification and score without an explanation.
     """
     analyzer = FileAnalyzer(model=model, api_key=api_key)
     results = {}
-    malicious_count, benign_count, total_score = 0, 0, 0
-    package_info = ""
     for filename, file_info in files_data.items():
         content = file_info["content"]
-        analysis_result = await analyzer.analyze_file(filename, content)
+        analysis_result = await analyzer.analyze_file(filename, content, verdict_only=verdict_only)
 
         # ✅ Ensure results match the required schema
         results[filename] = {
@@ -60,17 +65,44 @@ async def classify_files(files_data: Dict[str, Dict[str, str]], model: str, api_
             }
         }
 
+    results.update(await analyze_overall(analyzer.llm, files_data, results, verdict_only=verdict_only))
+    return results
+
+
+async def explain_files(files_data: Dict[str, Dict[str, str]], results: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+    """
+    Adds the overall explanation to a verdict-only result with a single call, reusing its per-file analyses.
+    The verdict and score of the verdict pass are kept.
+    """
+    analyzer = FileAnalyzer(model=model, api_key=api_key)
+    overall = await analyze_overall(analyzer.llm, files_data, results, stage="explain")
+    results["overall_explanation"] = overall["overall_explanation"]
+    return results
+
+
+async def analyze_overall(llm: LLM, files_data: Dict[str, Dict[str, str]], results: Dict[str, Any],
+                          verdict_only: bool = False, stage: str = "overall") -> Dict[str, Any]:
+    """
+    Asks for the overall package assessment from the per-file `results` and returns its overall_* fields.
+    """
+    malicious_count, benign_count, total_score = 0, 0, 0
+    package_info = ""
+    for filename, file_info in files_data.items():
+        file_result = results[filename]["result"]
+
         # ✅ Generate a formatted package report
         package_info += (
             f"File {results[filename]['filename']} in {file_info['file path']}, "
-            f"was predicted as {results[filename]['result']['Predicted Classification']}, "
-            f"with a malicious score of {results[filename]['result']['Malicious Score']}, "
-            f"based on the following reasons: {results[filename]['result']['Explanation']}.\n"
+            f"was predicted as {file_result['Predicted Classification']}, "
+            f"with a malicious score of {file_result['Malicious Score']}"
         )
+        if file_result["Explanation"]:
+            package_info += f", based on the following reasons: {file_result['Explanation']}"
+        package_info += ".\n"
 
         # ✅ Update counters for malicious and benign files
-        total_score += analysis_result["score"]
-        if analysis_result["classification"] == "Malicious":
+        total_score += file_result["Malicious Score"]
+        if file_result["Predicted Classification"] == "Malicious":
             malicious_count += 1
         else:
             benign_count += 1
@@ -78,30 +110,27 @@ async def classify_files(files_data: Dict[str, Dict[str, str]], model: str, api_
     # ✅ Compute the average malicious score
     avg_malicious_score = total_score / len(files_data)
 
-        
     overall_prompt = gp.generate_overall_analysis_prompt(malicious_count, benign_count, avg_malicious_score,package_info)
-    overall_result_text = await analyzer.llm.call_llm(overall_prompt, rf.OVERALL_RESPONSE_FORMAT)
+    if verdict_only:
+        overall_result_text = await llm.call_llm(overall_prompt, rf.OVERALL_VERDICT_RESPONSE_FORMAT, stage=stage,
+                                                 max_tokens=explanations.verdict_max_tokens())
+    else:
+        overall_result_text = await llm.call_llm(overall_prompt, rf.OVERALL_RESPONSE_FORMAT, stage=stage)
     try:
-        
-        
-        
         # ✅ Convert overall response to dictionary
         overall_result = json.loads(overall_result_text)
-        if analyzer.llm.USE_HUGGINGFACE:
-            results["overall_prediction"] = overall_result["overall Classification"]
-            results["overall_malicious_score"] = overall_result["overall Malicious Score"]
-            results["overall_explanation"] = overall_result["overall Explanation"]
-        else:
-            results["overall_prediction"] = overall_result['result']["overall Classification"]
-            results["overall_malicious_score"] = overall_result['result']["overall Malicious Score"]
-            results["overall_explanation"] = overall_result['result']["overall Explanation"]
+        if not llm.USE_HUGGINGFACE:
+            overall_result = overall_result['result']
+        return {
+            "overall_prediction": overall_result["overall Classification"],
+            "overall_malicious_score": overall_result["overall Malicious Score"],
+            "overall_explanation": overall_result.get("overall Explanation", ""),
+        }
 
     except json.JSONDecodeError as e:
         print(f"❌ JSON Parsing Error: {e}")
-        results["overall_prediction"] = "Unknown"
-        results["overall_malicious_score"] = 0
-        results["overall_explanation"] = "Error parsing overall response."
-
-    return results
-
-
+        return {
+            "overall_prediction": "Unknown",
+            "overall_malicious_score": 0,
+            "overall_explanation": "Error parsing overall response.",
+        }